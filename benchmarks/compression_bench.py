@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Compression benchmark - bytes on the wire and CPU cost per endpoint
+Runs the app in-process against a copy of the database, fetches each
+endpoint with and without compression and reports the transfer size and
+the CPU time spent compressing every response.
+
+Usage: python benchmarks/compression_bench.py [--db teacher_app_web.db] [--json results.json]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_ENDPOINTS = [
+    '/api/get_classes',
+    '/api/get_students',
+    '/api/get_subjects',
+    '/api/get_organizations',
+    '/api/get_resources',
+    '/api/get_discussions',
+    '/api/get_global_discussions',
+    '/api/get_announcements',
+    '/api/get_organization_members/{org_id}',
+    '/dashboard',
+    '/resources',
+    '/global-discussions',
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Measure response compression per endpoint')
+    parser.add_argument('--db', default=os.path.join(ROOT, 'teacher_app_web.db'),
+                        help='SQLite database to copy and benchmark against')
+    parser.add_argument('--username', default='teacher')
+    parser.add_argument('--password', default='teacher123')
+    parser.add_argument('--iterations', type=int, default=20,
+                        help='compressions per endpoint and encoding when timing CPU')
+    parser.add_argument('--endpoint', action='append', dest='endpoints',
+                        help='endpoint to benchmark (repeatable); {org_id} is filled in')
+    parser.add_argument('--json', help='also write the results to this file')
+    return parser.parse_args()
+
+
+def cpu_ms(compress, body, iterations):
+    """Average CPU milliseconds for one compression of body"""
+    start = time.process_time()
+    for _ in range(iterations):
+        compress(body)
+    return (time.process_time() - start) * 1000 / iterations
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix='staffroom-bench-')
+    shutil.copy(args.db, os.path.join(workdir, 'bench.db'))
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    os.environ['QUERY_CACHE_PATH'] = os.path.join(workdir, 'query_cache.db')
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+
+    try:
+        import web_app
+
+        compression = web_app.compression
+        client = web_app.app.test_client()
+        login = client.post('/api/login', json={'username': args.username, 'password': args.password})
+        if login.status_code != 200:
+            print(f"Login failed for {args.username}: {login.status_code}")
+            return 1
+        with client.session_transaction() as session:
+            org_id = session.get('current_org_id')
+
+        encodings = compression.encodings()
+        results = []
+        for endpoint in args.endpoints or DEFAULT_ENDPOINTS:
+            path = endpoint.format(org_id=org_id)
+            plain = client.get(path, headers={'Accept-Encoding': 'identity'})
+            body = plain.get_data()
+            result = {
+                'endpoint': path,
+                'status': plain.status_code,
+                'content_type': plain.mimetype,
+                'identity_bytes': len(body),
+            }
+            for encoding in encodings:
+                response = client.get(path, headers={'Accept-Encoding': encoding})
+                wire = response.get_data()
+                result[f'{encoding}_bytes'] = len(wire)
+                result[f'{encoding}_encoded'] = response.headers.get('Content-Encoding') == encoding
+                result[f'{encoding}_cpu_ms'] = round(
+                    cpu_ms(lambda b: compression.compress(b, encoding), body, args.iterations), 3)
+            results.append(result)
+
+        header = f"{'endpoint':42} {'status':>6} {'identity':>10}"
+        for encoding in encodings:
+            header += f" {encoding:>10} {'ratio':>6} {'cpu ms':>8}"
+        print(header)
+        for result in results:
+            line = f"{result['endpoint']:42} {result['status']:>6} {result['identity_bytes']:>10}"
+            for encoding in encodings:
+                size = result[f'{encoding}_bytes']
+                ratio = size / result['identity_bytes'] if result['identity_bytes'] else 1.0
+                marker = '' if result[f'{encoding}_encoded'] else '*'
+                line += f" {str(size) + marker:>10} {ratio:>6.2f} {result[f'{encoding}_cpu_ms']:>8.3f}"
+            print(line)
+        print("* sent uncompressed (below the size threshold or not a compressible type)")
+
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump({'encodings': encodings, 'min_size': compression.min_size, 'results': results}, f, indent=2)
+        return 0
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
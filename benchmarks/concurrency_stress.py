@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+Multi-worker SQLite concurrency stress suite
+Runs the real handlers the way gunicorn does: N worker processes, each with
+M threads, all against one SQLite file. Every thread is a logged-in teacher
+(and a student of the same organization) issuing a mixed stream of reads
+(dashboard, resources, discussions, attendance) and writes (attendance
+marking, discussion replies, assignment submissions) as fast as it can.
+
+Each combination of journal mode, writer queue (web/writer.py, WAL only),
+busy timeout and process count is run for --duration seconds on a fresh
+copy of the synthetic dataset and reports:
+
+- throughput (requests and writes per second)
+- error rate: 5xx responses and requests that hit "database is locked"
+- read and write latency percentiles
+- lock wait: database time per request above the same route's median in an
+  uncontended single-thread run of the same journal mode
+
+and finally the largest configuration that stays within --max-error-rate
+and --max-p95, as a starting point for sizing workers.
+
+Usage: python benchmarks/concurrency_stress.py [--scale tiny] [--processes 1,2,4] [--threads 4]
+                                               [--journal-modes delete,wal] [--writer-modes off,on]
+                                               [--busy-timeouts 0,100,5000] [--write-share 1.0]
+                                               [--duration 10] [--json report.json]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from route_bench import build_request, git_revision, percentile, user_context
+from synthetic import add_scale_arguments, ensure_dataset, scale_overrides
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+READ_ROUTES = ('dashboard', 'get_resources', 'get_discussions', 'discussion_details', 'attendance_percentage')
+WRITE_ROUTES = ('mark_attendance', 'add_reply', 'submit_assignment')
+
+STARTUP_TIMEOUT = 120
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Stress SQLite with concurrent worker processes and threads')
+    add_scale_arguments(parser)
+    parser.add_argument('--dataset', help='synthetic database to use (default: benchmarks/data/<scale>.db)')
+    parser.add_argument('--processes', default='1,2,4', help='worker process counts to run')
+    parser.add_argument('--threads', type=int, default=4, help='threads per worker process')
+    parser.add_argument('--journal-modes', default='delete,wal', help='SQLite journal modes to compare')
+    parser.add_argument('--busy-timeouts', default='0,100,5000', help='busy timeouts to compare, in ms')
+    parser.add_argument('--writer-modes', default='off,on',
+                        help='run with the SQLite writer queue off and/or on (on only applies to WAL)')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per configuration')
+    parser.add_argument('--write-share', type=float, default=0.3, help='fraction of requests that write')
+    parser.add_argument('--no-cache', action='store_true', help='disable the query and fragment caches')
+    parser.add_argument('--max-error-rate', type=float, default=0.001,
+                        help='highest acceptable error rate for the sizing recommendation')
+    parser.add_argument('--max-p95', type=float, default=500.0,
+                        help='highest acceptable p95 latency (ms) for the sizing recommendation')
+    parser.add_argument('--json', help='write the report to this file')
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--cell', help=argparse.SUPPRESS)
+    parser.add_argument('--meta', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+# Worker process: imports the app against the cell's database and runs its threads
+
+class StressUser:
+    """A teacher client and a student client of one organization"""
+
+    def __init__(self, app, conn, meta, index, seed):
+        self.ctx = user_context(meta, index, seed)
+        self.rng = self.ctx['rng']
+        org_id = self.ctx['organization_id']
+        student_id = self.ctx['students'][index % len(self.ctx['students'])]
+        student = conn.execute("SELECT username FROM users WHERE id = ?", (student_id,)).fetchone()[0]
+        self.assignments = [row[0] for row in conn.execute(
+            "SELECT id FROM resources WHERE organization_id = ? AND resource_category = 'assignment' LIMIT 50",
+            (org_id,))] or [0]
+        self.teacher = self._login(app, self.ctx['username'])
+        self.student = self._login(app, student)
+
+    def _login(self, app, username):
+        client = app.test_client()
+        response = client.post('/api/login', json={'username': username, 'password': self.ctx['password']})
+        if response.status_code != 200:
+            raise RuntimeError(f"login failed for {username}: {response.status_code}")
+        return client
+
+    def send(self, name):
+        if name == 'add_reply':
+            return self.teacher.post('/api/add_reply', data={
+                'discussion_id': self.rng.choice(self.ctx['discussions']), 'content': 'Stress test reply'})
+        if name == 'submit_assignment':
+            return self.student.post('/api/submit_assignment', data={
+                'assignment_id': self.rng.choice(self.assignments), 'content': 'Stress test submission'})
+        method, path, body = build_request(name, self.ctx)
+        return self.teacher.open(path, method=method, json=body)
+
+
+def run_worker(args):
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    import web_app
+    from flask import g
+
+    with open(args.meta) as f:
+        meta = json.load(f)
+    app = web_app.app
+    local = threading.local()
+
+    def capture(exc):
+        records = g.get('sql_records', [])
+        local.db_ms = sum(record['ms'] for record in records)
+        local.lock_errors = sum(1 for record in records if 'locked' in record.get('error', ''))
+
+    app.teardown_request(capture)
+
+    conn = web_app.db.get_connection()
+    try:
+        users = [StressUser(app, conn, meta, args.worker * args.threads + t, args.seed)
+                 for t in range(args.threads)]
+    finally:
+        conn.close()
+
+    samples = defaultdict(list)
+    samples_lock = threading.Lock()
+
+    def run_thread(user, start, deadline):
+        rng = user.rng
+        own = defaultdict(list)
+        while time.time() < start:
+            time.sleep(0.001)
+        while time.time() < deadline:
+            name = rng.choice(WRITE_ROUTES if rng.random() < args.write_share else READ_ROUTES)
+            local.db_ms, local.lock_errors = 0.0, 0
+            began = time.perf_counter()
+            response = user.send(name)
+            response.get_data()
+            response.close()
+            elapsed = (time.perf_counter() - began) * 1000
+            own[name].append((round(elapsed, 3), round(local.db_ms, 3), response.status_code, local.lock_errors))
+        with samples_lock:
+            for name, values in own.items():
+                samples[name].extend(values)
+
+    with open(os.path.join(args.cell, f'ready-{args.worker}'), 'w'):
+        pass
+    go = os.path.join(args.cell, 'go')
+    while not os.path.exists(go):
+        time.sleep(0.005)
+    with open(go) as f:
+        schedule = json.load(f)
+
+    threads = [threading.Thread(target=run_thread, args=(user, schedule['start'], schedule['deadline']))
+               for user in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    finished = time.time()
+
+    with open(os.path.join(args.cell, f'out-{args.worker}.json'), 'w') as f:
+        json.dump({'samples': samples, 'finished': finished}, f)
+    return 0
+
+
+# Driver
+
+def run_cell(dataset, workdir, journal_mode, use_writer, busy_timeout, processes, threads, duration, args):
+    """Run one configuration on a fresh copy of the dataset; returns {route: [samples]} and the window"""
+    cell = tempfile.mkdtemp(prefix=f'{journal_mode}-{int(use_writer)}-{busy_timeout}-{processes}-', dir=workdir)
+    db_path = os.path.join(cell, 'stress.db')
+    shutil.copy(dataset, db_path)
+    # WAL is a property of the file; switching here keeps workers from racing to do it
+    conn = sqlite3.connect(db_path)
+    conn.execute(f"PRAGMA journal_mode = {journal_mode}")
+    conn.close()
+
+    env = dict(os.environ,
+               DATABASE_URL='sqlite:///' + db_path,
+               SQLITE_BUSY_TIMEOUT_MS=str(busy_timeout),
+               SQLITE_WRITER='1' if use_writer else '0',
+               QUERY_CACHE_PATH=os.path.join(cell, 'query_cache.db'),
+               METRICS_DIR=os.path.join(cell, 'metrics'),
+               PROFILE_DIR=os.path.join(cell, 'profiles'),
+               SLOW_QUERY_LOG=os.path.join(cell, 'slow_queries.log'),
+               UPLOAD_FOLDER=os.path.join(cell, 'uploads'),
+               LOG_LEVEL='CRITICAL')
+    if journal_mode not in ('DELETE', 'WAL'):
+        # The other modes only last for the connection that set them
+        env['SQLITE_JOURNAL_MODE'] = journal_mode
+    if args.no_cache:
+        env.update(QUERY_CACHE='0', FRAGMENT_CACHE='0')
+
+    workers = []
+    for index in range(processes):
+        command = [sys.executable, os.path.abspath(__file__), '--worker', str(index), '--cell', cell,
+                   '--meta', dataset + '.json', '--threads', str(threads), '--seed', str(args.seed),
+                   '--write-share', str(args.write_share)]
+        workers.append(subprocess.Popen(command, env=env, cwd=ROOT))
+    try:
+        waited = time.time()
+        while not all(os.path.exists(os.path.join(cell, f'ready-{i}')) for i in range(processes)):
+            failed = [worker.returncode for worker in workers if worker.poll() not in (None, 0)]
+            if failed or time.time() - waited > STARTUP_TIMEOUT:
+                raise RuntimeError(f"worker startup failed ({journal_mode}, busy_timeout={busy_timeout})")
+            time.sleep(0.05)
+        start = time.time() + 0.5
+        with open(os.path.join(cell, 'go.tmp'), 'w') as f:
+            json.dump({'start': start, 'deadline': start + duration}, f)
+        os.rename(os.path.join(cell, 'go.tmp'), os.path.join(cell, 'go'))
+        for worker in workers:
+            if worker.wait(timeout=duration + STARTUP_TIMEOUT) != 0:
+                raise RuntimeError(f"worker exited with status {worker.returncode}")
+    finally:
+        for worker in workers:
+            if worker.poll() is None:
+                worker.kill()
+
+    samples = defaultdict(list)
+    finished = start
+    for index in range(processes):
+        with open(os.path.join(cell, f'out-{index}.json')) as f:
+            result = json.load(f)
+        for name, values in result['samples'].items():
+            samples[name].extend(values)
+        finished = max(finished, result['finished'])
+    shutil.rmtree(cell, ignore_errors=True)
+    return samples, finished - start
+
+
+def median(values):
+    ordered = sorted(values)
+    return ordered[len(ordered) // 2] if ordered else 0.0
+
+
+def uncontended_db_ms(samples):
+    """Median database ms per route from a single-thread run"""
+    return {name: median(value[1] for value in values) for name, values in samples.items()}
+
+
+def summarize_cell(samples, wall_seconds, baseline):
+    routes = {}
+    all_latency, read_latency, write_latency, waits = [], [], [], []
+    requests = errors = lock_errors = writes = 0
+    total_ms = 0.0
+    for name, values in samples.items():
+        route_waits = [max(0.0, db_ms - baseline.get(name, db_ms)) for _, db_ms, _, _ in values]
+        route_errors = sum(1 for _, _, status, locked in values if status >= 500 or locked)
+        latencies = sorted(value[0] for value in values)
+        routes[name] = {
+            'requests': len(values),
+            'errors': route_errors,
+            'p95_ms': round(percentile(latencies, 95), 3),
+            'mean_lock_wait_ms': round(sum(route_waits) / len(values), 3) if values else 0.0,
+        }
+        requests += len(values)
+        errors += route_errors
+        lock_errors += sum(value[3] for value in values)
+        total_ms += sum(latencies)
+        waits.extend(route_waits)
+        all_latency.extend(latencies)
+        (write_latency if name in WRITE_ROUTES else read_latency).extend(latencies)
+        if name in WRITE_ROUTES:
+            writes += len(values)
+    for values in (all_latency, read_latency, write_latency, waits):
+        values.sort()
+    return {
+        'requests': requests,
+        'rps': round(requests / wall_seconds, 2) if wall_seconds else 0.0,
+        'write_rps': round(writes / wall_seconds, 2) if wall_seconds else 0.0,
+        'errors': errors,
+        'error_rate': round(errors / requests, 5) if requests else 0.0,
+        'lock_errors': lock_errors,
+        'p50_ms': round(percentile(all_latency, 50), 3),
+        'p95_ms': round(percentile(all_latency, 95), 3),
+        'p99_ms': round(percentile(all_latency, 99), 3),
+        'read_p95_ms': round(percentile(read_latency, 95), 3),
+        'write_p95_ms': round(percentile(write_latency, 95), 3),
+        'mean_lock_wait_ms': round(sum(waits) / len(waits), 3) if waits else 0.0,
+        'p95_lock_wait_ms': round(percentile(waits, 95), 3),
+        'lock_wait_share': round(sum(waits) / total_ms, 4) if total_ms else 0.0,
+        'routes': routes,
+    }
+
+
+def recommend(cells, max_error_rate, max_p95):
+    """Highest-throughput configuration within the error and latency limits"""
+    acceptable = [cell for cell in cells if cell['error_rate'] <= max_error_rate and cell['p95_ms'] <= max_p95]
+    return max(acceptable, key=lambda cell: cell['rps']) if acceptable else None
+
+
+def describe(cell):
+    return (f"journal_mode={cell['journal_mode']} writer={'on' if cell['writer'] else 'off'} "
+            f"busy_timeout={cell['busy_timeout_ms']}ms "
+            f"{cell['processes']} processes x {cell['threads']} threads")
+
+
+def print_table(cells):
+    print(f"{'journal':8} {'writer':6} {'busy ms':>7} {'procs':>5} {'req/s':>8} {'write/s':>8} {'err %':>7} {'locked':>6} "
+          f"{'p95 read':>9} {'p95 write':>9} {'wait mean':>9} {'wait p95':>9} {'wait %':>6}")
+    for cell in cells:
+        print(f"{cell['journal_mode']:8} {'on' if cell['writer'] else 'off':6} {cell['busy_timeout_ms']:>7} {cell['processes']:>5} {cell['rps']:>8.1f} "
+              f"{cell['write_rps']:>8.1f} {cell['error_rate'] * 100:>7.2f} {cell['lock_errors']:>6} "
+              f"{cell['read_p95_ms']:>9.1f} {cell['write_p95_ms']:>9.1f} {cell['mean_lock_wait_ms']:>9.2f} "
+              f"{cell['p95_lock_wait_ms']:>9.1f} {cell['lock_wait_share'] * 100:>6.1f}")
+
+
+def main():
+    args = parse_args()
+    if args.worker is not None:
+        return run_worker(args)
+
+    dataset = os.path.abspath(args.dataset or os.path.join(ROOT, 'benchmarks', 'data', f'{args.scale}.db'))
+    os.makedirs(os.path.dirname(dataset), exist_ok=True)
+    meta = ensure_dataset(dataset, args.scale, scale_overrides(args), args.seed)
+    journal_modes = [mode.strip().upper() for mode in args.journal_modes.split(',')]
+    busy_timeouts = [int(value) for value in args.busy_timeouts.split(',')]
+    process_counts = [int(value) for value in args.processes.split(',')]
+    # The writer switches the database to WAL, so it is only compared there
+    configurations = [(journal_mode, writer_mode == 'on') for journal_mode in journal_modes
+                      for writer_mode in args.writer_modes.split(',')
+                      if writer_mode == 'off' or journal_mode == 'WAL']
+
+    workdir = tempfile.mkdtemp(prefix='staffroom-stress-')
+    cells = []
+    try:
+        for journal_mode, use_writer in configurations:
+            samples, _ = run_cell(dataset, workdir, journal_mode, use_writer, 5000, 1, 1,
+                                  max(2.0, args.duration / 2), args)
+            baseline = uncontended_db_ms(samples)
+            print(f"{journal_mode} writer={'on' if use_writer else 'off'}: uncontended database ms per route "
+                  + ', '.join(f'{name}={ms:.2f}' for name, ms in sorted(baseline.items())))
+            for busy_timeout in busy_timeouts:
+                for processes in process_counts:
+                    samples, wall = run_cell(dataset, workdir, journal_mode, use_writer, busy_timeout, processes,
+                                             args.threads, args.duration, args)
+                    cell = {'journal_mode': journal_mode, 'writer': use_writer, 'busy_timeout_ms': busy_timeout,
+                            'processes': processes, 'threads': args.threads}
+                    cell.update(summarize_cell(samples, wall, baseline))
+                    cells.append(cell)
+                    print(f"  {describe(cell)}: {cell['rps']:.1f} req/s, "
+                          f"{cell['error_rate'] * 100:.2f}% errors, p95 {cell['p95_ms']:.1f} ms")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\n{meta['scale']} dataset, {args.threads} threads per process, {args.duration:.0f}s per run, "
+          f"{int(args.write_share * 100)}% writes, {os.cpu_count()} CPUs")
+    print_table(cells)
+
+    best = recommend(cells, args.max_error_rate, args.max_p95)
+    if best:
+        print(f"\nRecommended: {describe(best)} ({best['rps']:.1f} req/s, "
+              f"{best['error_rate'] * 100:.2f}% errors, p95 {best['p95_ms']:.1f} ms)")
+    else:
+        print(f"\nNo configuration stayed within {args.max_error_rate * 100:.2f}% errors "
+              f"and p95 {args.max_p95:.0f} ms")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'revision': git_revision(),
+                'cpu_count': os.cpu_count(),
+                'dataset': {'scale': meta['scale'], 'seed': meta['seed'], 'counts': meta['counts']},
+                'duration': args.duration,
+                'write_share': args.write_share,
+                'caches': not args.no_cache,
+                'cells': cells,
+                'recommendation': best,
+            }, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,519 @@
+#!/usr/bin/env python3
+"""
+WebDatabaseManager micro-benchmarks with scaling budgets
+Calls every WebDatabaseManager method against synthetic datasets of several
+sizes (multiples of the tiny scale, organizations included, so one
+organization's data stays the same size while the tables grow) and records
+per call: SQL statements, rows read or written, wall time and peak Python
+allocations. Rows and allocations are fitted to N^k across the sizes; a
+method whose rows grow with N although it only needs one organization's
+data is loading whole tables.
+
+The run fails when a method has no benchmark, errors, or exceeds its stored
+budget in benchmarks/method_budgets.json: more statements per call, or a
+rows/allocation exponent above the recorded one plus slack. Wall time is
+only gated with --check-time, as it depends on the machine.
+
+Usage: python benchmarks/method_bench.py [--sizes 1,4,16] [--update-budgets] [--check-time]
+"""
+
+import argparse
+import ast
+import json
+import math
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import namedtuple
+from datetime import datetime
+
+from synthetic import SCALES, ensure_dataset
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGETS_PATH = os.path.join(ROOT, 'benchmarks', 'method_budgets.json')
+
+EXPONENT_SLACK = 0.3
+ALLOC_EXPONENT_SLACK = 0.4
+ROWS_FLOOR = 1
+ALLOC_FLOOR = 16 * 1024
+MS_FLOOR = 0.05
+
+# Not benchmarked: schema setup runs once per process, the connection helpers under every method
+SKIPPED = {
+    '__init__': 'constructor',
+    'init_database': 'schema setup at startup',
+    'create_default_admin': 'startup seeding',
+    'create_default_subjects': 'startup seeding',
+    'create_demo_students': 'startup seeding',
+    'get_connection': 'connection factory used by every method',
+    'write': 'transaction helper, measured through the methods that use it',
+    'cache_scope': 'query cache key property',
+}
+
+# fn(db, ctx) is timed; setup(db, ctx) runs untimed before each call and may set ctx fields
+Call = namedtuple('Call', 'fn setup iterations', defaults=(None, None))
+
+
+def _new_user(db, ctx, user_type='student'):
+    ctx.n += 1
+    conn = db.get_connection()
+    try:
+        cursor = conn.execute("""
+            INSERT INTO users (username, email, password_hash, first_name, last_name, user_type)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (f'mb{os.getpid()}_{ctx.n}', f'mb{os.getpid()}_{ctx.n}@bench.example', ctx.password_hash,
+              'Bench', 'User', user_type))
+        conn.commit()
+        ctx.fresh_user = cursor.lastrowid
+    finally:
+        conn.close()
+
+
+def _join_request(db, ctx):
+    _new_user(db, ctx)
+    db.create_join_request(ctx.org_id, ctx.fresh_user)
+    conn = db.get_connection()
+    try:
+        ctx.request_id = conn.execute("SELECT MAX(id) FROM organization_join_requests").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _enrolled_student(db, ctx):
+    _new_user(db, ctx)
+    db.enroll_student(ctx.class_id, ctx.fresh_user)
+
+
+def _new_resource(db, ctx):
+    ctx.target_id = db.create_resource('Bench resource', 'to delete', 'note', organization_id=ctx.org_id,
+                                       uploaded_by=ctx.teacher_id)
+
+
+def _new_event(db, ctx):
+    ctx.target_id = db.create_schedule_event(ctx.class_id, 'Bench event', '', '2026-07-01 09:00:00',
+                                             '2026-07-01 10:00:00', ctx.teacher_id)
+
+
+def _new_series(db, ctx):
+    ctx.target_id = db.create_schedule_event(ctx.class_id, 'Bench series', '', '2026-07-01 09:00:00',
+                                             '2026-07-01 10:00:00', ctx.teacher_id,
+                                             recurrence_pattern='RRULE:FREQ=WEEKLY;BYDAY=MO,WE,FR')
+
+
+def _new_class(db, ctx):
+    _new_user(db, ctx)
+    conn = db.get_connection()
+    try:
+        conn.execute("INSERT INTO organization_memberships (organization_id, user_id, role) VALUES (?, ?, 'student')",
+                     (ctx.org_id, ctx.fresh_user))
+        conn.commit()
+    finally:
+        conn.close()
+    ctx.target_id = db.create_class('Bench roster', '', ctx.subject_id, 5, ctx.teacher_id, ctx.org_id)
+
+
+def _submissions(db, ctx):
+    assignment_id = db.create_resource('Bench assignment', '', 'note', class_id=ctx.class_id,
+                                       organization_id=ctx.org_id, uploaded_by=ctx.teacher_id,
+                                       resource_category='assignment')
+    conn = db.get_connection()
+    try:
+        ctx.grades = []
+        for i in range(5):
+            cursor = conn.execute("INSERT INTO assignment_submissions (assignment_id, student_id, content) VALUES (?, ?, ?)",
+                                  (assignment_id, ctx.student_id + i, 'Bench submission'))
+            ctx.grades.append((cursor.lastrowid, 80 + i, 'Bench feedback'))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _empty_organization(db, ctx):
+    ctx.n += 1
+    ctx.target_id = db.create_organization(f'Empty {os.getpid()} {ctx.n}', '', '', '', '', '', '', None, None,
+                                           ctx.teacher_id)
+
+
+def _with_conn(db, fn):
+    conn = db.get_connection()
+    try:
+        return fn(conn)
+    finally:
+        conn.close()
+
+
+CALLS = {
+    'add_discussion_attachment': Call(lambda db, c: db.add_discussion_attachment(
+        c.discussion_id, None, 'bench.txt', 'bench.txt', 'uploads/bench.txt', 10, 'text/plain', c.teacher_id)),
+    'add_discussion_reply': Call(lambda db, c: db.add_discussion_reply(c.discussion_id, 'Bench reply', c.teacher_id)),
+    'add_global_discussion_reply': Call(lambda db, c: db.add_global_discussion_reply(
+        c.global_discussion_id, c.teacher_id, c.org_name, 'Bench reply')),
+    'add_organization_member': Call(lambda db, c: db.add_organization_member(c.org_id, c.fresh_user, 'teacher'),
+                                    setup=_new_user),
+    'approve_join_request': Call(lambda db, c: db.approve_join_request(c.request_id, c.teacher_id),
+                                 setup=_join_request),
+    'authenticate_user': Call(lambda db, c: db.authenticate_user(c.username, c.password), iterations=3),
+    'create_class': Call(lambda db, c: db.create_class('Bench class', '', c.subject_id, 5, c.teacher_id, c.org_id)),
+    'create_discussion': Call(lambda db, c: db.create_discussion('Bench', 'Bench content', c.teacher_id,
+                                                                 'general', c.org_id)),
+    'cancel_schedule_occurrence': Call(lambda db, c: db.cancel_schedule_occurrence(
+        c.target_id, datetime(2026, 7, 3, 9, 0)), setup=_new_series),
+    'check_submission_access': Call(lambda db, c: _with_conn(db, lambda conn: db.check_submission_access(
+        conn, [submission_id for submission_id, _, _ in c.grades], c.teacher_id)), setup=_submissions),
+    'create_global_discussion': Call(lambda db, c: db.create_global_discussion('Bench', 'Bench content',
+                                                                               c.teacher_id, c.org_name)),
+    'create_join_request': Call(lambda db, c: db.create_join_request(c.org_id, c.fresh_user), setup=_new_user),
+    'create_organization': Call(lambda db, c: db.create_organization(
+        f'Bench org {os.getpid()} {c.next()}', '', '', '', '', '', '', None, None, c.teacher_id)),
+    'create_resource': Call(lambda db, c: db.create_resource(
+        'Bench resource', '', 'note', grade_level=5, subject_id=c.subject_id, class_id=c.class_id,
+        organization_id=c.org_id, uploaded_by=c.teacher_id)),
+    'create_schedule_event': Call(lambda db, c: db.create_schedule_event(
+        c.class_id, 'Bench event', '', '2026-07-01 09:00:00', '2026-07-01 10:00:00', c.teacher_id)),
+    'create_user': Call(lambda db, c: db.create_user(f'mbuser{os.getpid()}_{c.next()}',
+                                                     f'mbuser{os.getpid()}_{c.n}@bench.example', 'bench123',
+                                                     'Bench', 'User', 'student', c.org_id), iterations=3),
+    'delete_organization_if_empty': Call(lambda db, c: db.delete_organization_if_empty(c.target_id),
+                                         setup=_empty_organization),
+    'delete_resource': Call(lambda db, c: db.delete_resource(c.target_id), setup=_new_resource),
+    'delete_schedule_event': Call(lambda db, c: db.delete_schedule_event(c.target_id), setup=_new_event),
+    'enroll_student': Call(lambda db, c: db.enroll_student(c.class_id, c.fresh_user), setup=_new_user),
+    'get_all_discussions': Call(lambda db, c: db.get_all_discussions()),
+    'get_all_organizations': Call(lambda db, c: db.get_all_organizations()),
+    'get_all_students': Call(lambda db, c: db.get_all_students()),
+    'get_all_subjects': Call(lambda db, c: db.get_all_subjects()),
+    'get_attachments_for_discussions': Call(lambda db, c: db.get_attachments_for_discussions(c.discussion_ids)),
+    'get_class_organization_id': Call(lambda db, c: _with_conn(db, lambda conn: db.get_class_organization_id(
+        conn, c.class_id))),
+    'get_class_schedule': Call(lambda db, c: db.get_class_schedule(c.class_id)),
+    'get_class_students': Call(lambda db, c: db.get_class_students(c.class_id)),
+    'get_data_versions': Call(lambda db, c: db.get_data_versions(c.org_id, ('resources', 'discussions', 'users'))),
+    'get_discussion_attachments': Call(lambda db, c: db.get_discussion_attachments(c.discussion_id)),
+    'get_discussion_replies': Call(lambda db, c: db.get_discussion_replies(c.discussion_id)),
+    'get_discussions_by_organization': Call(lambda db, c: db.get_discussions_by_organization(c.org_id)),
+    'get_gradebook': Call(lambda db, c: db.get_gradebook(c.class_id)),
+    'get_global_discussion_replies': Call(lambda db, c: db.get_global_discussion_replies(c.global_discussion_id)),
+    'get_global_discussions': Call(lambda db, c: db.get_global_discussions()),
+    'get_organization_by_id': Call(lambda db, c: db.get_organization_by_id(c.org_id)),
+    'get_organization_members': Call(lambda db, c: db.get_organization_members(c.org_id)),
+    'get_pending_join_requests': Call(lambda db, c: db.get_pending_join_requests(c.org_id)),
+    'get_reply_attachments': Call(lambda db, c: db.get_reply_attachments(c.reply_id)),
+    'get_resource_organization_id': Call(lambda db, c: _with_conn(db, lambda conn: db.get_resource_organization_id(
+        conn, c.resource_id))),
+    'get_resources_by_class': Call(lambda db, c: db.get_resources_by_class(c.class_id)),
+    'get_resources_by_organization': Call(lambda db, c: db.get_resources_by_organization(c.org_id)),
+    'get_schedule_event': Call(lambda db, c: db.get_schedule_event(c.target_id), setup=_new_event),
+    'get_student_classes': Call(lambda db, c: db.get_student_classes(c.student_id)),
+    'get_teacher_classes': Call(lambda db, c: db.get_teacher_classes(c.teacher_id)),
+    'get_teacher_schedule': Call(lambda db, c: db.get_teacher_schedule(c.teacher_id)),
+    'get_user_current_organization': Call(lambda db, c: db.get_user_current_organization(c.teacher_id)),
+    'get_user_organization_membership': Call(lambda db, c: db.get_user_organization_membership(c.teacher_id)),
+    'get_user_organizations': Call(lambda db, c: db.get_user_organizations(c.teacher_id)),
+    'grade_submissions': Call(lambda db, c: db.grade_submissions(c.grades, c.teacher_id, owner_id=c.teacher_id),
+                              setup=_submissions),
+    'is_organization_member': Call(lambda db, c: db.is_organization_member(c.org_id, c.teacher_id)),
+    'reject_join_request': Call(lambda db, c: db.reject_join_request(c.request_id, c.teacher_id),
+                                setup=_join_request),
+    'sync_class_roster': Call(lambda db, c: db.sync_class_roster(c.target_id, [c.student_id, c.fresh_user]),
+                              setup=_new_class),
+    'unenroll_student': Call(lambda db, c: db.unenroll_student(c.class_id, c.fresh_user), setup=_enrolled_student),
+    'update_organization': Call(lambda db, c: db.update_organization(
+        c.org_id, c.org_name, 'Updated by benchmark', '', '', '', '', '', None, None, True, 'public')),
+    'update_resource': Call(lambda db, c: db.update_resource(c.resource_id, title='Bench resource')),
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Micro-benchmark WebDatabaseManager methods across data sizes')
+    parser.add_argument('--sizes', default='1,4,16', help='dataset sizes as multiples of the tiny scale')
+    parser.add_argument('--iterations', type=int, default=10, help='timed calls per method and size')
+    parser.add_argument('--method', action='append', dest='methods', help='only these methods (repeatable)')
+    parser.add_argument('--budgets', default=BUDGETS_PATH)
+    parser.add_argument('--update-budgets', action='store_true', help='store this run as the new budgets')
+    parser.add_argument('--check-time', action='store_true', help='also gate on wall time at the largest size')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed wall time growth with --check-time')
+    parser.add_argument('--json', help='write the measurements and fits to this file')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--out', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+# Worker: one process per dataset, since web_app binds to DATABASE_URL on import
+
+class Context:
+    """Sample ids from the dataset's first organization"""
+
+    def __init__(self, db, meta):
+        from werkzeug.security import generate_password_hash
+
+        org = meta['organizations'][0]
+        self.n = 0
+        self.org_id = org['id']
+        self.username = org['owner']
+        self.password = meta['password']
+        self.password_hash = generate_password_hash('bench123')
+        self.student_id = org['students'][0]
+        self.discussion_id = org['discussions'][0]
+        self.discussion_ids = org['discussions'][:20]
+        self.fresh_user = self.request_id = self.target_id = None
+        conn = db.get_connection()
+        try:
+            self.teacher_id = conn.execute("SELECT id FROM users WHERE username = ?", (self.username,)).fetchone()[0]
+            self.org_name = conn.execute("SELECT name FROM organizations WHERE id = ?", (self.org_id,)).fetchone()[0]
+            self.class_id = conn.execute("SELECT id FROM classes WHERE organization_id = ? ORDER BY id LIMIT 1",
+                                         (self.org_id,)).fetchone()[0]
+            self.subject_id = conn.execute("SELECT id FROM subjects ORDER BY id LIMIT 1").fetchone()[0]
+            self.resource_id = conn.execute("SELECT id FROM resources WHERE organization_id = ? ORDER BY id LIMIT 1",
+                                            (self.org_id,)).fetchone()[0]
+            self.reply_id = conn.execute("SELECT id FROM discussion_replies WHERE discussion_id = ? LIMIT 1",
+                                         (self.discussion_id,)).fetchone()
+            self.reply_id = self.reply_id[0] if self.reply_id else 0
+        finally:
+            conn.close()
+        self.global_discussion_id = db.create_global_discussion('Bench global', 'Bench content', self.teacher_id,
+                                                                self.org_name)
+
+    def next(self):
+        self.n += 1
+        return self.n
+
+
+def measure(app, db, ctx, call, iterations):
+    """Median wall ms, statements and rows per call, then peak allocations of one more call"""
+    from flask import g
+
+    times, queries, rows = [], [], []
+    for _ in range(call.iterations or iterations):
+        if call.setup:
+            call.setup(db, ctx)
+        with app.test_request_context():
+            start = time.perf_counter()
+            call.fn(db, ctx)
+            times.append((time.perf_counter() - start) * 1000)
+            records = [record for record in g.get('sql_records', []) if record['statement'] != 'COMMIT']
+            queries.append(len(records))
+            rows.append(sum(record['rows'] for record in records))
+
+    if call.setup:
+        call.setup(db, ctx)
+    tracemalloc.start()
+    try:
+        with app.test_request_context():
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            call.fn(db, ctx)
+            alloc = tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'ms': round(statistics.median(times), 4),
+        'queries': max(queries),
+        'rows': int(statistics.median(rows)),
+        'alloc_bytes': max(alloc, 0),
+    }
+
+
+def run_worker(args):
+    sys.path.insert(0, ROOT)
+    import web_app
+
+    with open(args.worker + '.json') as f:
+        meta = json.load(f)
+    db = web_app.db
+    ctx = Context(db, meta)
+    results = {}
+    for name in args.methods or sorted(CALLS):
+        try:
+            results[name] = measure(web_app.app, db, ctx, CALLS[name], args.iterations)
+        except Exception as e:
+            results[name] = {'error': f'{type(e).__name__}: {e}'}
+    with open(args.out, 'w') as f:
+        json.dump(results, f)
+    return 0
+
+
+# Driver
+
+def unbenchmarked_methods():
+    """Public WebDatabaseManager methods with neither a CALLS entry nor a SKIPPED reason"""
+    with open(os.path.join(ROOT, 'web_app.py')) as f:
+        tree = ast.parse(f.read())
+    names = set()
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef) and node.name == 'WebDatabaseManager':
+            names.update(item.name for item in node.body if isinstance(item, ast.FunctionDef))
+    return sorted(name for name in names if name not in CALLS and name not in SKIPPED)
+
+
+def run_size(multiplier, args, workdir):
+    counts = {table: value * multiplier for table, value in SCALES['tiny'].items()}
+    dataset = os.path.join(ROOT, 'benchmarks', 'data', f'methods-x{multiplier}.db')
+    os.makedirs(os.path.dirname(dataset), exist_ok=True)
+    ensure_dataset(dataset, 'tiny', counts)
+
+    copy = os.path.join(workdir, f'x{multiplier}.db')
+    shutil.copy(dataset, copy)
+    shutil.copy(dataset + '.json', copy + '.json')
+    env = dict(os.environ,
+               DATABASE_URL='sqlite:///' + copy,
+               QUERY_CACHE='0',
+               FRAGMENT_CACHE='0',
+               SQL_INSTRUMENTATION='1',
+               # Writes run on the request's connection so their statements are counted
+               SQLITE_WRITER='0',
+               QUERY_CACHE_PATH=os.path.join(workdir, 'query_cache.db'),
+               METRICS_DIR=os.path.join(workdir, 'metrics'),
+               PROFILE_DIR=os.path.join(workdir, 'profiles'),
+               SLOW_QUERY_LOG=os.path.join(workdir, 'slow_queries.log'),
+               LOG_LEVEL='ERROR')
+    out = os.path.join(workdir, f'x{multiplier}.out.json')
+    command = [sys.executable, os.path.abspath(__file__), '--worker', copy, '--out', out,
+               '--iterations', str(args.iterations)]
+    for name in args.methods or []:
+        command += ['--method', name]
+    subprocess.run(command, check=True, env=env, cwd=ROOT)
+    with open(out) as f:
+        return counts, json.load(f)
+
+
+def fit_exponent(sizes, values, floor):
+    """Least-squares k in value ~ size^k"""
+    xs = [math.log(size) for size in sizes]
+    ys = [math.log(max(value, floor)) for value in values]
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    var_x = sum((x - mean_x) ** 2 for x in xs)
+    if not var_x:
+        return 0.0
+    return round(sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / var_x, 3)
+
+
+def complexity(exponent):
+    if exponent < 0.25:
+        return 'O(1)'
+    if exponent < 0.75:
+        return 'sublinear'
+    if exponent < 1.25:
+        return 'O(N)'
+    return f'O(N^{exponent:.1f})'
+
+
+def analyze(sizes, per_size):
+    """Per method: measurements at each size and the fitted exponents"""
+    analysis = {}
+    for name in sorted(per_size[sizes[0]]):
+        runs = [per_size[size].get(name, {}) for size in sizes]
+        errors = [run['error'] for run in runs if 'error' in run]
+        if errors:
+            analysis[name] = {'error': errors[0]}
+            continue
+        rows_exponent = fit_exponent(sizes, [run['rows'] for run in runs], ROWS_FLOOR)
+        analysis[name] = {
+            'sizes': {str(size): run for size, run in zip(sizes, runs)},
+            'queries': max(run['queries'] for run in runs),
+            'rows_exponent': rows_exponent,
+            'alloc_exponent': fit_exponent(sizes, [run['alloc_bytes'] for run in runs], ALLOC_FLOOR),
+            'ms_exponent': fit_exponent(sizes, [run['ms'] for run in runs], MS_FLOOR),
+            'ms': runs[-1]['ms'],
+            'complexity': complexity(rows_exponent),
+        }
+    return analysis
+
+
+def check_budgets(analysis, budgets, args):
+    failures = []
+    for name, result in analysis.items():
+        if 'error' in result:
+            failures.append(f"{name}: {result['error']}")
+            continue
+        budget = budgets.get(name)
+        if budget is None:
+            failures.append(f"{name}: no budget (run with --update-budgets)")
+            continue
+        if result['queries'] > budget['queries']:
+            failures.append(f"{name}: {result['queries']} statements per call, budget {budget['queries']}")
+        if result['rows_exponent'] > budget['rows_exponent'] + EXPONENT_SLACK:
+            failures.append(f"{name}: rows grow as N^{result['rows_exponent']}, budget N^{budget['rows_exponent']}")
+        if result['alloc_exponent'] > budget['alloc_exponent'] + ALLOC_EXPONENT_SLACK:
+            failures.append(f"{name}: allocations grow as N^{result['alloc_exponent']}, "
+                            f"budget N^{budget['alloc_exponent']}")
+        if args.check_time and result['ms'] > budget['ms'] * (1 + args.tolerance) + 1:
+            failures.append(f"{name}: {result['ms']:.2f} ms, budget {budget['ms']:.2f} ms")
+    return failures
+
+
+def print_table(sizes, analysis):
+    size_columns = ''.join(f" {'rows x' + str(size):>10}" for size in sizes)
+    print(f"{'method':34} {'stmts':>5}{size_columns} {'ms@x' + str(sizes[-1]):>9} {'alloc k':>8} {'rows k':>7}  growth")
+    for name, result in analysis.items():
+        if 'error' in result:
+            print(f"{name:34} ERROR {result['error']}")
+            continue
+        rows = ''.join(f" {result['sizes'][str(size)]['rows']:>10}" for size in sizes)
+        print(f"{name:34} {result['queries']:>5}{rows} {result['ms']:>9.2f} {result['alloc_exponent']:>8.2f} "
+              f"{result['rows_exponent']:>7.2f}  {result['complexity']}")
+
+
+def main():
+    args = parse_args()
+    if args.worker:
+        return run_worker(args)
+
+    missing = unbenchmarked_methods()
+    sizes = sorted(int(size) for size in args.sizes.split(','))
+    if len(sizes) < 2:
+        raise SystemExit('--sizes needs at least two sizes to fit scaling curves')
+
+    workdir = tempfile.mkdtemp(prefix='staffroom-methods-')
+    try:
+        per_size = {}
+        for size in sizes:
+            counts, per_size[size] = run_size(size, args, workdir)
+            print(f"measured x{size}: {counts}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    analysis = analyze(sizes, per_size)
+    print_table(sizes, analysis)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'sizes': sizes, 'methods': analysis},
+                      f, indent=2)
+
+    if args.update_budgets:
+        budgets = {}
+        if args.methods and os.path.exists(args.budgets):
+            with open(args.budgets) as f:
+                budgets = json.load(f)
+        for name, result in analysis.items():
+            if 'error' not in result:
+                budgets[name] = {key: result[key] for key in ('queries', 'rows_exponent', 'alloc_exponent', 'ms')}
+        with open(args.budgets, 'w') as f:
+            json.dump(dict(sorted(budgets.items())), f, indent=2)
+            f.write('\n')
+        print(f"wrote budgets for {len(budgets)} methods to {args.budgets}")
+        return 0
+
+    if not os.path.exists(args.budgets):
+        print(f"no budgets at {args.budgets}; run with --update-budgets to create them")
+        return 1
+    with open(args.budgets) as f:
+        budgets = json.load(f)
+    failures = [f"{name}: not benchmarked (add it to CALLS or SKIPPED)" for name in missing]
+    failures += check_budgets(analysis, budgets, args)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if failures:
+        return 1
+    print(f"all {len(analysis)} methods within budget")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+End-to-end route benchmark
+Drives the key routes against a synthetic dataset (see synthetic.py) and
+reports latency percentiles and throughput per route. Two modes:
+
+- client: the Flask test client, one request at a time, in-process
+- http: N threads, each logged in as a different organization owner,
+  against a local threaded server or a running deployment (--url)
+
+Results can be written as JSON and compared with a stored baseline; the run
+exits with status 1 when a route's p95 regresses beyond --tolerance.
+
+Usage: python benchmarks/route_bench.py [--scale small] [--mode http --threads 8]
+                                        [--json results.json] [--baseline baseline.json]
+"""
+
+import argparse
+import atexit
+import http.cookiejar
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from synthetic import add_scale_arguments, ensure_dataset, scale_overrides
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name -> (method, path, request body); paths and bodies are filled from the user's organization
+ROUTES = {
+    'login': ('POST', '/api/login', lambda ctx: {'username': ctx['username'], 'password': ctx['password']}),
+    'dashboard': ('GET', '/dashboard', None),
+    'get_resources': ('GET', '/api/get_resources', None),
+    'get_discussions': ('GET', '/api/get_discussions', None),
+    'discussion_details': ('GET', '/api/get_discussion_details/{discussion_id}', None),
+    'mark_attendance': ('POST', '/api/mark_attendance', lambda ctx: {
+        'student_id': ctx['student_id'], 'status': ctx['rng'].choice(('present', 'absent', 'late')),
+        'date': f"2026-07-{ctx['rng'].randint(1, 28):02d}"}),
+    'attendance_percentage': ('GET', '/api/get_attendance_percentage', None),
+    'announcements': ('GET', '/api/get_announcements', None),
+}
+
+# Login hashes the password, so it runs a tenth as often as the other routes
+WEIGHTS = {'login': 0.1}
+
+NOISE_FLOOR_MS = 1.0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the main routes against a synthetic dataset')
+    add_scale_arguments(parser)
+    parser.add_argument('--dataset', help='synthetic database to use (default: benchmarks/data/<scale>.db)')
+    parser.add_argument('--mode', choices=('client', 'http'), default='client')
+    parser.add_argument('--threads', type=int, default=4, help='concurrent clients in http mode')
+    parser.add_argument('--url', help='benchmark a running server (http mode) instead of a local one')
+    parser.add_argument('--iterations', type=int, default=50, help='requests per route (per thread in http mode)')
+    parser.add_argument('--warmup', type=int, default=3, help='untimed requests per route first')
+    parser.add_argument('--route', action='append', dest='routes', choices=sorted(ROUTES),
+                        help='route to benchmark (repeatable, default all)')
+    parser.add_argument('--no-cache', action='store_true', help='disable the query and fragment caches')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--baseline', help='compare with a previous --json result')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed p95 slowdown against the baseline (0.2 = 20%%)')
+    return parser.parse_args()
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(samples, wall_seconds):
+    """Latency percentiles (ms), error count and throughput for one route"""
+    latencies = sorted(ms for ms, _ in samples)
+    errors = sum(1 for _, status in samples if status >= 400)
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'mean_ms': round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'max_ms': round(latencies[-1], 3) if latencies else 0.0,
+        'rps': round(len(samples) / wall_seconds, 2) if wall_seconds else 0.0,
+    }
+
+
+def route_plan(routes, iterations):
+    """Requests per route, weighted so slow-by-design routes run less often"""
+    return {name: max(1, int(iterations * WEIGHTS.get(name, 1.0))) for name in routes}
+
+
+def user_context(meta, index, seed):
+    """Login and request parameters for the index-th simulated user"""
+    org = meta['organizations'][index % len(meta['organizations'])]
+    rng = random.Random(seed + index)
+    return {
+        'username': org['owner'],
+        'password': meta['password'],
+        'organization_id': org['id'],
+        'students': org['students'],
+        'discussions': org['discussions'],
+        'rng': rng,
+    }
+
+
+def build_request(name, ctx):
+    method, path, body = ROUTES[name]
+    rng = ctx['rng']
+    ctx['student_id'] = rng.choice(ctx['students']) if ctx['students'] else 0
+    ctx['discussion_id'] = rng.choice(ctx['discussions']) if ctx['discussions'] else 0
+    return method, path.format(**ctx), body(ctx) if body else None
+
+
+# Test client mode
+
+def run_client(app, meta, routes, args):
+    client = app.test_client()
+    ctx = user_context(meta, 0, args.seed)
+    login = client.post('/api/login', json={'username': ctx['username'], 'password': ctx['password']})
+    if login.status_code != 200:
+        raise SystemExit(f"Login failed for {ctx['username']}: {login.status_code}")
+
+    results = {}
+    for name, count in route_plan(routes, args.iterations).items():
+        for _ in range(args.warmup):
+            method, path, body = build_request(name, ctx)
+            client.open(path, method=method, json=body).get_data()
+        samples = []
+        started = time.perf_counter()
+        for _ in range(count):
+            method, path, body = build_request(name, ctx)
+            start = time.perf_counter()
+            response = client.open(path, method=method, json=body)
+            response.get_data()
+            samples.append(((time.perf_counter() - start) * 1000, response.status_code))
+        results[name] = summarize(samples, time.perf_counter() - started)
+    return results, None
+
+
+# HTTP mode
+
+class HttpUser:
+    """One logged-in client with its own cookie jar"""
+
+    def __init__(self, base_url, ctx):
+        self.base_url = base_url.rstrip('/')
+        self.ctx = ctx
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def request(self, method, path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method)
+        if data is not None:
+            req.add_header('Content-Type', 'application/json')
+        start = time.perf_counter()
+        try:
+            with self.opener.open(req, timeout=120) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            status = e.code
+        except (urllib.error.URLError, OSError):
+            status = 599
+        return (time.perf_counter() - start) * 1000, status
+
+
+def start_local_server(app):
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def run_http(base_url, meta, routes, args):
+    users = []
+    for index in range(args.threads):
+        user = HttpUser(base_url, user_context(meta, index, args.seed))
+        _, status = user.request('POST', '/api/login', {'username': user.ctx['username'],
+                                                        'password': user.ctx['password']})
+        if status != 200:
+            raise SystemExit(f"Login failed for {user.ctx['username']}: {status}")
+        users.append(user)
+
+    plan = route_plan(routes, args.iterations)
+    samples = {name: [] for name in plan}
+    lock = threading.Lock()
+
+    def worker(user):
+        work = [name for name, count in plan.items() for _ in range(count)]
+        user.ctx['rng'].shuffle(work)
+        for name in list(plan) * args.warmup:
+            user.request(*build_request(name, user.ctx))
+        barrier.wait()
+        local = {name: [] for name in plan}
+        for name in work:
+            local[name].append(user.request(*build_request(name, user.ctx)))
+        with lock:
+            for name, values in local.items():
+                samples[name].extend(values)
+
+    barrier = threading.Barrier(len(users) + 1)
+    threads = [threading.Thread(target=worker, args=(user,)) for user in users]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    results = {name: summarize(values, wall) for name, values in samples.items()}
+    total = sum(len(values) for values in samples.values())
+    return results, {'requests': total, 'seconds': round(wall, 3), 'rps': round(total / wall, 2) if wall else 0.0}
+
+
+# Reporting
+
+def compare(results, baseline, tolerance):
+    """Routes whose p95 grew by more than tolerance (and the noise floor) since the baseline"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get('routes', {}).get(name)
+        if not previous:
+            continue
+        limit = previous['p95_ms'] * (1 + tolerance)
+        if current['p95_ms'] > limit and current['p95_ms'] - previous['p95_ms'] > NOISE_FLOOR_MS:
+            regressions.append((name, previous['p95_ms'], current['p95_ms']))
+    return regressions
+
+
+def print_table(results, overall):
+    print(f"{'route':24} {'reqs':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} {'req/s':>8}")
+    for name, r in results.items():
+        print(f"{name:24} {r['requests']:>6} {r['errors']:>6} {r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} "
+              f"{r['p99_ms']:>9.2f} {r['max_ms']:>9.2f} {r['rps']:>8.1f}")
+    if overall:
+        print(f"overall: {overall['requests']} requests in {overall['seconds']}s = {overall['rps']} req/s")
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def main():
+    args = parse_args()
+    dataset = os.path.abspath(args.dataset or os.path.join(ROOT, 'benchmarks', 'data', f'{args.scale}.db'))
+    os.makedirs(os.path.dirname(dataset), exist_ok=True)
+    meta = ensure_dataset(dataset, args.scale, scale_overrides(args), args.seed)
+    routes = args.routes or list(ROUTES)
+
+    workdir = tempfile.mkdtemp(prefix='staffroom-bench-')
+    # Registered before web_app is imported so it runs after the app's own exit hooks
+    atexit.register(shutil.rmtree, workdir, True)
+    if args.url:
+        if args.mode != 'http':
+            raise SystemExit('--url requires --mode http')
+        results, overall = run_http(args.url, meta, routes, args)
+    else:
+        # Writes (mark_attendance) go to a copy so the dataset stays reusable
+        shutil.copy(dataset, os.path.join(workdir, 'bench.db'))
+        os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+        os.environ['QUERY_CACHE_PATH'] = os.path.join(workdir, 'query_cache.db')
+        os.environ['METRICS_DIR'] = os.path.join(workdir, 'metrics')
+        os.environ['PROFILE_DIR'] = os.path.join(workdir, 'profiles')
+        os.environ['SLOW_QUERY_LOG'] = os.path.join(workdir, 'slow_queries.log')
+        os.environ.setdefault('LOG_LEVEL', 'WARNING')
+        os.environ.setdefault('LOG_LEVELS', 'werkzeug=WARNING')
+        if args.no_cache:
+            os.environ['QUERY_CACHE'] = '0'
+            os.environ['FRAGMENT_CACHE'] = '0'
+        sys.path.insert(0, ROOT)
+        os.chdir(ROOT)
+        import web_app
+
+        if args.mode == 'client':
+            results, overall = run_client(web_app.app, meta, routes, args)
+        else:
+            server, base_url = start_local_server(web_app.app)
+            try:
+                results, overall = run_http(base_url, meta, routes, args)
+            finally:
+                server.shutdown()
+
+    print(f"{args.mode} mode, {meta['scale']} dataset {meta['counts']}")
+    print_table(results, overall)
+
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'mode': args.mode,
+        'threads': args.threads if args.mode == 'http' else 1,
+        'url': args.url,
+        'caches': not args.no_cache,
+        'dataset': {'scale': meta['scale'], 'seed': meta['seed'], 'counts': meta['counts']},
+        'routes': results,
+        'overall': overall,
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('dataset', {}).get('counts') != meta['counts'] or baseline.get('mode') != args.mode:
+            print("warning: baseline was recorded with a different dataset or mode")
+        regressions = compare(results, baseline, args.tolerance)
+        for name, before, after in regressions:
+            print(f"REGRESSION {name}: p95 {before:.2f} ms -> {after:.2f} ms")
+        if regressions:
+            return 1
+        print(f"no p95 regressions beyond {args.tolerance:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
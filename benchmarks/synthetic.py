@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+Synthetic dataset generator for benchmarks
+Builds a SQLite database with the app's schema and a configurable number of
+organizations, users, classes, attendance rows, discussions and resources,
+so routes and queries can be measured at realistic scale. A generated
+dataset is described by a sidecar <db>.json (scale, seed, login users) and
+is reused by later runs with the same scale and seed.
+
+Usage: python benchmarks/synthetic.py --scale large --out bench_large.db
+"""
+
+import argparse
+import atexit
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PASSWORD = 'bench123'
+BASE_TIME = datetime(2026, 6, 30, 16, 0, 0)
+
+SCALES = {
+    'tiny': {'organizations': 5, 'users': 1000, 'classes': 25, 'attendance': 10000,
+             'discussions': 500, 'replies': 1500, 'resources': 250, 'announcements': 50},
+    'small': {'organizations': 50, 'users': 20000, 'classes': 500, 'attendance': 200000,
+              'discussions': 10000, 'replies': 30000, 'resources': 5000, 'announcements': 1000},
+    'large': {'organizations': 500, 'users': 200000, 'classes': 5000, 'attendance': 2000000,
+              'discussions': 100000, 'replies': 300000, 'resources': 50000, 'announcements': 10000},
+}
+
+TEACHER_SHARE = 0.1
+CLASSES_PER_STUDENT = 2
+ATTENDANCE_STATUSES = ('present', 'present', 'present', 'present', 'late', 'absent', 'excused')
+RESOURCE_TYPES = ('note', 'video', 'pdf', 'photo', 'document', 'link', 'other')
+RESOURCE_CATEGORIES = ('assignment', 'note', 'test_paper', 'practice', 'other')
+DISCUSSION_CATEGORIES = ('general', 'academic', 'events', 'resources')
+PRIORITIES = ('low', 'normal', 'normal', 'high', 'urgent')
+
+WORDS = ('lesson plan homework exam revision chapter worksheet project lab syllabus term grade '
+         'reading fractions algebra biology history poetry essay quiz notes practice schedule').split()
+
+# The schema the resource routes query. init_database also has an older
+# resources definition first, which is what a brand-new file would get.
+RESOURCES_DDL = """
+    CREATE TABLE IF NOT EXISTS resources (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        description TEXT,
+        resource_type TEXT NOT NULL CHECK (resource_type IN ('note', 'video', 'pdf', 'photo', 'document', 'link', 'other')),
+        file_path TEXT,
+        file_name TEXT,
+        file_size INTEGER,
+        external_url TEXT,
+        grade_level INTEGER,
+        subject_id INTEGER,
+        class_id INTEGER,
+        organization_id INTEGER,
+        uploaded_by INTEGER NOT NULL,
+        tags TEXT,
+        is_public BOOLEAN DEFAULT 1,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        resource_category TEXT DEFAULT 'other',
+        due_date DATE
+    )
+"""
+
+
+def scale_counts(scale, overrides=None):
+    """Row counts for a named scale, with any per-table overrides applied"""
+    counts = dict(SCALES[scale])
+    counts.update({name: value for name, value in (overrides or {}).items() if value is not None})
+    return counts
+
+
+def meta_path(db_path):
+    return db_path + '.json'
+
+
+def load_meta(db_path):
+    try:
+        with open(meta_path(db_path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def prepare_schema(db_path):
+    """Create the tables init_database would otherwise create in their legacy form"""
+    conn = sqlite3.connect(db_path)
+    conn.execute(RESOURCES_DDL)
+    conn.commit()
+    conn.close()
+
+
+def init_app_schema(db_path):
+    """Run the app's own init_database against db_path (importing web_app binds it to DATABASE_URL)"""
+    sys.path.insert(0, ROOT)
+    from web_app import WebDatabaseManager
+    WebDatabaseManager('sqlite:///' + db_path)
+
+
+def _text(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def _timestamp(rng, days=365):
+    moment = BASE_TIME - timedelta(seconds=rng.randrange(days * 86400))
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def populate(db_path, counts, seed=1):
+    """Insert the synthetic rows; returns the dataset description"""
+    from werkzeug.security import generate_password_hash
+
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA journal_mode = MEMORY')
+    subject_ids = [row[0] for row in conn.execute('SELECT id FROM subjects')]
+    password_hash = generate_password_hash(PASSWORD)
+    started = time.perf_counter()
+
+    def progress(table, rows):
+        print(f"  {table:<28} {rows:>10,} rows  ({time.perf_counter() - started:.1f}s)")
+
+    # Users: a tenth are teachers, split evenly across organizations
+    n_orgs = counts['organizations']
+    first_user = (conn.execute('SELECT COALESCE(MAX(id), 0) FROM users').fetchone()[0]) + 1
+    users = []
+    org_teachers = {org: [] for org in range(n_orgs)}
+    org_students = {org: [] for org in range(n_orgs)}
+    for i in range(counts['users']):
+        user_id = first_user + i
+        org = i % n_orgs
+        is_teacher = (i // n_orgs) % round(1 / TEACHER_SHARE) == 0
+        user_type = 'teacher' if is_teacher else 'student'
+        (org_teachers if is_teacher else org_students)[org].append(user_id)
+        users.append((user_id, f'{user_type}{user_id}', f'{user_type}{user_id}@bench.example', password_hash,
+                      rng.choice(WORDS).title(), rng.choice(WORDS).title(), user_type))
+    conn.executemany("""
+        INSERT INTO users (id, username, email, password_hash, first_name, last_name, user_type)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, users)
+    usernames = {user[0]: user[1] for user in users}
+    del users
+    progress('users', counts['users'])
+
+    # Organizations, owned by their first teacher; everyone is a member of one
+    first_org = (conn.execute('SELECT COALESCE(MAX(id), 0) FROM organizations').fetchone()[0]) + 1
+    org_ids = [first_org + org for org in range(n_orgs)]
+    conn.executemany("""
+        INSERT INTO organizations (id, name, description, created_by, created_at) VALUES (?, ?, ?, ?, ?)
+    """, [(org_ids[org], f'Bench School {org + 1}', _text(rng, 8), org_teachers[org][0], _timestamp(rng))
+          for org in range(n_orgs)])
+    # organization_tag is added by a migration that SQLite can reject, so it may be missing
+    if 'organization_tag' in [row[1] for row in conn.execute('PRAGMA table_info(organizations)')]:
+        conn.executemany("UPDATE organizations SET organization_tag = ? WHERE id = ?",
+                         [(f'BENCH{org + 1:05d}', org_ids[org]) for org in range(n_orgs)])
+    memberships = []
+    for org in range(n_orgs):
+        for position, teacher in enumerate(org_teachers[org]):
+            memberships.append((org_ids[org], teacher, 'owner' if position == 0 else 'teacher'))
+        memberships.extend((org_ids[org], student, 'student') for student in org_students[org])
+    conn.executemany("INSERT INTO organization_memberships (organization_id, user_id, role) VALUES (?, ?, ?)",
+                     memberships)
+    progress('organization_memberships', len(memberships))
+    del memberships
+
+    # Classes spread across organizations, each student enrolled in a couple of them
+    first_class = (conn.execute('SELECT COALESCE(MAX(id), 0) FROM classes').fetchone()[0]) + 1
+    org_classes = {org: [] for org in range(n_orgs)}
+    classes = []
+    for i in range(counts['classes']):
+        class_id = first_class + i
+        org = i % n_orgs
+        org_classes[org].append(class_id)
+        classes.append((class_id, f'Class {i + 1}', _text(rng, 5), rng.choice(subject_ids), rng.randint(1, 12),
+                        rng.choice(org_teachers[org]), org_ids[org]))
+    conn.executemany("""
+        INSERT INTO classes (id, name, description, subject_id, grade_level, teacher_id, organization_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, classes)
+    progress('classes', len(classes))
+    class_teacher = {row[0]: row[5] for row in classes}
+    del classes
+
+    student_classes = {}
+    enrollments = []
+    for org in range(n_orgs):
+        if not org_classes[org]:
+            continue
+        for student in org_students[org]:
+            picked = rng.sample(org_classes[org], min(CLASSES_PER_STUDENT, len(org_classes[org])))
+            student_classes[student] = (org, picked)
+            enrollments.extend((class_id, student) for class_id in picked)
+    conn.executemany("INSERT INTO class_students (class_id, student_id) VALUES (?, ?)", enrollments)
+    progress('class_students', len(enrollments))
+    del enrollments
+
+    # Attendance: consecutive school days per student (one row per student and date)
+    students = list(student_classes)
+    attendance = []
+    if students:
+        per_student, extra = divmod(counts['attendance'], len(students))
+        for position, student in enumerate(students):
+            org, picked = student_classes[student]
+            days = per_student + (1 if position < extra else 0)
+            for day in range(days):
+                class_id = picked[day % len(picked)]
+                attendance.append((student, class_id, org_ids[org],
+                                   (BASE_TIME.date() - timedelta(days=day)).isoformat(),
+                                   rng.choice(ATTENDANCE_STATUSES), class_teacher[class_id]))
+            if len(attendance) >= 200000:
+                conn.executemany("""
+                    INSERT INTO attendance (student_id, class_id, organization_id, date, status, marked_by)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                """, attendance)
+                attendance = []
+        conn.executemany("""
+            INSERT INTO attendance (student_id, class_id, organization_id, date, status, marked_by)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, attendance)
+    progress('attendance', counts['attendance'] if students else 0)
+    del attendance
+
+    # Discussions and replies by members of the same organization
+    first_discussion = (conn.execute('SELECT COALESCE(MAX(id), 0) FROM discussions').fetchone()[0]) + 1
+    discussion_org = []
+    discussions = []
+    for i in range(counts['discussions']):
+        org = rng.randrange(n_orgs)
+        discussion_org.append(org)
+        created = _timestamp(rng)
+        discussions.append((first_discussion + i, _text(rng, 6).capitalize(), _text(rng, 60),
+                            rng.choice(org_teachers[org]), rng.choice(DISCUSSION_CATEGORIES), org_ids[org],
+                            created, created))
+    conn.executemany("""
+        INSERT INTO discussions (id, title, content, author_id, category, organization_id, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, discussions)
+    progress('discussions', len(discussions))
+    del discussions
+
+    replies = []
+    for _ in range(counts['replies'] if discussion_org else 0):
+        index = rng.randrange(len(discussion_org))
+        org = discussion_org[index]
+        author = rng.choice(org_teachers[org] + org_students[org][:50])
+        replies.append((first_discussion + index, author, _text(rng, 25), _timestamp(rng)))
+    conn.executemany("""
+        INSERT INTO discussion_replies (discussion_id, author_id, content, created_at) VALUES (?, ?, ?, ?)
+    """, replies)
+    progress('discussion_replies', len(replies))
+    del replies
+
+    # Resources uploaded by teachers, attached to a class of their organization
+    resources = []
+    for i in range(counts['resources']):
+        org = rng.randrange(n_orgs)
+        class_id = rng.choice(org_classes[org]) if org_classes[org] else None
+        category = rng.choice(RESOURCE_CATEGORIES)
+        created = _timestamp(rng)
+        resources.append((_text(rng, 4).capitalize(), _text(rng, 20), rng.choice(RESOURCE_TYPES),
+                          rng.randint(1, 12), rng.choice(subject_ids), class_id, org_ids[org],
+                          rng.choice(org_teachers[org]), category,
+                          (BASE_TIME + timedelta(days=rng.randint(1, 30))).date().isoformat()
+                          if category == 'assignment' else None, created, created))
+    conn.executemany("""
+        INSERT INTO resources (title, description, resource_type, grade_level, subject_id, class_id,
+                               organization_id, uploaded_by, resource_category, due_date, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, resources)
+    progress('resources', len(resources))
+    del resources
+
+    announcements = []
+    for i in range(counts['announcements']):
+        org = i % n_orgs
+        created = _timestamp(rng, days=90)
+        announcements.append((_text(rng, 5).capitalize(), _text(rng, 40), org_ids[org], org_teachers[org][0],
+                              rng.choice(PRIORITIES), 1 if rng.random() < 0.05 else 0, created, created))
+    conn.executemany("""
+        INSERT INTO announcements (title, content, organization_id, author_id, priority, is_pinned, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, announcements)
+    progress('announcements', len(announcements))
+
+    conn.commit()
+    conn.close()
+
+    return {
+        'counts': counts,
+        'seed': seed,
+        'password': PASSWORD,
+        'organizations': [
+            {
+                'id': org_ids[org],
+                'owner': usernames[org_teachers[org][0]],
+                'teachers': len(org_teachers[org]),
+                'students': org_students[org][:200],
+                'discussions': [first_discussion + i for i, o in enumerate(discussion_org) if o == org][:200],
+            }
+            for org in range(n_orgs)
+        ],
+    }
+
+
+def is_current(db_path, counts, seed):
+    meta = load_meta(db_path)
+    return bool(meta and os.path.exists(db_path) and meta['counts'] == counts and meta['seed'] == seed)
+
+
+def build(db_path, scale, counts, seed):
+    """Generate db_path in this process (imports web_app; see ensure_dataset)"""
+    for path in (db_path, meta_path(db_path)):
+        if os.path.exists(path):
+            os.remove(path)
+    print(f"Generating synthetic dataset {db_path} ({scale})")
+    prepare_schema(db_path)
+    init_app_schema(db_path)
+    meta = populate(db_path, counts, seed)
+    meta['scale'] = scale
+    with open(meta_path(db_path), 'w') as f:
+        json.dump(meta, f)
+    return meta
+
+
+def ensure_dataset(db_path, scale='tiny', overrides=None, seed=1):
+    """Return the description of db_path, generating it first if it is missing or stale
+
+    Generation runs in a child process so the caller can still import
+    web_app against its own DATABASE_URL afterwards.
+    """
+    counts = scale_counts(scale, overrides)
+    if not is_current(db_path, counts, seed):
+        command = [sys.executable, os.path.abspath(__file__), '--out', db_path, '--scale', scale, '--seed', str(seed)]
+        for table, value in counts.items():
+            command += [f'--{table}', str(value)]
+        subprocess.run(command, check=True)
+    return load_meta(db_path)
+
+
+def add_scale_arguments(parser):
+    """--scale/--seed and per-table count overrides shared by the benchmark scripts"""
+    parser.add_argument('--scale', choices=sorted(SCALES), default='tiny')
+    parser.add_argument('--seed', type=int, default=1)
+    for table in SCALES['tiny']:
+        parser.add_argument(f'--{table}', type=int, help=f'override the number of {table}')
+
+
+def scale_overrides(args):
+    return {table: getattr(args, table) for table in SCALES['tiny']}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic StaffRoom database')
+    parser.add_argument('--out', required=True, help='SQLite file to create')
+    add_scale_arguments(parser)
+    args = parser.parse_args()
+    out = os.path.abspath(args.out)
+    counts = scale_counts(args.scale, scale_overrides(args))
+    if is_current(out, counts, args.seed):
+        print(f"{out} is already up to date")
+        return 0
+    workdir = tempfile.mkdtemp(prefix='staffroom-synthetic-')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + out
+    os.environ['QUERY_CACHE_PATH'] = os.path.join(workdir, 'query_cache.db')
+    os.environ['METRICS_DIR'] = os.path.join(workdir, 'metrics')
+    os.environ['PROFILE_DIR'] = os.path.join(workdir, 'profiles')
+    os.environ['SLOW_QUERY_LOG'] = os.path.join(workdir, 'slow_queries.log')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    # Registered before web_app is imported so it runs after the app's own exit hooks
+    atexit.register(shutil.rmtree, workdir, True)
+    build(out, args.scale, counts, args.seed)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
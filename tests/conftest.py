@@ -0,0 +1,11 @@
+"""
+Tests for the web support package
+Run from the repository root with `python -m pytest tests`. They import
+the web/ modules directly and never import web_app, which binds to
+DATABASE_URL on import.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
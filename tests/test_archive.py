@@ -0,0 +1,178 @@
+import logging
+import sqlite3
+from datetime import date
+
+import pytest
+
+from web.archive import Archiver, academic_year_start
+from web.database import connect
+
+SCHEMA = """
+CREATE TABLE attendance (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    student_id INTEGER NOT NULL,
+    class_id INTEGER,
+    organization_id INTEGER,
+    date DATE NOT NULL,
+    status TEXT NOT NULL CHECK (status IN ('present', 'absent', 'late', 'excused')),
+    marked_by INTEGER NOT NULL,
+    notes TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(student_id, date)
+);
+CREATE TABLE discussion_replies (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    discussion_id INTEGER NOT NULL,
+    author_id INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE assignment_submissions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    assignment_id INTEGER NOT NULL,
+    student_id INTEGER NOT NULL,
+    content TEXT,
+    submission_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    grade REAL,
+    status TEXT DEFAULT 'submitted',
+    UNIQUE(assignment_id, student_id)
+);
+"""
+
+CUTOFF = '2025-08-01'
+
+
+@pytest.fixture
+def archiver(tmp_path):
+    live = str(tmp_path / 'live.db')
+    db = sqlite3.connect(live)
+    db.executescript(SCHEMA)
+    db.executemany("INSERT INTO attendance (student_id, class_id, date, status, marked_by) VALUES (?, 1, ?, ?, 2)", [
+        (5, '2025-03-02', 'present'), (6, '2025-07-31', 'late'), (5, '2025-08-01', 'absent'), (6, '2026-09-14', 'present'),
+    ])
+    db.executemany("INSERT INTO discussion_replies (discussion_id, author_id, content, created_at) VALUES (1, 2, ?, ?)", [
+        ('old', '2024-11-05 10:00:00'), ('last night', '2025-07-31 23:59:59'), ('new', '2025-08-01 00:00:00'),
+    ])
+    db.executemany("""INSERT INTO assignment_submissions (assignment_id, student_id, content, submission_date, grade)
+                      VALUES (?, ?, ?, ?, ?)""", [
+        (10, 5, 'essay', '2025-05-01 09:00:00', None), (10, 6, 'essay 2', '2025-06-01 09:00:00', 75.0),
+        (11, 5, 'report', '2025-10-01 09:00:00', None),
+    ])
+    db.commit()
+    db.close()
+    archiver = Archiver(lambda: connect('sqlite:///' + live), str(tmp_path / 'archive.db'), batch_size=2, pause=0)
+    archiver.cutoff = lambda today=None: CUTOFF
+    return archiver
+
+
+def rows(archiver, table, schema='main', order='id'):
+    conn = archiver._connect()
+    try:
+        return [tuple(row) for row in conn.execute(f"SELECT * FROM {schema}.{table} ORDER BY {order}").fetchall()]
+    finally:
+        conn.close()
+
+
+def union(archiver, table, since=None):
+    conn = archiver._connect()
+    try:
+        return [tuple(row) for row in conn.execute(f"SELECT * FROM {archiver.source(conn, table, since)} ORDER BY id")]
+    finally:
+        conn.close()
+
+
+def test_cutoff_follows_academic_years():
+    archiver = Archiver(None, 'unused.db')
+    assert academic_year_start(date(2026, 7, 31)) == date(2025, 8, 1)
+    assert archiver.cutoff(date(2026, 7, 31)) == '2025-08-01'
+    assert archiver.cutoff(date(2026, 8, 1)) == '2026-08-01'
+    assert Archiver(None, 'unused.db', keep_years=2).cutoff(date(2026, 8, 1)) == '2025-08-01'
+    assert Archiver(None, 'unused.db', year_start=(9, 1)).cutoff(date(2026, 8, 31)) == '2025-09-01'
+
+
+@pytest.mark.parametrize('since, covered', [
+    (None, True),
+    ('2025-07-31', True),
+    ('2025-07-31 23:59:59', True),
+    ('2025-08-01', False),
+    ('2025-08-01 00:00:00', False),
+    ('2026-01-01', False),
+])
+def test_covers_boundary(archiver, since, covered):
+    assert archiver.covers(since) is covered
+
+
+def test_source_is_live_table_after_boundary(archiver):
+    archiver.run()
+    conn = archiver._connect()
+    try:
+        assert archiver.source(conn, 'attendance', '2025-08-01') == 'attendance'
+        assert 'archive.attendance' in archiver.source(conn, 'attendance', '2025-07-31')
+    finally:
+        conn.close()
+
+
+def test_run_moves_rows_before_the_cutoff(archiver):
+    before = {table: rows(archiver, table) for table in ('attendance', 'discussion_replies', 'assignment_submissions')}
+    assert archiver.run() == {'attendance': 2, 'discussion_replies': 2, 'assignment_submissions': 2}
+    assert [row[4] for row in rows(archiver, 'attendance')] == ['2025-08-01', '2026-09-14']
+    assert [row[3] for row in rows(archiver, 'discussion_replies', 'archive')] == ['old', 'last night']
+    assert [row[3] for row in rows(archiver, 'discussion_replies')] == ['new']
+    for table, original in before.items():
+        assert union(archiver, table) == original
+        assert union(archiver, table, CUTOFF) == rows(archiver, table)
+    assert archiver.run() == {'attendance': 0, 'discussion_replies': 0, 'assignment_submissions': 0}
+
+
+def test_archive_restore_rearchive(archiver):
+    original = rows(archiver, 'assignment_submissions')
+    archiver.run()
+    assert archiver.restore('assignment_submissions', 'assignment_id = ? AND student_id = ?', (10, 6)) == 1
+    assert rows(archiver, 'assignment_submissions')[0] == original[1]
+    assert [row[0] for row in rows(archiver, 'assignment_submissions', 'archive')] == [original[0][0]]
+    assert archiver.restore('assignment_submissions', 'id = ?', (original[1][0],)) == 0
+
+    conn = archiver._connect()
+    conn.execute("UPDATE assignment_submissions SET grade = 82 WHERE id = ?", (original[1][0],))
+    conn.commit()
+    conn.close()
+    assert archiver.run()['assignment_submissions'] == 1
+    assert rows(archiver, 'assignment_submissions') == [original[2]]
+    regraded = union(archiver, 'assignment_submissions')
+    assert [row[5] for row in regraded] == [None, 82.0, None]
+    assert archiver.stats()['restored'] == 1 and archiver.stats()['dropped'] == 0
+
+
+def test_restore_drops_archived_row_when_live_row_has_its_key(archiver, caplog):
+    archiver.run()
+    conn = archiver._connect()
+    conn.execute("""INSERT INTO attendance (student_id, class_id, date, status, marked_by)
+                    VALUES (5, 1, '2025-03-02', 'excused', 3)""")
+    conn.commit()
+    conn.close()
+    with caplog.at_level(logging.WARNING, logger='web.archive'):
+        assert archiver.restore('attendance', 'student_id = ? AND date = ?', (5, '2025-03-02')) == 0
+    assert 'Dropped 1 archived attendance rows' in caplog.text
+    assert archiver.stats()['dropped'] == 1
+    assert [row[5] for row in rows(archiver, 'attendance') if row[4] == '2025-03-02'] == ['excused']
+    assert [row[4] for row in rows(archiver, 'attendance', 'archive')] == ['2025-07-31']
+
+
+def test_rows_left_in_both_files_are_archived_once(archiver):
+    archiver.ensure_schema()
+    conn = archiver._connect()
+    # As if a crash came between committing the archive copy and the live delete
+    conn.execute("INSERT INTO archive.discussion_replies SELECT * FROM main.discussion_replies WHERE content = 'old'")
+    conn.commit()
+    conn.close()
+    archiver.run()
+    assert [row[3] for row in union(archiver, 'discussion_replies')] == ['old', 'last night', 'new']
+
+
+def test_boundary_keeps_a_later_recorded_cutoff(archiver):
+    archiver.run()
+    wider = Archiver(archiver.connect, archiver.path, keep_years=2)
+    wider.cutoff = lambda today=None: '2024-08-01'
+    wider.ensure_schema()
+    assert wider.boundary() == CUTOFF
+    assert wider.covers('2025-07-31') and not wider.covers(CUTOFF)
@@ -0,0 +1,34 @@
+import sqlite3
+
+from web import cache
+from web.cache import QueryCache
+
+
+def last_used(path, key):
+    return sqlite3.connect(path).execute("SELECT last_used FROM cache_entries WHERE key = ?", (key,)).fetchone()[0]
+
+
+def test_hit_only_touches_stale_entries(tmp_path, monkeypatch):
+    path = str(tmp_path / 'qc.db')
+    qc = QueryCache(path)
+    clock = [1000.0]
+    monkeypatch.setattr(cache.time, 'time', lambda: clock[0])
+    qc.set('k', qc.stamp(['users']), [1, 2])
+
+    clock[0] += cache.TOUCH_INTERVAL / 2
+    assert qc.get('k', ['users']) == (True, [1, 2])
+    assert last_used(path, 'k') == 1000.0
+
+    clock[0] += cache.TOUCH_INTERVAL
+    assert qc.get('k', ['users']) == (True, [1, 2])
+    assert last_used(path, 'k') == clock[0]
+
+
+def test_generation_bump_invalidates_across_instances(tmp_path):
+    path = str(tmp_path / 'qc.db')
+    reader, writer = QueryCache(path), QueryCache(path)
+    reader.set('k', reader.stamp(['users', 'classes']), 'v')
+    writer.invalidate(['subjects'])
+    assert reader.get('k', ['users', 'classes']) == (True, 'v')
+    writer.invalidate(['classes'])
+    assert reader.get('k', ['users', 'classes']) == (False, None)
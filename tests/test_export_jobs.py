@@ -0,0 +1,120 @@
+import json
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from web import exports
+from web.exports import ExportJobs, ExportLimitError
+
+
+def wait(jobs, job_id, statuses=('done', 'failed')):
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        job = jobs.get(job_id)
+        if job['status'] in statuses:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} still {job['status']}")
+
+
+def blocked(release):
+    def produce():
+        release.wait(5)
+        yield b'a,b\n'
+    return produce
+
+
+def test_job_runs_to_a_file(tmp_path):
+    jobs = ExportJobs(str(tmp_path))
+    job = jobs.start(lambda: iter([b'a,b\n', b'1,2\n']), user_id=1, format='csv')
+    assert job['status'] == 'queued'
+    done = wait(jobs, job['id'])
+    assert done['status'] == 'done' and done['bytes'] == 8
+    with open(jobs.path(done), 'rb') as f:
+        assert f.read() == b'a,b\n1,2\n'
+
+
+def test_failed_produce_marks_job_failed(tmp_path):
+    def produce():
+        yield b'a\n'
+        raise RuntimeError('query failed')
+    jobs = ExportJobs(str(tmp_path))
+    job = wait(jobs, jobs.start(produce, user_id=1, format='csv')['id'])
+    assert job['status'] == 'failed' and job['error'] == 'query failed'
+
+
+def test_per_user_limit(tmp_path):
+    release = threading.Event()
+    jobs = ExportJobs(str(tmp_path), workers=1, per_user=2)
+    started = [jobs.start(blocked(release), user_id=1, format='csv') for _ in range(2)]
+    with pytest.raises(ExportLimitError):
+        jobs.start(blocked(release), user_id=1, format='csv')
+    started.append(jobs.start(blocked(release), user_id=2, format='csv'))
+    release.set()
+    for job in started:
+        wait(jobs, job['id'])
+    assert jobs.unfinished(1) == 0
+    assert wait(jobs, jobs.start(lambda: iter([b'x']), user_id=1, format='csv')['id'])['status'] == 'done'
+
+
+def test_pending_limit_bounds_the_queue(tmp_path):
+    release = threading.Event()
+    jobs = ExportJobs(str(tmp_path), workers=1, max_pending=2, per_user=10)
+    started = [jobs.start(blocked(release), user_id=n, format='csv') for n in range(2)]
+    with pytest.raises(ExportLimitError):
+        jobs.start(blocked(release), user_id=3, format='csv')
+    release.set()
+    for job in started:
+        wait(jobs, job['id'])
+    assert jobs._pending == 0
+
+
+def test_stale_job_is_reported_failed(tmp_path, monkeypatch):
+    release = threading.Event()
+    jobs = ExportJobs(str(tmp_path), workers=1, stale_after=60)
+    job = jobs.start(blocked(release), user_id=1, format='csv')
+    assert wait(jobs, job['id'], ('running',))['status'] == 'running'
+    now = time.time()
+    monkeypatch.setattr(exports.time, 'time', lambda: now + 120)
+    stale = jobs.get(job['id'])
+    assert stale['status'] == 'failed' and 'stopped' in stale['error']
+    assert jobs.unfinished(1) == 0
+    monkeypatch.undo()
+    release.set()
+    wait(jobs, job['id'])
+
+
+def test_queued_job_waits_however_long_its_worker_is_busy(tmp_path, monkeypatch):
+    release = threading.Event()
+    jobs = ExportJobs(str(tmp_path), workers=1, stale_after=60)
+    running = jobs.start(blocked(release), user_id=1, format='csv')
+    queued = jobs.start(blocked(release), user_id=1, format='csv')
+    assert wait(jobs, running['id'], ('running',))['status'] == 'running'
+    now = time.time()
+    monkeypatch.setattr(exports.time, 'time', lambda: now + 120)
+    assert jobs.get(queued['id'])['status'] == 'queued'
+    # The running job has missed its heartbeat by now; the queued one still counts
+    assert jobs.get(running['id'])['status'] == 'failed'
+    assert jobs.unfinished(1) == 1
+    monkeypatch.undo()
+    release.set()
+    assert wait(jobs, queued['id'])['status'] == 'done'
+
+
+def test_queued_job_of_an_exited_worker_is_reported_failed(tmp_path):
+    jobs = ExportJobs(str(tmp_path))
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    job = {'id': 'a' * 32, 'status': 'queued', 'user_id': 1, 'format': 'csv', 'created_at': time.time(),
+           'updated_at': time.time(), 'pid': process.pid, 'host': exports.socket.gethostname()}
+    with open(tmp_path / f"{job['id']}.json", 'w') as f:
+        json.dump(job, f)
+    assert jobs.get(job['id'])['status'] == 'failed'
+    assert jobs.unfinished(1) == 0
+    job.update(host='elsewhere')
+    with open(tmp_path / f"{job['id']}.json", 'w') as f:
+        json.dump(job, f)
+    assert jobs.get(job['id'])['status'] == 'queued'
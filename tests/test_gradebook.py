@@ -0,0 +1,92 @@
+from datetime import datetime
+
+import pytest
+
+from web import gradebook
+
+STUDENTS = [{'id': 7, 'name': 'Ada'}, {'id': 3, 'name': 'Ben'}, {'id': 12, 'name': 'Cy'}]
+ASSIGNMENTS = [
+    {'id': 40, 'title': 'Essay', 'due_date': '2026-09-10'},
+    {'id': 41, 'title': 'Quiz', 'due_date': '2026-09-20 17:00:00'},
+    {'id': 42, 'title': 'Project', 'due_date': None},
+    {'id': 43, 'title': 'Unset', 'due_date': '2026-10-01'},
+]
+CELLS = [
+    (7, 40, 90, 'graded', '2026-09-10 23:59:00'),
+    (3, 40, 89.999, 'graded', '2026-09-11 08:00:00'),
+    (12, 40, 59.5, 'graded', datetime(2026, 9, 9, 12, 0)),
+    (7, 41, 60, 'graded', '2026-09-21'),
+    (3, 41, None, 'submitted', '2026-09-19'),
+    (7, 42, 71, None, '2026-12-01'),
+    (12, 42, 100, 'returned', None),
+    (99, 40, 10, 'graded', '2026-09-01'),  # no longer in the class
+    (3, 77, 10, 'graded', '2026-09-01'),  # not an assignment of the class
+]
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def backend(request, monkeypatch):
+    if request.param == 'numpy':
+        if gradebook.numpy is None:
+            pytest.skip('NumPy is not installed')
+    else:
+        monkeypatch.setattr(gradebook, 'numpy', None)
+    return request.param
+
+
+def test_grid(backend):
+    book = gradebook.build(STUDENTS, ASSIGNMENTS, CELLS)
+    assert book['grades'] == [[90.0, 60.0, 71.0, None], [89.999, None, None, None], [59.5, None, 100.0, None]]
+    assert book['status'] == [
+        ['graded', 'graded', 'submitted', 'missing'],
+        ['graded', 'submitted', 'missing', 'missing'],
+        ['graded', 'missing', 'returned', 'missing'],
+    ]
+    assert book['late'] == [[False, True, False, False], [True, False, False, False], [False, False, False, False]]
+
+
+def test_student_statistics(backend):
+    students = gradebook.build(STUDENTS, ASSIGNMENTS, CELLS)['students']
+    assert [(s['name'], s['average'], s['graded'], s['submitted'], s['late']) for s in students] == [
+        ('Ada', 73.67, 3, 3, 1), ('Ben', 90.0, 1, 2, 1), ('Cy', 79.75, 2, 2, 0)]
+
+
+def test_assignment_statistics(backend):
+    essay, quiz, project, unset = gradebook.build(STUDENTS, ASSIGNMENTS, CELLS)['assignments']
+    assert (essay['graded'], essay['mean'], essay['median'], essay['stddev']) == (3, 79.83, 90.0, 14.38)
+    assert essay['distribution'] == {'90-100': 1, '80-89': 1, '70-79': 0, '60-69': 0, '0-59': 1}
+    assert (essay['submitted'], essay['late']) == (3, 1)
+    assert (quiz['graded'], quiz['mean'], quiz['median'], quiz['stddev'], quiz['submitted']) == (1, 60.0, 60.0, 0.0, 2)
+    assert quiz['distribution']['60-69'] == 1
+    assert (project['mean'], project['median'], project['stddev'], project['late']) == (85.5, 85.5, 14.5, 0)
+    assert unset['graded'] == 0 and unset['submitted'] == 0
+    assert (unset['mean'], unset['median'], unset['stddev']) == (None, None, None)
+    assert sum(unset['distribution'].values()) == 0
+    assert unset['title'] == 'Unset' and unset['due_date'] == '2026-10-01'
+
+
+def test_backends_agree(monkeypatch):
+    if gradebook.numpy is None:
+        pytest.skip('NumPy is not installed')
+    with_numpy = gradebook.build(STUDENTS, ASSIGNMENTS, CELLS)
+    monkeypatch.setattr(gradebook, 'numpy', None)
+    assert gradebook.build(STUDENTS, ASSIGNMENTS, CELLS) == with_numpy
+
+
+@pytest.mark.parametrize('students, assignments, cells', [
+    ([], ASSIGNMENTS, []),
+    (STUDENTS, [], []),
+    (STUDENTS, ASSIGNMENTS, []),
+])
+def test_empty(backend, students, assignments, cells):
+    book = gradebook.build(students, assignments, cells)
+    assert len(book['grades']) == len(students)
+    assert all(s['average'] is None and s['graded'] == 0 for s in book['students'])
+    assert all(a['mean'] is None and a['submitted'] == 0 for a in book['assignments'])
+
+
+def test_is_late_compares_days():
+    assert not gradebook.is_late('2026-09-10 23:59:59', '2026-09-10')
+    assert gradebook.is_late('2026-09-11 00:00:00', '2026-09-10 17:00:00')
+    assert not gradebook.is_late(None, '2026-09-10')
+    assert not gradebook.is_late('2026-09-11', None)
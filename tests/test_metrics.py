@@ -0,0 +1,83 @@
+import json
+import os
+import subprocess
+import sys
+
+from flask import Flask
+
+from web.metrics import Metrics
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def write_snapshot(directory, name, requests, latency):
+    with open(os.path.join(directory, name), 'w') as f:
+        json.dump({
+            'counters': [['staffroom_http_requests_total', [['endpoint', 'index']], requests]],
+            'histograms': [['staffroom_http_request_duration_seconds', [['endpoint', 'index']],
+                            {'buckets': [0.1, 1.0], 'counts': [latency, latency], 'sum': 0.05 * latency,
+                             'count': latency}]],
+        }, f)
+
+
+def test_exited_workers_are_folded_into_one_file(tmp_path):
+    directory = str(tmp_path)
+    metrics = Metrics(directory=directory)
+    write_snapshot(directory, f'metrics-{dead_pid()}-1.json', 3, 2)
+    write_snapshot(directory, f'metrics-{dead_pid()}-2.json', 4, 1)
+    write_snapshot(directory, f'metrics-{os.getppid()}-3.json', 5, 5)
+
+    first = metrics.render()
+    assert 'staffroom_http_requests_total{endpoint="index"} 12' in first
+    assert 'staffroom_http_request_duration_seconds_count{endpoint="index"} 8' in first
+    files = sorted(os.listdir(directory))
+    assert 'retired.json' in files
+    assert [name for name in files if name.startswith('metrics-')] == sorted([
+        f'metrics-{os.getppid()}-3.json', os.path.basename(metrics._snapshot_path())])
+    assert metrics.render() == first
+
+
+def test_fold_interrupted_before_delete_is_not_counted_twice(tmp_path):
+    directory = str(tmp_path)
+    metrics = Metrics(directory=directory)
+    name = f'metrics-{dead_pid()}-1.json'
+    write_snapshot(directory, name, 3, 2)
+    metrics.render()
+    write_snapshot(directory, name, 3, 2)
+    with open(os.path.join(directory, 'retired.json')) as f:
+        retired = json.load(f)
+    retired['folded'] = [name]
+    with open(os.path.join(directory, 'retired.json'), 'w') as f:
+        json.dump(retired, f)
+
+    assert 'staffroom_http_requests_total{endpoint="index"} 3' in metrics.render()
+    assert not os.path.exists(os.path.join(directory, name))
+
+
+def test_endpoint_needs_admin_or_token(tmp_path):
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    Metrics(app, directory=str(tmp_path), token='s3cret')
+    client = app.test_client()
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer s3cret'}).status_code == 200
+    with client.session_transaction() as session:
+        session['user_type'] = 'teacher'
+    assert client.get('/metrics').status_code == 401
+    with client.session_transaction() as session:
+        session['user_type'] = 'admin'
+    assert client.get('/metrics').status_code == 200
+
+
+def test_endpoint_without_token_is_admin_only(tmp_path):
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    Metrics(app, directory=str(tmp_path))
+    client = app.test_client()
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer '}).status_code == 401
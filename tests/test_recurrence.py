@@ -0,0 +1,186 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from web.recurrence import MAX_OCCURRENCES, OccurrenceCache, Rule, parse
+
+
+def brute_force(rule, dtstart, start, end):
+    """Occurrences by checking every day from dtstart, applying COUNT before EXDATE as RFC 5545 does"""
+    days = rule.byday or (dtstart.weekday(),)
+    week0 = dtstart.date() - timedelta(days=dtstart.weekday())
+    found, n, day = [], 0, dtstart
+    while day <= end and (rule.count is None or n < rule.count):
+        if rule.freq == 'DAILY':
+            match = (day - dtstart).days % rule.interval == 0
+        elif rule.freq == 'WEEKLY':
+            week = (day.date() - timedelta(days=day.weekday()) - week0).days // 7
+            match = day.weekday() in days and week % rule.interval == 0
+        else:
+            months = (day.year - dtstart.year) * 12 + day.month - dtstart.month
+            match = day.day == dtstart.day and months % rule.interval == 0
+        if match:
+            if rule.until is not None and day > rule.until:
+                break
+            n += 1
+            if day >= start and day not in rule.exdates:
+                found.append(day)
+        day += timedelta(days=1)
+    return found
+
+
+@pytest.mark.parametrize('text, dtstart, start, end', [
+    ('FREQ=DAILY;INTERVAL=3', datetime(2026, 9, 1, 9), datetime(2026, 12, 1), datetime(2027, 1, 15)),
+    ('FREQ=DAILY;COUNT=10', datetime(2026, 9, 1, 9), datetime(2026, 9, 5), datetime(2026, 12, 1)),
+    ('FREQ=DAILY;BYDAY=MO,WE,FR;UNTIL=20261120', datetime(2026, 9, 2, 9), datetime(2026, 9, 1), datetime(2027, 1, 1)),
+    # dtstart on a Tuesday, which is not a listed day: the series starts on the Wednesday
+    ('FREQ=WEEKLY;BYDAY=MO,WE', datetime(2026, 9, 1, 9), datetime(2026, 8, 1), datetime(2026, 10, 1)),
+    ('FREQ=WEEKLY;INTERVAL=2;BYDAY=SU,TH;COUNT=7', datetime(2026, 9, 3, 15), datetime(2026, 9, 1), datetime(2027, 3, 1)),
+    ('FREQ=WEEKLY;INTERVAL=3', datetime(2026, 9, 4, 8), datetime(2027, 2, 1), datetime(2027, 6, 1)),
+    # Months without a 31st are skipped, and COUNT only counts real occurrences
+    ('FREQ=MONTHLY', datetime(2026, 1, 31, 9), datetime(2026, 1, 1), datetime(2027, 12, 31)),
+    ('FREQ=MONTHLY;COUNT=5', datetime(2026, 1, 31, 9), datetime(2026, 1, 1), datetime(2028, 1, 1)),
+    ('FREQ=MONTHLY;INTERVAL=12', datetime(2024, 2, 29, 9), datetime(2024, 1, 1), datetime(2033, 1, 1)),
+])
+def test_between_matches_brute_force(text, dtstart, start, end):
+    rule = parse(text)
+    assert rule.between(dtstart, start, end) == brute_force(rule, dtstart, start, end)
+
+
+def test_monthly_on_the_31st_skips_short_months():
+    starts = parse('FREQ=MONTHLY').between(datetime(2026, 1, 31, 9), None, datetime(2026, 8, 31, 23))
+    assert [d.month for d in starts] == [1, 3, 5, 7, 8]
+
+
+def test_byday_series_does_not_include_unlisted_dtstart():
+    starts = parse('FREQ=WEEKLY;BYDAY=MO,WE').between(datetime(2026, 9, 1, 9), None, datetime(2026, 9, 8, 23))
+    assert starts == [datetime(2026, 9, 2, 9), datetime(2026, 9, 7, 9)]
+
+
+@pytest.mark.parametrize('text, dtstart', [
+    ('FREQ=DAILY;COUNT=40', datetime(2026, 9, 1, 9)),
+    ('FREQ=DAILY;INTERVAL=2;COUNT=1', datetime(2026, 9, 1, 9)),
+    ('FREQ=WEEKLY;BYDAY=MO,WE,FR;COUNT=13', datetime(2026, 9, 2, 9)),
+    ('FREQ=WEEKLY;BYDAY=MO,WE;COUNT=5', datetime(2026, 9, 1, 9)),
+    ('FREQ=WEEKLY;INTERVAL=2;BYDAY=TU,SA;COUNT=9', datetime(2026, 9, 5, 9)),
+    ('FREQ=MONTHLY;COUNT=6', datetime(2026, 1, 31, 9)),
+])
+def test_count_bound_is_the_last_candidate(text, dtstart):
+    rule = parse(text)
+    starts = rule.between(dtstart, None, datetime(2030, 1, 1))
+    assert len(starts) == rule.count
+    assert rule.bound(dtstart) == starts[-1]
+
+
+def test_bound_is_until_or_none():
+    assert parse('FREQ=DAILY;UNTIL=20261218').bound(datetime(2026, 9, 1)) == datetime(2026, 12, 18, 23, 59, 59, 999999)
+    assert parse('FREQ=WEEKLY').bound(datetime(2026, 9, 1)) is None
+
+
+def test_exdate_removes_occurrence_without_shifting_count():
+    rule = parse('RRULE:FREQ=DAILY;COUNT=5\nEXDATE:20260903T090000')
+    assert rule.between(datetime(2026, 9, 1, 9), None, datetime(2027, 1, 1)) == [
+        datetime(2026, 9, 1, 9), datetime(2026, 9, 2, 9), datetime(2026, 9, 4, 9), datetime(2026, 9, 5, 9)]
+    assert not rule.occurs_at(datetime(2026, 9, 1, 9), datetime(2026, 9, 3, 9))
+    assert rule.occurs_at(datetime(2026, 9, 1, 9), datetime(2026, 9, 4, 9))
+
+
+def test_window_bounds_are_inclusive():
+    starts = parse('FREQ=DAILY').between(datetime(2026, 9, 1, 9), datetime(2026, 9, 3, 9), datetime(2026, 9, 5, 9))
+    assert starts == [datetime(2026, 9, 3, 9), datetime(2026, 9, 4, 9), datetime(2026, 9, 5, 9)]
+
+
+def test_open_ended_rule_needs_window_end():
+    with pytest.raises(ValueError):
+        parse('FREQ=DAILY').between(datetime(2026, 9, 1, 9))
+
+
+def test_cap_counts_from_window_start():
+    dtstart = datetime(2022, 1, 3, 9)
+    starts = parse('FREQ=DAILY').between(dtstart, datetime(2026, 10, 19), datetime(2031, 1, 1))
+    assert len(starts) == MAX_OCCURRENCES
+    assert starts[0] == datetime(2026, 10, 19, 9)
+
+
+def test_far_window_does_not_walk_from_dtstart():
+    starts = parse('FREQ=WEEKLY;BYDAY=TU').between(datetime(1900, 1, 2, 9), datetime(9000, 1, 1), datetime(9000, 1, 31))
+    first = datetime(9000, 1, 1 + (1 - datetime(9000, 1, 1).weekday()) % 7, 9)
+    assert starts == [first + timedelta(weeks=n) for n in range(len(starts))]
+    assert starts[-1] + timedelta(weeks=1) > datetime(9000, 1, 31)
+
+
+def test_pattern_round_trips():
+    text = 'RRULE:FREQ=WEEKLY;INTERVAL=1;BYDAY=MO,WE;UNTIL=20261218\nEXDATE:20261111T090000'
+    rule = parse(text)
+    assert str(rule) == text
+    assert str(rule.with_exdate(datetime(2026, 11, 25, 9))).endswith('EXDATE:20261111T090000,20261125T090000')
+
+
+@pytest.mark.parametrize('text', [
+    '', 'FREQ=HOURLY', 'FREQ=DAILY;BYMONTH=1', 'FREQ=WEEKLY;BYDAY=XX', 'FREQ=DAILY;COUNT=2;UNTIL=20260101',
+    'X-FOO:1', 'FREQ=MONTHLY;BYDAY=MO', 'FREQ=DAILY;INTERVAL=2;BYDAY=MO', 'FREQ=MONTHLY;COUNT=2000000',
+    'FREQ=DAILY;INTERVAL=1000000000', 'FREQ=DAILY;COUNT=0',
+])
+def test_rejects_malformed_and_oversized_rules(text):
+    with pytest.raises(ValueError):
+        Rule.parse(text)
+
+
+def test_validate_limits_series_span():
+    parse('FREQ=DAILY;UNTIL=20300101').validate(datetime(2026, 9, 1, 9))
+    parse('FREQ=WEEKLY').validate(datetime(2026, 9, 1, 9))
+    with pytest.raises(ValueError):
+        parse('FREQ=DAILY;UNTIL=99991231').validate(datetime(2026, 9, 1, 9))
+    with pytest.raises(ValueError):
+        parse('FREQ=MONTHLY;COUNT=2000').validate(datetime(2026, 9, 1, 9))
+
+
+def test_expansion_stops_at_the_end_of_datetime_range():
+    dtstart = datetime(9999, 6, 30, 9)
+    assert len(parse('FREQ=MONTHLY;COUNT=2000').between(dtstart, dtstart, None)) == 7
+    assert parse('FREQ=MONTHLY;COUNT=2000').bound(dtstart) == datetime.max
+    assert len(parse('FREQ=DAILY').between(datetime(9999, 12, 1, 9), None, datetime.max)) == 31
+
+
+def test_expand_events_merges_and_orders():
+    cache = OccurrenceCache(max_size=100)
+    events = [
+        {'id': 1, 'title': 'Maths', 'start_time': '2026-09-07T09:00', 'end_time': '2026-09-07T10:30',
+         'is_recurring': 1, 'recurrence_pattern': 'RRULE:FREQ=WEEKLY;BYDAY=MO,WE\nEXDATE:20260916T090000'},
+        {'id': 2, 'title': 'Trip', 'start_time': '2026-09-15 08:00:00', 'end_time': '2026-09-15 16:00:00',
+         'is_recurring': 0, 'recurrence_pattern': None},
+        {'id': 3, 'title': 'Past', 'start_time': '2026-08-01T08:00', 'end_time': '2026-08-01T09:00',
+         'is_recurring': 0, 'recurrence_pattern': None},
+    ]
+    expanded = cache.expand_events(events, datetime(2026, 9, 14), datetime(2026, 9, 21, 23, 59))
+    assert [(e['id'], e['start_time'], e['end_time'], e.get('recurrence_id')) for e in expanded] == [
+        (1, '2026-09-14T09:00', '2026-09-14T10:30', '2026-09-14T09:00'),
+        (2, '2026-09-15 08:00:00', '2026-09-15 16:00:00', None),
+        (1, '2026-09-21T09:00', '2026-09-21T10:30', '2026-09-21T09:00'),
+    ]
+
+
+def test_expand_events_uses_horizon_without_window_end():
+    cache = OccurrenceCache(max_size=100)
+    events = [{'id': 1, 'start_time': '2026-09-01 09:00:00', 'end_time': '2026-09-01 10:00:00',
+               'is_recurring': 1, 'recurrence_pattern': 'FREQ=DAILY'}]
+    expanded = cache.expand_events(events, datetime(2026, 9, 1), horizon=datetime(2026, 9, 3, 23, 59))
+    assert [e['start_time'] for e in expanded] == ['2026-09-01 09:00:00', '2026-09-02 09:00:00', '2026-09-03 09:00:00']
+
+
+def test_expand_events_keeps_unusable_series_as_one_off():
+    cache = OccurrenceCache(max_size=100)
+    events = [{'id': 1, 'start_time': '2026-09-01T09:00', 'end_time': '2026-09-01T10:00',
+               'is_recurring': 1, 'recurrence_pattern': 'FREQ=YEARLY'}]
+    assert [e['id'] for e in cache.expand_events(events, datetime(2026, 9, 1), datetime(2026, 9, 2))] == [1]
+    assert cache.expand_events(events, datetime(2026, 10, 1), datetime(2026, 10, 2)) == []
+
+
+def test_expand_is_cached_by_pattern_and_window():
+    cache = OccurrenceCache(max_size=100)
+    args = ('FREQ=DAILY', '2026-09-01T09:00', '2026-09-01T10:00', datetime(2026, 9, 1), datetime(2026, 9, 3))
+    first = cache.expand(*args)
+    assert cache.expand(*args) == first
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+    cache.expand('FREQ=DAILY;INTERVAL=2', *args[1:])
+    assert cache.stats()['misses'] == 2
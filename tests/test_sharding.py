@@ -0,0 +1,202 @@
+import os
+import sqlite3
+
+import pytest
+
+from web.sharding import SHARDED_TABLES, ShardRouter, split
+
+SCHEMA = """
+CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT UNIQUE NOT NULL, full_name TEXT);
+CREATE TABLE organizations (id INTEGER PRIMARY KEY, name TEXT NOT NULL);
+CREATE TABLE organization_memberships (id INTEGER PRIMARY KEY, organization_id INTEGER, user_id INTEGER);
+CREATE TABLE classes (id INTEGER PRIMARY KEY, name TEXT, teacher_id INTEGER, organization_id INTEGER);
+CREATE INDEX idx_classes_org ON classes (organization_id);
+CREATE TABLE class_enrollments (id INTEGER PRIMARY KEY, class_id INTEGER, student_id INTEGER);
+CREATE TABLE class_students (id INTEGER PRIMARY KEY, class_id INTEGER, student_id INTEGER,
+                             UNIQUE (class_id, student_id));
+CREATE TABLE class_schedule (id INTEGER PRIMARY KEY, class_id INTEGER, title TEXT);
+CREATE TABLE resources (id INTEGER PRIMARY KEY, title TEXT, class_id INTEGER, created_by INTEGER {org_column});
+CREATE TABLE assignment_submissions (id INTEGER PRIMARY KEY, assignment_id INTEGER, student_id INTEGER, grade REAL);
+CREATE TABLE discussions (id INTEGER PRIMARY KEY, title TEXT, organization_id INTEGER, author_id INTEGER);
+CREATE TABLE discussion_replies (id INTEGER PRIMARY KEY, discussion_id INTEGER, author_id INTEGER, content TEXT);
+CREATE TABLE discussion_attachments (id INTEGER PRIMARY KEY, discussion_id INTEGER, reply_id INTEGER, path TEXT);
+CREATE TABLE attendance (id INTEGER PRIMARY KEY, class_id INTEGER, student_id INTEGER, organization_id INTEGER,
+                         date TEXT, status TEXT);
+CREATE TABLE announcements (id INTEGER PRIMARY KEY, organization_id INTEGER, title TEXT);
+CREATE TABLE data_versions (organization_id INTEGER, scope TEXT, version INTEGER, PRIMARY KEY (organization_id, scope));
+"""
+
+# Per organization: classes 10*org+1..+2 with two students each, one schedule
+# entry, two resources with submissions, a discussion with a reply and
+# attachments on both, attendance with and without organization_id, and an
+# announcement. Class 99 and discussion 99 belong to no organization.
+EXPECTED = {
+    'classes': 2, 'class_enrollments': 2, 'class_students': 4, 'class_schedule': 1, 'resources': 2,
+    'assignment_submissions': 3, 'discussions': 1, 'discussion_replies': 1, 'discussion_attachments': 2,
+    'attendance': 3, 'announcements': 1, 'data_versions': 1,
+}
+
+
+def build_source(path, legacy_resources):
+    db = sqlite3.connect(path)
+    db.executescript(SCHEMA.format(org_column='' if legacy_resources else ', organization_id INTEGER'))
+    db.executemany("INSERT INTO users (id, username, full_name) VALUES (?, ?, ?)",
+                   [(n, f'user{n}', f'User {n}') for n in range(1, 9)])
+    db.executemany("INSERT INTO organizations (id, name) VALUES (?, ?)", [(1, 'North'), (2, 'South')])
+    db.execute("INSERT INTO classes (id, name, teacher_id, organization_id) VALUES (99, 'Unassigned', 1, NULL)")
+    db.execute("INSERT INTO discussions (id, title, organization_id, author_id) VALUES (99, 'Global', NULL, 1)")
+    db.execute("INSERT INTO class_students (class_id, student_id) VALUES (99, 5)")
+    for org in (1, 2):
+        base = 10 * org
+        db.execute("INSERT INTO organization_memberships (organization_id, user_id) VALUES (?, 1)", (org,))
+        for c in (base + 1, base + 2):
+            db.execute("INSERT INTO classes (id, name, teacher_id, organization_id) VALUES (?, ?, 1, ?)",
+                       (c, f'Class {c}', org))
+            db.executemany("INSERT INTO class_students (class_id, student_id) VALUES (?, ?)", [(c, 5), (c, 6)])
+            db.execute("INSERT INTO class_enrollments (class_id, student_id) VALUES (?, 7)", (c,))
+        db.execute("INSERT INTO class_schedule (class_id, title) VALUES (?, 'Weekly')", (base + 1,))
+        for r in (base + 1, base + 2):
+            if legacy_resources:
+                db.execute("INSERT INTO resources (id, title, class_id, created_by) VALUES (?, 'Homework', ?, 1)",
+                           (r, base + 1))
+            else:
+                db.execute("""INSERT INTO resources (id, title, class_id, created_by, organization_id)
+                              VALUES (?, 'Homework', ?, 1, ?)""", (r, base + 1, org))
+        db.executemany("INSERT INTO assignment_submissions (assignment_id, student_id, grade) VALUES (?, ?, ?)",
+                       [(base + 1, 5, 80), (base + 1, 6, 70), (base + 2, 5, 90)])
+        db.execute("INSERT INTO discussions (id, title, organization_id, author_id) VALUES (?, 'Staff', ?, 1)",
+                   (base + 1, org))
+        db.execute("INSERT INTO discussion_replies (id, discussion_id, author_id, content) VALUES (?, ?, 2, 'Yes')",
+                   (base + 1, base + 1))
+        db.execute("INSERT INTO discussion_attachments (discussion_id, path) VALUES (?, 'a.pdf')", (base + 1,))
+        db.execute("INSERT INTO discussion_attachments (reply_id, path) VALUES (?, 'b.pdf')", (base + 1,))
+        db.executemany("""INSERT INTO attendance (class_id, student_id, organization_id, date, status)
+                          VALUES (?, ?, ?, '2026-09-01', 'present')""",
+                       [(base + 1, 5, org), (base + 1, 6, org), (base + 2, 5, None)])
+        db.execute("INSERT INTO announcements (organization_id, title) VALUES (?, 'Welcome')", (org,))
+        db.execute("INSERT INTO data_versions (organization_id, scope, version) VALUES (?, 'classes', 3)", (org,))
+    db.commit()
+    db.close()
+
+
+@pytest.fixture(params=[False, True], ids=['resources.organization_id', 'legacy-resources'])
+def split_db(tmp_path, request):
+    source = str(tmp_path / 'source.db')
+    catalog = str(tmp_path / 'catalog.db')
+    shard_dir = str(tmp_path / 'shards')
+    build_source(source, legacy_resources=request.param)
+    moved = split(source, catalog, shard_dir)
+    return source, catalog, shard_dir, moved
+
+
+def count(path, table):
+    db = sqlite3.connect(path)
+    try:
+        return db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    finally:
+        db.close()
+
+
+def test_split_moves_each_organizations_rows(split_db):
+    source, catalog, shard_dir, moved = split_db
+    assert moved == {1: sum(EXPECTED.values()), 2: sum(EXPECTED.values())}
+    for org in (1, 2):
+        shard = os.path.join(shard_dir, f'org_{org}.db')
+        assert {table: count(shard, table) for table in EXPECTED} == EXPECTED
+
+
+def test_split_keeps_every_row_exactly_once(split_db):
+    source, catalog, shard_dir, _ = split_db
+    for table in SHARDED_TABLES:
+        shards = sum(count(os.path.join(shard_dir, f'org_{org}.db'), table) for org in (1, 2))
+        assert shards + count(catalog, table) == count(source, table), table
+    for table in ('users', 'organizations', 'organization_memberships'):
+        assert count(catalog, table) == count(source, table)
+
+
+def test_legacy_class_scoped_children_land_in_their_class_shard(split_db):
+    _, _, shard_dir, _ = split_db
+    for org in (1, 2):
+        db = sqlite3.connect(os.path.join(shard_dir, f'org_{org}.db'))
+        # Attendance without organization_id follows its class
+        assert db.execute("SELECT class_id FROM attendance WHERE organization_id IS NULL").fetchall() == [(10 * org + 2,)]
+        assert {row[0] for row in db.execute("SELECT id FROM resources")} == {10 * org + 1, 10 * org + 2}
+        db.close()
+
+
+def test_nothing_is_orphaned(split_db):
+    _, catalog, shard_dir, _ = split_db
+    db = sqlite3.connect(catalog)
+    assert db.execute("SELECT id FROM classes").fetchall() == [(99,)]
+    assert db.execute("SELECT class_id FROM class_students").fetchall() == [(99,)]
+    assert db.execute("SELECT id FROM discussions").fetchall() == [(99,)]
+    for table in ('class_enrollments', 'class_schedule', 'resources', 'assignment_submissions', 'discussion_replies',
+                  'discussion_attachments', 'attendance', 'announcements', 'data_versions'):
+        assert db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] == 0, table
+    db.close()
+    children = [
+        ('class_students', 'class_id', 'classes'), ('class_enrollments', 'class_id', 'classes'),
+        ('class_schedule', 'class_id', 'classes'), ('attendance', 'class_id', 'classes'),
+        ('resources', 'class_id', 'classes'), ('assignment_submissions', 'assignment_id', 'resources'),
+        ('discussion_replies', 'discussion_id', 'discussions'),
+    ]
+    for org in (1, 2):
+        db = sqlite3.connect(os.path.join(shard_dir, f'org_{org}.db'))
+        for child, column, parent in children:
+            orphans = db.execute(f"""SELECT COUNT(*) FROM {child}
+                                     WHERE {column} NOT IN (SELECT id FROM {parent})""").fetchone()[0]
+            assert orphans == 0, (org, child)
+        db.close()
+
+
+def test_split_refuses_to_overwrite(split_db):
+    source, catalog, shard_dir, _ = split_db
+    with pytest.raises(FileExistsError):
+        split(source, catalog, shard_dir)
+
+
+def test_router_reads_shard_with_catalog_attached(split_db):
+    _, catalog, shard_dir, _ = split_db
+    router = ShardRouter('sqlite:///' + catalog, shard_dir, pool_size=1)
+    try:
+        conn = router.connect(2)
+        rows = conn.execute("""
+            SELECT c.id, u.full_name, COUNT(cs.id) AS students
+            FROM classes c JOIN users u ON c.teacher_id = u.id
+            LEFT JOIN class_students cs ON cs.class_id = c.id
+            GROUP BY c.id ORDER BY c.id
+        """).fetchall()
+        assert [tuple(row) for row in rows] == [(21, 'User 1', 2), (22, 'User 1', 2)]
+        assert conn.execute("SELECT name FROM organizations WHERE id = 2").fetchone()[0] == 'South'
+        conn.close()
+
+        again = router.connect(2)
+        assert again.execute("SELECT COUNT(*) FROM catalog.users").fetchone()[0] == 8
+        again.close()
+        assert router.stats()['reused'] == 1
+
+        unscoped = router.connect(None)
+        assert [row[0] for row in unscoped.execute("SELECT id FROM classes")] == [99]
+        unscoped.close()
+    finally:
+        router.close()
+
+
+def test_router_creates_new_shards_with_catalog_columns(split_db):
+    _, catalog, shard_dir, _ = split_db
+    db = sqlite3.connect(catalog)
+    db.execute("INSERT INTO organizations (id, name) VALUES (3, 'East')")
+    db.execute("ALTER TABLE classes ADD COLUMN room TEXT DEFAULT 'TBC'")
+    db.commit()
+    db.close()
+    router = ShardRouter('sqlite:///' + catalog, shard_dir)
+    try:
+        for org in (1, 3):
+            conn = router.connect(org)
+            conn.execute("INSERT INTO classes (id, name, teacher_id, organization_id) VALUES (?, 'New', 1, ?)",
+                         (100 + org, org))
+            assert conn.execute("SELECT room FROM classes WHERE id = ?", (100 + org,)).fetchone()[0] == 'TBC'
+            conn.close()
+        assert router.shards() == [1, 2, 3]
+    finally:
+        router.close()
@@ -0,0 +1,98 @@
+import json
+
+import pytest
+from flask import Flask, request
+from werkzeug.test import EnvironBuilder
+
+from web.exports import stream_export
+from web.streaming import stream_json
+
+
+class Conn:
+    def __init__(self):
+        self.closed = 0
+
+    def close(self):
+        self.closed += 1
+
+
+class Cursor:
+    description = [('id',), ('name',)]
+
+    def __init__(self, batches, fail_at=None):
+        self.batches = list(batches)
+        self.calls = 0
+        self.fail_at = fail_at
+
+    def fetchmany(self, size):
+        self.calls += 1
+        if self.calls == self.fail_at:
+            raise RuntimeError('query failed')
+        return self.batches.pop(0) if self.batches else []
+
+
+@pytest.fixture
+def client():
+    app = Flask(__name__)
+    app.conns = []
+
+    def make(fail_at=None):
+        conn = Conn()
+        app.conns.append(conn)
+        return conn, Cursor([[(1, 'a'), (2, 'b')], [(3, 'c')]], fail_at)
+
+    @app.route('/json', methods=['GET', 'HEAD'])
+    def rows():
+        conn, cursor = make(request.args.get('fail_at', type=int))
+        return stream_json(conn, cursor, 'rows', extra={'page': 1})
+
+    @app.route('/csv')
+    def csv():
+        conn, cursor = make(request.args.get('fail_at', type=int))
+        return stream_export(conn, cursor, ['id', 'name'], 'csv', 'rows.csv')
+
+    client = app.test_client()
+    client.app = app
+    client.conns = app.conns
+    return client
+
+
+def serve(app, path):
+    """Run a request the way a WSGI server does, always closing the body iterable"""
+    body = app(EnvironBuilder(path=path).get_environ(), lambda status, headers, exc_info=None: None)
+    try:
+        return b''.join(body)
+    finally:
+        body.close()
+
+
+def test_json_body_and_close(client):
+    response = client.get('/json')
+    assert json.loads(response.data) == {'success': True, 'page': 1,
+                                         'rows': [{'id': 1, 'name': 'a'}, {'id': 2, 'name': 'b'},
+                                                  {'id': 3, 'name': 'c'}]}
+    response.close()
+    assert client.conns[0].closed == 1
+
+
+def test_connection_closed_when_body_is_never_read(client):
+    response = client.head('/json')
+    assert response.status_code == 200 and response.data == b''
+    response.close()
+    assert client.conns[0].closed == 1
+    response = client.get('/csv')
+    response.close()
+    assert client.conns[1].closed == 1
+
+
+def test_failing_first_batch_is_a_500(client):
+    assert client.get('/json?fail_at=1').status_code == 500
+    assert client.get('/csv?fail_at=1').status_code == 500
+    assert [conn.closed for conn in client.conns] == [1, 1]
+
+
+def test_failure_after_the_first_batch_aborts_the_response(client):
+    for path in ('/json?fail_at=2', '/csv?fail_at=2'):
+        with pytest.raises(RuntimeError):
+            serve(client.app, path)
+    assert [conn.closed for conn in client.conns] == [1, 1]
@@ -0,0 +1,60 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from web.database import IntegrityError, connect
+from web.writer import SQLiteWriter, WriterError
+
+
+@pytest.fixture
+def writer(tmp_path):
+    url = 'sqlite:///' + str(tmp_path / 'w.db')
+    db = sqlite3.connect(str(tmp_path / 'w.db'))
+    db.execute("CREATE TABLE notes (id INTEGER PRIMARY KEY, body TEXT UNIQUE)")
+    db.close()
+    writer = SQLiteWriter(lambda: connect(url), timeout=0.2)
+    yield writer
+    writer.stop()
+
+
+def bodies(writer):
+    return writer.run(lambda conn: [row[0] for row in conn.execute("SELECT body FROM notes ORDER BY id")])
+
+
+def test_failing_job_rolls_back_alone(writer):
+    writer.run(lambda conn: conn.execute("INSERT INTO notes (body) VALUES ('a')"))
+    with pytest.raises(Exception):
+        writer.run(lambda conn: conn.execute("INSERT INTO notes (body) VALUES ('a')"))
+    assert bodies(writer) == ['a']
+
+
+def test_nested_write_runs_inline(writer):
+    def outer(conn):
+        conn.execute("INSERT INTO notes (body) VALUES ('outer')")
+        with pytest.raises(IntegrityError):
+            writer.run(lambda inner: inner.execute("INSERT INTO notes (body) VALUES ('outer')"))
+        return writer.run(lambda inner: inner.execute("INSERT INTO notes (body) VALUES ('inner')").lastrowid)
+    assert writer.run(outer) == 2
+    assert bodies(writer) == ['outer', 'inner']
+
+
+def test_running_job_is_waited_for_past_the_timeout(writer):
+    def slow(conn):
+        time.sleep(0.5)
+        return conn.execute("INSERT INTO notes (body) VALUES ('slow')").lastrowid
+    assert writer.run(slow) == 1
+    assert bodies(writer) == ['slow']
+
+
+def test_queued_job_is_dropped_after_the_timeout(writer):
+    release = threading.Event()
+    blocker = threading.Thread(target=writer.run, args=(lambda conn: release.wait(5),))
+    blocker.start()
+    time.sleep(0.05)
+    with pytest.raises(WriterError):
+        writer.run(lambda conn: conn.execute("INSERT INTO notes (body) VALUES ('late')"))
+    release.set()
+    blocker.join()
+    assert bodies(writer) == []
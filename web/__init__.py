@@ -0,0 +1 @@
+# StaffRoom web backend support package
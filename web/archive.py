@@ -0,0 +1,343 @@
+"""
+Hot/cold archival of attendance, discussion replies and submissions
+These tables only grow, and every scan and index lookup on them pays for
+years of history that hardly anyone reads. The archiver moves rows dated
+before the start of the oldest academic year still kept hot into a separate
+SQLite file with the same schema, attached to the connections that need it
+as `archive`.
+
+Rows move in batches, each its own short transaction (copy into the archive,
+delete from the live table), with a pause between batches so request writes
+get a turn. A background thread in each worker checks every `interval`
+seconds; a lock file makes one worker per host do the moving.
+
+Reads ask source() for the table to select from. It returns the live table
+when the requested range starts on or after the boundary, and otherwise a
+UNION ALL of the live and archived rows with the archive attached, so recent
+queries never touch the archive. Writes to rows that may be archived call
+restore() first, which moves them back into the live table. An archived row
+whose UNIQUE key a live row has taken since is dropped, keeping the live one;
+restore() logs and counts those.
+
+SQLite commits each attached file separately in WAL mode, so a crash between
+the two can leave a batch in both files; the next run replaces the archived
+copies and deletes the live ones again.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from datetime import date
+
+from web.database import DatabaseError
+
+try:
+    import fcntl
+except ImportError:  # Windows: runs are only serialized within a process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Archived tables and the date column that decides when a row goes cold
+ARCHIVED_TABLES = {
+    'attendance': 'date',
+    'discussion_replies': 'created_at',
+    'assignment_submissions': 'submission_date',
+}
+
+# Indexes on the archive beyond the tables' own UNIQUE constraints
+ARCHIVE_INDEXES = [
+    ('attendance', 'date'),
+    ('discussion_replies', 'discussion_id'),
+    ('discussion_replies', 'created_at'),
+    ('assignment_submissions', 'submission_date'),
+]
+
+_CREATE_TABLE_RE = re.compile(r'^\s*CREATE\s+TABLE\s+(IF\s+NOT\s+EXISTS\s+)?["`\[]?\w+["`\]]?', re.IGNORECASE)
+
+
+def academic_year_start(today, year_start=(8, 1)):
+    """First day of the academic year containing `today`; `year_start` is (month, day)"""
+    start = date(today.year, *year_start)
+    return start if today >= start else date(today.year - 1, *year_start)
+
+
+def parse_year_start(value):
+    """Parse an ARCHIVE_YEAR_START value like '08-01' into (month, day)"""
+    month, day = (int(part) for part in value.split('-'))
+    date(2000, month, day)  # raises ValueError for impossible dates
+    return month, day
+
+
+class Archiver:
+    """Moves rows older than the hot academic years into an attached archive database
+
+    `connect()` opens a connection to the live SQLite database and
+    `path` is the archive file. The current academic year starts on
+    `year_start` (month, day); `keep_years` academic years stay live.
+    """
+
+    def __init__(self, connect, path, year_start=(8, 1), keep_years=1, batch_size=500, pause=0.05,
+                 interval=3600):
+        self.connect = connect
+        self.path = path
+        self.year_start = year_start
+        self.keep_years = max(int(keep_years), 1)
+        self.batch_size = batch_size
+        self.pause = pause
+        self.interval = interval
+        self._archived_before = None
+        self._lock = threading.RLock()
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._stats = {'runs': 0, 'moved': {table: 0 for table in ARCHIVED_TABLES}, 'restored': 0, 'dropped': 0,
+                       'batches': 0, 'failures': 0, 'last_seconds': 0.0, 'last_error': None}
+
+    def cutoff(self, today=None):
+        """ISO date before which rows are archived"""
+        start = academic_year_start(today or date.today(), self.year_start)
+        return start.replace(year=start.year - (self.keep_years - 1)).isoformat()
+
+    def boundary(self):
+        """ISO date before which rows may be in the archive
+
+        The configured cutoff, or a later one recorded by an earlier run
+        with fewer years kept.
+        """
+        cutoff = self.cutoff()
+        if self._archived_before is not None and self._archived_before > cutoff:
+            return self._archived_before
+        return cutoff
+
+    def covers(self, since):
+        """Whether rows dated from `since` (an ISO date or timestamp; None for all time) may be archived"""
+        return since is None or str(since)[:10] < self.boundary()
+
+    def attach(self, conn):
+        """Attach the archive to a live-database connection as `archive`"""
+        try:
+            conn.execute("ATTACH DATABASE ? AS archive", (self.path,))
+        except DatabaseError as e:
+            if 'already in use' not in str(e):
+                raise
+
+    def source(self, conn, table, since=None):
+        """Table expression for a FROM clause covering `table` rows dated from `since`
+
+        The live table alone when none of those rows can be archived,
+        otherwise the live and archived rows together (attaching the
+        archive to conn).
+        """
+        if not self.covers(since):
+            return table
+        self.attach(conn)
+        columns = ', '.join(conn.table_columns(table))
+        return f"(SELECT {columns} FROM main.{table} UNION ALL SELECT {columns} FROM archive.{table})"
+
+    def _connect(self):
+        conn = self.connect()
+        try:
+            self.attach(conn)
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def ensure_schema(self):
+        """Create the archive file, its tables and indexes, and add columns the live tables gained"""
+        with self._lock:
+            conn = self._connect()
+            try:
+                for table in ARCHIVED_TABLES:
+                    row = conn.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?",
+                                       (table,)).fetchone()
+                    if row is None:
+                        continue
+                    conn.execute(_CREATE_TABLE_RE.sub(f"CREATE TABLE IF NOT EXISTS archive.{table}", row[0], count=1))
+                    archived = {r[1] for r in conn.execute(f"PRAGMA archive.table_info({table})").fetchall()}
+                    for column in conn.execute(f"PRAGMA main.table_info({table})").fetchall():
+                        if column[1] not in archived:
+                            # ALTER TABLE only takes constant defaults
+                            default = column[4]
+                            default = f" DEFAULT {default}" if default and not default.upper().startswith('CURRENT_') else ''
+                            conn.execute(f"ALTER TABLE archive.{table} ADD COLUMN {column[1]} {column[2]}{default}")
+                for table, column in ARCHIVE_INDEXES:
+                    conn.execute(f"CREATE INDEX IF NOT EXISTS archive.idx_{table}_{column} ON {table} ({column})")
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS archive.archive_state (
+                        table_name TEXT PRIMARY KEY,
+                        archived_before TEXT NOT NULL,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                conn.commit()
+                row = conn.execute("SELECT MAX(archived_before) FROM archive.archive_state").fetchone()
+                self._archived_before = row[0] if row else None
+            finally:
+                conn.close()
+
+    def _ensure_thread(self):
+        # Started lazily in each process so gunicorn workers forked after import get their own
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._loop, name='archiver', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def start(self):
+        """Run archival in the background of this worker"""
+        if self._pid != os.getpid():
+            self._ensure_thread()
+
+    def _loop(self):
+        while not self._stopping.is_set():
+            try:
+                self.run()
+            except Exception as e:
+                logger.error("Error archiving old rows: %s", e)
+            self._stopping.wait(self.interval)
+
+    def run(self):
+        """Move every row older than the cutoff into the archive
+
+        Returns rows moved per table, or None when another worker holds the
+        archive lock.
+        """
+        with self._lock, open(self.path + '.lock', 'a') as lock_file:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return None
+            started = time.perf_counter()
+            cutoff = self.cutoff()
+            moved = {}
+            try:
+                self.ensure_schema()
+                conn = self._connect()
+                try:
+                    for table, column in ARCHIVED_TABLES.items():
+                        moved[table] = self._archive_table(conn, table, column, cutoff)
+                    self._record_cutoff(conn, cutoff)
+                finally:
+                    conn.close()
+            except Exception as e:
+                self._stats['failures'] += 1
+                self._stats['last_error'] = str(e)
+                raise
+            if self._archived_before is None or cutoff > self._archived_before:
+                self._archived_before = cutoff
+            seconds = time.perf_counter() - started
+            self._stats['runs'] += 1
+            self._stats['last_seconds'] = round(seconds, 4)
+            self._stats['last_error'] = None
+            if any(moved.values()):
+                logger.info("Archived rows dated before %s in %.2fs: %s", cutoff, seconds, moved)
+            return moved
+
+    def _record_cutoff(self, conn, cutoff):
+        conn.execute("BEGIN IMMEDIATE")
+        for table in ARCHIVED_TABLES:
+            conn.execute("""
+                INSERT INTO archive.archive_state (table_name, archived_before) VALUES (?, ?)
+                ON CONFLICT(table_name) DO UPDATE SET
+                    archived_before = MAX(archived_before, excluded.archived_before),
+                    updated_at = CURRENT_TIMESTAMP
+            """, (table, cutoff))
+        conn.commit()
+
+    def _archive_table(self, conn, table, column, cutoff):
+        columns = ', '.join(conn.table_columns(table))
+        total = 0
+        while not self._stopping.is_set():
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(f"SELECT id FROM main.{table} WHERE {column} < ? ORDER BY id LIMIT ?",
+                                    (cutoff, self.batch_size)).fetchall()
+                if not rows:
+                    conn.rollback()
+                    break
+                last_id = rows[-1][0]
+                # The batch is the oldest ids dated before the cutoff, i.e. every such row up to last_id
+                conn.execute(f"""
+                    INSERT OR REPLACE INTO archive.{table} ({columns})
+                    SELECT {columns} FROM main.{table} WHERE {column} < ? AND id <= ?
+                """, (cutoff, last_id))
+                conn.execute(f"DELETE FROM main.{table} WHERE {column} < ? AND id <= ?", (cutoff, last_id))
+                conn.note_change(table)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            total += len(rows)
+            self._stats['moved'][table] += len(rows)
+            self._stats['batches'] += 1
+            if len(rows) < self.batch_size:
+                break
+            time.sleep(self.pause)
+        return total
+
+    def restore(self, table, where, params=()):
+        """Move archived rows of `table` matching `where` back to the live table before they are written
+
+        Returns the number of rows restored. Archived rows that collide with
+        a live row on a UNIQUE key are deleted from the archive without being
+        restored, since the live row is the newer one.
+        """
+        with self._lock:
+            conn = self._connect()
+            try:
+                if conn.execute(f"SELECT 1 FROM archive.{table} WHERE {where} LIMIT 1", params).fetchone() is None:
+                    return 0
+                columns = ', '.join(conn.table_columns(table))
+                conn.execute("BEGIN IMMEDIATE")
+                restored = conn.execute(f"INSERT OR IGNORE INTO main.{table} ({columns}) "
+                                        f"SELECT {columns} FROM archive.{table} WHERE {where}", params).rowcount
+                dropped = conn.execute(f"DELETE FROM archive.{table} WHERE {where}", params).rowcount - restored
+                conn.note_change(table)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+            self._stats['restored'] += restored
+            if dropped:
+                self._stats['dropped'] += dropped
+                logger.warning("Dropped %s archived %s rows matching %s %s: a live row has the same key",
+                               dropped, table, where, params)
+            return restored
+
+    def stats(self):
+        """Counters for this worker, the boundary and archived row counts"""
+        with self._lock:
+            stats = {name: (dict(value) if isinstance(value, dict) else value) for name, value in self._stats.items()}
+            stats['cutoff'] = self.cutoff()
+            stats['boundary'] = self.boundary()
+            try:
+                conn = self._connect()
+                try:
+                    stats['archived_rows'] = {
+                        table: conn.execute(f"SELECT COUNT(*) FROM archive.{table}").fetchone()[0]
+                        for table in ARCHIVED_TABLES
+                    }
+                finally:
+                    conn.close()
+            except Exception as e:
+                stats['archived_rows'] = None
+                stats['last_error'] = str(e)
+        stats['archive_bytes'] = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        return stats
+
+    def stop(self, timeout=5.0):
+        """Stop the background thread after the current batch"""
+        if self._pid == os.getpid() and self._thread is not None:
+            self._stopping.set()
+            self._thread.join(timeout)
+            self._pid = None
@@ -0,0 +1,229 @@
+"""
+Cross-worker query result cache
+Results of read methods are stored in a small SQLite side database shared by
+every gunicorn worker on the host. Each entry declares the tables it depends
+on; committing a write to one of those tables bumps the table's generation,
+which every worker sees on its next lookup.
+"""
+
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+CACHE_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS cache_entries (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        stamp INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        last_used REAL NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_cache_entries_last_used ON cache_entries (last_used)",
+    """
+    CREATE TABLE IF NOT EXISTS cache_generations (
+        table_name TEXT PRIMARY KEY,
+        generation INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS cache_stats (
+        name TEXT PRIMARY KEY,
+        hits INTEGER NOT NULL DEFAULT 0,
+        misses INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+]
+
+STATS_FLUSH_INTERVAL = 5.0
+
+# A hit only rewrites last_used once it is this stale; eviction order is
+# approximate to this many seconds, but hot entries no longer cost a write
+TOUCH_INTERVAL = 60.0
+
+
+class QueryCache:
+    """LRU result cache in a shared SQLite file with table-generation invalidation"""
+
+    def __init__(self, path, max_entries=5000, enabled=True):
+        self.path = path
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._pending_stats = {}
+        self._last_flush = time.monotonic()
+        self._initialized = False
+        atexit.register(self._flush_at_exit)
+
+    def _conn(self):
+        """Per-thread, per-process connection to the side database"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=2.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            if not self._initialized:
+                for statement in CACHE_DDL:
+                    conn.execute(statement)
+                self._initialized = True
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def stamp(self, tables):
+        """Sum of the tables' generations; grows whenever any of them changes"""
+        placeholders = ', '.join('?' for _ in tables)
+        row = self._conn().execute(f"""
+            SELECT COALESCE(SUM(generation), 0) FROM cache_generations
+            WHERE table_name IN ({placeholders})
+        """, list(tables)).fetchone()
+        return row[0]
+
+    def get(self, key, tables):
+        """Return (hit, value) for key if it is still current for tables"""
+        placeholders = ', '.join('?' for _ in tables)
+        conn = self._conn()
+        row = conn.execute(f"""
+            SELECT value, last_used FROM cache_entries
+            WHERE key = ? AND stamp = (
+                SELECT COALESCE(SUM(generation), 0) FROM cache_generations
+                WHERE table_name IN ({placeholders})
+            )
+        """, [key] + list(tables)).fetchone()
+        if row is None:
+            return False, None
+        now = time.time()
+        if now - row[1] >= TOUCH_INTERVAL:
+            conn.execute("UPDATE cache_entries SET last_used = ? WHERE key = ?", (now, key))
+        return True, json.loads(row[0])
+
+    def set(self, key, stamp, value):
+        """Store value computed while the dependency stamp was `stamp`"""
+        payload = json.dumps(value, default=str)
+        conn = self._conn()
+        conn.execute("""
+            INSERT INTO cache_entries (key, value, stamp, size, last_used)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET
+                value = excluded.value, stamp = excluded.stamp,
+                size = excluded.size, last_used = excluded.last_used
+        """, (key, payload, stamp, len(payload), time.time()))
+        self._evict(conn)
+
+    def _evict(self, conn):
+        """Drop the least recently used tenth once the cache is over capacity"""
+        count = conn.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+        if count > self.max_entries:
+            conn.execute("""
+                DELETE FROM cache_entries WHERE key IN (
+                    SELECT key FROM cache_entries ORDER BY last_used ASC LIMIT ?
+                )
+            """, (count - self.max_entries + self.max_entries // 10,))
+
+    def invalidate(self, tables):
+        """Bump the generation of tables (call after the write has committed)"""
+        if not self.enabled or not tables:
+            return
+        try:
+            conn = self._conn()
+            for table in tables:
+                conn.execute("""
+                    INSERT INTO cache_generations (table_name, generation) VALUES (?, 1)
+                    ON CONFLICT (table_name) DO UPDATE SET generation = generation + 1
+                """, (table,))
+        except sqlite3.Error as e:
+            logger.error("Error invalidating query cache: %s", e)
+
+    def clear(self):
+        """Drop every cached entry"""
+        if not self.enabled:
+            return
+        try:
+            self._conn().execute("DELETE FROM cache_entries")
+        except sqlite3.Error as e:
+            logger.error("Error clearing query cache: %s", e)
+
+    def _record(self, name, hit):
+        with self._stats_lock:
+            counts = self._pending_stats.setdefault(name, [0, 0])
+            counts[0 if hit else 1] += 1
+            if time.monotonic() - self._last_flush >= STATS_FLUSH_INTERVAL:
+                self._flush_stats()
+
+    def _flush_stats(self):
+        """Add this worker's counters to the shared totals"""
+        pending, self._pending_stats = self._pending_stats, {}
+        self._last_flush = time.monotonic()
+        try:
+            conn = self._conn()
+            for name, (hits, misses) in pending.items():
+                conn.execute("""
+                    INSERT INTO cache_stats (name, hits, misses) VALUES (?, ?, ?)
+                    ON CONFLICT (name) DO UPDATE SET
+                        hits = hits + excluded.hits, misses = misses + excluded.misses
+                """, (name, hits, misses))
+        except sqlite3.Error as e:
+            logger.error("Error flushing query cache stats: %s", e)
+
+    def _flush_at_exit(self):
+        with self._stats_lock:
+            if self.enabled and self._pending_stats:
+                self._flush_stats()
+
+    def stats(self):
+        """Hit/miss counts and hit ratio per cached method, across all workers"""
+        with self._stats_lock:
+            self._flush_stats()
+        totals = {}
+        try:
+            for name, hits, misses in self._conn().execute("SELECT name, hits, misses FROM cache_stats"):
+                lookups = hits + misses
+                totals[name] = {
+                    'hits': hits,
+                    'misses': misses,
+                    'hit_ratio': round(hits / lookups, 4) if lookups else 0.0
+                }
+        except sqlite3.Error as e:
+            logger.error("Error reading query cache stats: %s", e)
+        return totals
+
+    def cached(self, *tables):
+        """Decorator caching a WebDatabaseManager read method
+
+        `tables` lists every table the method reads; a committed write to
+        any of them invalidates the entry in all workers. Entries are keyed by
+        the manager's cache_scope, the copy of the data it reads.
+        """
+        def decorator(f):
+            @wraps(f)
+            def wrapper(manager, *args, **kwargs):
+                if not self.enabled:
+                    return f(manager, *args, **kwargs)
+                key = json.dumps([f.__name__, manager.cache_scope, args, kwargs], default=str, sort_keys=True)
+                try:
+                    hit, value = self.get(key, tables)
+                    stamp = None if hit else self.stamp(tables)
+                except sqlite3.Error as e:
+                    logger.error("Error reading query cache: %s", e)
+                    return f(manager, *args, **kwargs)
+                self._record(f.__name__, hit)
+                if hit:
+                    return value
+                value = f(manager, *args, **kwargs)
+                try:
+                    self.set(key, stamp, value)
+                except (sqlite3.Error, TypeError, ValueError) as e:
+                    logger.error("Error writing query cache: %s", e)
+                return value
+            wrapper.uncached = f
+            return wrapper
+        return decorator
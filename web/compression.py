@@ -0,0 +1,158 @@
+"""
+Response compression for JSON APIs and rendered pages
+Negotiates brotli (when the brotli package is installed) or gzip from
+Accept-Encoding. Buffered bodies are compressed whole, streamed bodies chunk
+by chunk with a sync flush so rows still reach the client as they are
+produced, and files or immutable responses are compressed once and kept in
+an in-process cache keyed by their ETag.
+"""
+
+import gzip
+import hashlib
+import zlib
+
+from flask import request
+
+from web.lru import LRUCache
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+COMPRESSIBLE_TYPES = frozenset({
+    'application/json',
+    'application/x-ndjson',
+    'application/javascript',
+    'application/xml',
+    'image/svg+xml',
+    'text/css',
+    'text/csv',
+    'text/html',
+    'text/javascript',
+    'text/plain',
+    'text/xml',
+})
+
+
+class Compression:
+    """after_request hook compressing eligible responses
+
+    `min_size` skips bodies too small to benefit; `max_size` bounds how
+    much of a file response is read into memory to compress it. Streamed
+    responses are always compressed since their size is not known up front.
+    """
+
+    def __init__(self, app=None, min_size=500, max_size=4 * 1024 * 1024, gzip_level=6,
+                 brotli_quality=4, cache_bytes=32 * 1024 * 1024):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.cache = LRUCache(cache_bytes)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.after_request(self.after_request)
+
+    def encodings(self):
+        """Encodings the server can produce, in order of preference"""
+        return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+    def negotiate(self, request):
+        """Pick the best encoding the client accepts, or None"""
+        return request.accept_encodings.best_match(self.encodings())
+
+    def compress(self, body, encoding, quality=None):
+        """Compress a whole body; `quality` overrides the default level"""
+        if encoding == 'br':
+            return brotli.compress(body, quality=quality if quality is not None else self.brotli_quality)
+        return gzip.compress(body, compresslevel=quality if quality is not None else self.gzip_level, mtime=0)
+
+    def _compressor(self, encoding):
+        if encoding == 'br':
+            return brotli.Compressor(quality=self.brotli_quality)
+        return zlib.compressobj(self.gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress_stream(self, chunks, encoding):
+        """Compress an iterable of byte chunks, flushing after each chunk"""
+        compressor = self._compressor(encoding)
+        try:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                if encoding == 'br':
+                    data = compressor.process(chunk) + compressor.flush()
+                else:
+                    data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+                if data:
+                    yield data
+            yield compressor.finish() if encoding == 'br' else compressor.flush()
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+    def is_compressible(self, response):
+        if response.status_code < 200 or response.status_code in (204, 206, 304):
+            return False
+        if 'Content-Encoding' in response.headers or 'Content-Range' in response.headers:
+            return False
+        return response.mimetype in COMPRESSIBLE_TYPES
+
+    def after_request(self, response):
+        if request.method == 'HEAD' or not self.is_compressible(response):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = self.negotiate(request)
+        if encoding is None:
+            return response
+
+        if response.is_streamed and not response.direct_passthrough:
+            response.response = self.compress_stream(_iter_bytes(response.response), encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            if response.direct_passthrough:
+                length = response.content_length
+                if length is None or length > self.max_size:
+                    return response
+                response.direct_passthrough = False
+            body = response.get_data()
+            if len(body) < self.min_size:
+                return response
+            response.set_data(self._compress_cached(response, body, encoding))
+
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            # The compressed body is a different representation of the same
+            # content, so its validator becomes weak
+            response.set_etag(etag, weak=True)
+        return response
+
+    def _compress_cached(self, response, body, encoding):
+        """Compress a body, reusing earlier work for files and immutable responses"""
+        etag, weak = response.get_etag()
+        if not etag or weak or not (response.cache_control.immutable or 'Last-Modified' in response.headers):
+            return self.compress(body, encoding)
+        key = (etag, hashlib.sha1(body).hexdigest(), encoding)
+        compressed = self.cache.get(key)
+        if compressed is None:
+            quality = None
+            if response.cache_control.immutable:
+                # Immutable bodies are compressed once for good, so spend
+                # the extra CPU on the best ratio
+                quality = 11 if encoding == 'br' else 9
+            compressed = self.compress(body, encoding, quality=quality)
+            self.cache.set(key, compressed)
+        return compressed
+
+
+def _iter_bytes(iterable):
+    """Yield a streamed response's chunks as bytes"""
+    try:
+        for chunk in iterable:
+            yield chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+    finally:
+        if hasattr(iterable, 'close'):
+            iterable.close()
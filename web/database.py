@@ -0,0 +1,507 @@
+"""
+Dialect-neutral database layer for the StaffRoom web app
+Lets the same sqlite3-style code (conn.execute, ? placeholders, Row access)
+run against SQLite or a pooled PostgreSQL connection
+"""
+
+import itertools
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from functools import lru_cache
+from urllib.parse import quote
+
+try:
+    import psycopg2
+    import psycopg2.pool
+except ImportError:  # PostgreSQL support is optional
+    psycopg2 = None
+
+SQLITE = 'sqlite'
+POSTGRESQL = 'postgresql'
+
+# Accepted values of SQLITE_JOURNAL_MODE. WAL is stored in the database file once set;
+# the others last only for the connection, so unset keeps whatever the file uses
+SQLITE_JOURNAL_MODES = ('DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL')
+SQLITE_SYNCHRONOUS_LEVELS = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+
+class DatabaseError(Exception):
+    """Base error raised by the query layer for either backend"""
+
+
+class IntegrityError(DatabaseError):
+    """Constraint violation (unique, foreign key, check, not null)"""
+
+
+class OperationalError(DatabaseError):
+    """Schema or connection problem (missing table/column, locked database)"""
+
+
+def dialect_for(url):
+    """Return the dialect name for a DATABASE_URL"""
+    return POSTGRESQL if url.startswith('postgresql://') else SQLITE
+
+
+def _translate_error(exc):
+    """Map a driver exception onto the layer's exception types"""
+    if isinstance(exc, sqlite3.IntegrityError):
+        return IntegrityError(str(exc))
+    if isinstance(exc, sqlite3.OperationalError):
+        return OperationalError(str(exc))
+    if psycopg2 is not None:
+        if isinstance(exc, psycopg2.IntegrityError):
+            return IntegrityError(str(exc))
+        if isinstance(exc, (psycopg2.OperationalError, psycopg2.ProgrammingError)):
+            return OperationalError(str(exc))
+    return DatabaseError(str(exc))
+
+
+_commit_listeners = []
+
+
+def add_commit_listener(listener):
+    """Register listener(tables) to run after a commit that changed tables"""
+    _commit_listeners.append(listener)
+
+
+_query_listeners = []
+_connect_listeners = []
+
+
+def add_query_listener(listener):
+    """Register listener(sql, seconds) to run after every statement"""
+    _query_listeners.append(listener)
+
+
+def add_connect_listener(listener):
+    """Register listener(url) to run whenever a connection is opened"""
+    _connect_listeners.append(listener)
+
+
+_DRIVER_ERRORS = (sqlite3.Error,) + ((psycopg2.Error,) if psycopg2 is not None else ())
+
+_cursor_names = itertools.count()
+
+_LIKE_RE = re.compile(r'\bLIKE\b', re.IGNORECASE)
+
+
+@lru_cache(maxsize=1024)
+def translate_sql(sql, with_params=True):
+    """Rewrite a qmark-style SQLite statement for psycopg2
+
+    Placeholders become %s, literal % signs are escaped when parameters are
+    bound, and LIKE becomes ILIKE so matching stays case-insensitive as in
+    SQLite. String literals are left untouched.
+    """
+    parts = sql.split("'")
+    for i, part in enumerate(parts):
+        if with_params:
+            part = part.replace('%', '%%')
+        if i % 2 == 0:
+            part = part.replace('?', '%s')
+            part = _LIKE_RE.sub('ILIKE', part)
+        parts[i] = part
+    return "'".join(parts)
+
+
+_DDL_RULES = [
+    (re.compile(r'\bINTEGER\s+PRIMARY\s+KEY\s+AUTOINCREMENT\b', re.IGNORECASE), 'SERIAL PRIMARY KEY'),
+    (re.compile(r'\bBOOLEAN\b', re.IGNORECASE), 'SMALLINT'),
+    (re.compile(r'\bREAL\b', re.IGNORECASE), 'DOUBLE PRECISION'),
+    (re.compile(r'\bDATETIME\b', re.IGNORECASE), 'TIMESTAMP'),
+    (re.compile(r'\bBLOB\b', re.IGNORECASE), 'BYTEA'),
+]
+
+
+@lru_cache(maxsize=256)
+def ddl(sql, dialect=SQLITE):
+    """Generate the dialect-specific form of a SQLite CREATE/ALTER statement
+
+    Booleans are stored as SMALLINT on PostgreSQL so the existing 0/1
+    comparisons keep working unchanged.
+    """
+    if dialect != POSTGRESQL:
+        return sql
+    for pattern, replacement in _DDL_RULES:
+        sql = pattern.sub(replacement, sql)
+    return sql
+
+
+def _normalize_value(value):
+    """Convert driver-specific values to what sqlite3 would have returned"""
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, memoryview):
+        return value.tobytes()
+    return value
+
+
+def _normalize_params(params):
+    """Bind booleans as integers, matching SQLite's storage of BOOLEAN"""
+    if not params:
+        return None
+    if isinstance(params, dict):
+        return params
+    return [int(p) if p is True or p is False else p for p in params]
+
+
+class Row:
+    """Row supporting index and column-name access, like sqlite3.Row"""
+
+    __slots__ = ('_index', '_values')
+
+    def __init__(self, index, values):
+        self._index = index
+        self._values = values
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self._values[self._index[key]]
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __eq__(self, other):
+        if isinstance(other, Row):
+            return self._index == other._index and self._values == other._values
+        return NotImplemented
+
+    def __repr__(self):
+        return f"Row({dict(zip(self._index, self._values))!r})"
+
+    def keys(self):
+        return list(self._index)
+
+
+class Cursor:
+    """Cursor over a psycopg2 cursor that yields normalized Row objects"""
+
+    def __init__(self, connection, raw):
+        self._connection = connection
+        self._raw = raw
+        self._index = None
+        if raw.description is not None:
+            self._index = {col[0]: i for i, col in enumerate(raw.description)}
+
+    @property
+    def description(self):
+        return self._raw.description
+
+    @property
+    def rowcount(self):
+        return self._raw.rowcount
+
+    @property
+    def lastrowid(self):
+        """Id generated by the last INSERT on this connection (SERIAL tables)"""
+        return self._connection._last_insert_id()
+
+    def _row(self, values):
+        if self._index is None:
+            # Named (server-side) cursors only describe their columns once rows arrive
+            self._index = {col[0]: i for i, col in enumerate(self._raw.description)}
+        return Row(self._index, tuple(_normalize_value(v) for v in values))
+
+    def fetchone(self):
+        values = self._raw.fetchone()
+        return self._row(values) if values is not None else None
+
+    def fetchmany(self, size=None):
+        rows = self._raw.fetchmany(size) if size is not None else self._raw.fetchmany()
+        return [self._row(values) for values in rows]
+
+    def fetchall(self):
+        return [self._row(values) for values in self._raw.fetchall()]
+
+    def __iter__(self):
+        for values in self._raw:
+            yield self._row(values)
+
+    def close(self):
+        self._raw.close()
+
+
+class Connection:
+    """sqlite3-style connection over either backend
+
+    Exposes execute/executemany/commit/rollback/close plus schema helpers so
+    callers never need to know which database they are talking to.
+    """
+
+    _columns_cache = {}
+
+    # Schema name the sharded catalog is attached under, on per-organization shard connections
+    catalog = None
+
+    def __init__(self, raw, dialect, url, release=None):
+        self._raw = raw
+        self.dialect = dialect
+        self.url = url
+        self._release = release
+        self._changed_tables = set()
+
+    @property
+    def raw(self):
+        """The underlying driver connection"""
+        return self._raw
+
+    def execute(self, sql, params=()):
+        """Execute a statement written with ? placeholders"""
+        start = time.perf_counter()
+        try:
+            if self.dialect == SQLITE:
+                return self._raw.execute(sql, params)
+            cursor = self._raw.cursor()
+            if sql.lstrip()[:6].upper() in ('CREATE', 'ALTER '):
+                sql = ddl(sql, self.dialect)
+            bound = _normalize_params(params)
+            cursor.execute(translate_sql(sql, bound is not None), bound)
+            return Cursor(self, cursor)
+        except _DRIVER_ERRORS as e:
+            raise _translate_error(e) from e
+        finally:
+            self._notify_query(sql, start)
+
+    def executemany(self, sql, seq_of_params):
+        """Execute a statement once per parameter set"""
+        start = time.perf_counter()
+        try:
+            if self.dialect == SQLITE:
+                return self._raw.executemany(sql, seq_of_params)
+            cursor = self._raw.cursor()
+            cursor.executemany(translate_sql(sql, True),
+                               [_normalize_params(p) for p in seq_of_params])
+            return Cursor(self, cursor)
+        except _DRIVER_ERRORS as e:
+            raise _translate_error(e) from e
+        finally:
+            self._notify_query(sql, start)
+
+    def server_cursor(self, sql, params=(), batch_size=500):
+        """Execute a SELECT whose rows are fetched from the database as they are read
+
+        SQLite cursors already step through results lazily. On PostgreSQL a
+        named cursor keeps the result set on the server and fetches
+        `batch_size` rows per round trip, instead of loading every row into
+        the client at execute(); it lives until the transaction ends.
+        """
+        if self.dialect == SQLITE:
+            return self.execute(sql, params)
+        start = time.perf_counter()
+        try:
+            cursor = self._raw.cursor(name=f"stream_{next(_cursor_names)}")
+            cursor.itersize = batch_size
+            bound = _normalize_params(params)
+            cursor.execute(translate_sql(sql, bound is not None), bound)
+            return Cursor(self, cursor)
+        except _DRIVER_ERRORS as e:
+            raise _translate_error(e) from e
+        finally:
+            self._notify_query(sql, start)
+
+    def _notify_query(self, sql, start):
+        if _query_listeners:
+            elapsed = time.perf_counter() - start
+            for listener in _query_listeners:
+                listener(sql, elapsed)
+
+    def note_change(self, table):
+        """Record that the current transaction wrote to table"""
+        self._changed_tables.add(table)
+
+    def commit(self):
+        try:
+            self._raw.commit()
+        except _DRIVER_ERRORS as e:
+            raise _translate_error(e) from e
+        if self._changed_tables:
+            changed, self._changed_tables = self._changed_tables, set()
+            for listener in _commit_listeners:
+                listener(changed)
+
+    def rollback(self):
+        self._changed_tables.clear()
+        try:
+            self._raw.rollback()
+        except _DRIVER_ERRORS as e:
+            raise _translate_error(e) from e
+
+    def close(self):
+        """Close the connection, or hand it back to the pool"""
+        if self._raw is None:
+            return
+        raw, self._raw = self._raw, None
+        if self._release is not None:
+            self._release(raw)
+        else:
+            raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        """Commit on success and roll back on error, like sqlite3"""
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+    def _last_insert_id(self):
+        if self.dialect == SQLITE:
+            return None
+        cursor = self._raw.cursor()
+        cursor.execute("SELECT lastval()")
+        return cursor.fetchone()[0]
+
+    def table_columns(self, table):
+        """Return the column names of a table (cached per database)"""
+        key = (self.url, table)
+        columns = Connection._columns_cache.get(key)
+        if columns is None:
+            if self.dialect == SQLITE:
+                cursor = self.execute(f"PRAGMA table_info({table})")
+                columns = [row[1] for row in cursor.fetchall()]
+            else:
+                cursor = self.execute("""
+                    SELECT column_name FROM information_schema.columns
+                    WHERE table_name = ? ORDER BY ordinal_position
+                """, (table,))
+                columns = [row[0] for row in cursor.fetchall()]
+            if columns:
+                Connection._columns_cache[key] = columns
+        return columns
+
+    def add_column(self, table, definition):
+        """Add a column if it is missing; returns True when it was added
+
+        Failures are swallowed (e.g. SQLite refusing UNIQUE columns), and on
+        PostgreSQL they are confined to a savepoint so the surrounding
+        transaction stays usable.
+        """
+        column = definition.split()[0]
+        if column in self.table_columns(table):
+            return False
+        Connection._columns_cache.pop((self.url, table), None)
+        if self.dialect == POSTGRESQL:
+            self.execute("SAVEPOINT add_column")
+        try:
+            self.execute(f"ALTER TABLE {table} ADD COLUMN {definition}")
+        except DatabaseError:
+            if self.dialect == POSTGRESQL:
+                self.execute("ROLLBACK TO SAVEPOINT add_column")
+            return False
+        finally:
+            Connection._columns_cache.pop((self.url, table), None)
+        return True
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _postgres_pool(url):
+    """Get the psycopg2 pool for this process, creating it on first use
+
+    Pools are keyed by pid so gunicorn workers never share sockets inherited
+    across fork.
+    """
+    key = (url, os.getpid())
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = psycopg2.pool.ThreadedConnectionPool(
+                    int(os.environ.get('DB_POOL_MIN', 1)),
+                    int(os.environ.get('DB_POOL_MAX', 10)),
+                    url
+                )
+                _pools[key] = pool
+    return pool
+
+
+def sqlite_pragmas(journal_mode=None, synchronous=None, cache_size_kb=None, mmap_size_mb=None):
+    """PRAGMA assignments for a new SQLite connection; unset values keep SQLite's defaults"""
+    pragmas = {}
+    if journal_mode and journal_mode.upper() in SQLITE_JOURNAL_MODES:
+        pragmas['journal_mode'] = journal_mode.upper()
+    if synchronous and synchronous.upper() in SQLITE_SYNCHRONOUS_LEVELS:
+        pragmas['synchronous'] = synchronous.upper()
+    if cache_size_kb:
+        pragmas['cache_size'] = -int(cache_size_kb)
+    if mmap_size_mb:
+        pragmas['mmap_size'] = int(mmap_size_mb) * 1024 * 1024
+    return pragmas
+
+
+def _env_sqlite_pragmas():
+    return sqlite_pragmas(os.environ.get('SQLITE_JOURNAL_MODE'), os.environ.get('SQLITE_SYNCHRONOUS'),
+                          os.environ.get('SQLITE_CACHE_SIZE_KB'), os.environ.get('SQLITE_MMAP_SIZE_MB'))
+
+
+def connect(url, pragmas=None, read_only=False, shared=False):
+    """Open a Connection for a DATABASE_URL (sqlite:///path or postgresql://...)
+
+    SQLite connections are tuned from the SQLITE_* environment variables,
+    then `pragmas` (see sqlite_pragmas) on top. A read_only SQLite
+    connection opens the file with mode=ro and leaves its journal mode alone;
+    a shared one may be used from any thread, for pooling.
+    """
+    if dialect_for(url) == POSTGRESQL:
+        if psycopg2 is None:
+            raise OperationalError("psycopg2 is required for a postgresql:// DATABASE_URL")
+        pool = _postgres_pool(url)
+        try:
+            raw = pool.getconn()
+        except _DRIVER_ERRORS as e:
+            raise _translate_error(e) from e
+
+        def release(conn):
+            broken = bool(conn.closed)
+            if not broken:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+            pool.putconn(conn, close=broken)
+
+        conn = Connection(raw, POSTGRESQL, url, release=release)
+    else:
+        db_file = url.replace('sqlite:///', '')
+        timeout = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)) / 1000.0
+        settings = _env_sqlite_pragmas()
+        settings.update(pragmas or {})
+        try:
+            if read_only:
+                settings.pop('journal_mode', None)
+                raw = sqlite3.connect(f"file:{quote(os.path.abspath(db_file))}?mode=ro", timeout=timeout, uri=True,
+                                      check_same_thread=not shared)
+            else:
+                raw = sqlite3.connect(db_file, timeout=timeout, check_same_thread=not shared)
+        except sqlite3.Error as e:
+            raise _translate_error(e) from e
+        raw.row_factory = sqlite3.Row
+        try:
+            for name, value in settings.items():
+                raw.execute(f"PRAGMA {name} = {value}")
+        except sqlite3.Error as e:
+            raw.close()
+            raise _translate_error(e) from e
+        conn = Connection(raw, SQLITE, url)
+    for listener in _connect_listeners:
+        listener(url)
+    return conn
@@ -0,0 +1,497 @@
+"""
+Streaming exports in CSV, NDJSON and XLSX
+Rows are read from the cursor one fetchmany batch at a time and encoded as
+they arrive, so an export of any size holds one batch and one output chunk
+in memory. XLSX is a zip of XML parts; the worksheet is deflated into the
+zip as its rows are written, and the zip goes to a write-only sink that is
+drained after every chunk, so no temp file or whole-sheet string is built.
+
+Exports too large to wait for run as background jobs that write the same
+bytes to a file under the export directory. A job's status lives next to it
+as <id>.json, so whichever worker gets the status or download request can
+answer it. Jobs run on a small per-process thread pool, each user may have
+only a few queued or running at once, and a job whose worker exited is
+reported as failed. Finished jobs are deleted after `ttl`
+seconds.
+"""
+
+import csv
+import io
+import itertools
+import json
+import logging
+import math
+import numbers
+import os
+import re
+import socket
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import escape, quoteattr
+
+from flask import Response
+
+from web.streaming import CHUNK_SIZE, encode, iter_rows, prefetch
+
+logger = logging.getLogger(__name__)
+
+# format: (mimetype, file extension)
+FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+}
+
+# Spreadsheet apps run cells starting with these as formulas
+_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+# Control characters XML 1.0 cannot carry
+_ILLEGAL_XML_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+_JOB_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+# A running job rewrites its status at least this often (seconds) while rows arrive
+HEARTBEAT_INTERVAL = 30.0
+
+# File types that are compressed already; deflating them again costs CPU for no gain
+PRECOMPRESSED_EXTENSIONS = frozenset({
+    '7z', 'avi', 'bz2', 'docx', 'gif', 'gz', 'heic', 'jpeg', 'jpg', 'm4a', 'mkv', 'mov', 'mp3', 'mp4', 'odp',
+    'ods', 'odt', 'ogg', 'pdf', 'png', 'pptx', 'rar', 'webm', 'webp', 'xlsx', 'xz', 'zip',
+})
+
+
+def _csv_value(value):
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def iter_csv(columns, rows):
+    """Yield CSV byte chunks: a header line, then one line per row"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([_csv_value(value) for value in row])
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def iter_ndjson(columns, rows):
+    """Yield newline-delimited JSON byte chunks, one object per row"""
+    buffer = bytearray()
+    for row in rows:
+        buffer += encode(dict(zip(columns, row)))
+        buffer += b'\n'
+        if len(buffer) >= CHUNK_SIZE:
+            yield bytes(buffer)
+            buffer.clear()
+    yield bytes(buffer)
+
+
+class _Sink:
+    """Write-only file object for zipfile; what it collects is drained into the response"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def should_deflate(name):
+    """Whether a zip entry is worth deflating, judging by its extension"""
+    return name.rsplit('.', 1)[-1].lower() not in PRECOMPRESSED_EXTENSIONS
+
+
+def iter_file(path, chunk_size=CHUNK_SIZE):
+    """Yield a file's bytes a chunk at a time"""
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def iter_zip(entries, compress=None, zip64=False):
+    """Yield a zip archive built on the fly from (name, chunks) entries
+
+    `chunks` is an iterable of bytes written to the entry as it is read, and
+    `entries` may itself be a generator. `compress(name)` says whether to
+    deflate an entry (default: always); stored entries cost no CPU. Sizes
+    go in a data descriptor after each entry since nothing is seekable;
+    entries that may pass 2 GiB need `zip64`.
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', allowZip64=True) as archive:
+        for name, chunks in entries:
+            info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+            deflate = compress is None or compress(name)
+            info.compress_type = zipfile.ZIP_DEFLATED if deflate else zipfile.ZIP_STORED
+            info.external_attr = 0o644 << 16
+            with archive.open(info, 'w', force_zip64=zip64) as entry:
+                for chunk in chunks:
+                    entry.write(chunk)
+                    if len(sink.buffer) >= CHUNK_SIZE:
+                        yield sink.drain()
+            if len(sink.buffer) >= CHUNK_SIZE:
+                yield sink.drain()
+    yield sink.drain()
+
+
+XLSX_MAX_ROWS = 1048576  # per sheet, header included
+
+_XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+_XLSX_ROOT_RELS = (
+    _XML_DECLARATION +
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+_XLSX_STYLES = (
+    _XML_DECLARATION +
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+
+
+def _xlsx_package(sheet_names):
+    """The workbook parts around the sheets, once the number of sheets is known"""
+    content_types = (
+        _XML_DECLARATION +
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>' +
+        ''.join(f'<Override PartName="/xl/worksheets/sheet{n}.xml" '
+                'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+                for n in range(1, len(sheet_names) + 1)) +
+        '</Types>'
+    )
+    workbook = (
+        _XML_DECLARATION +
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets>' +
+        ''.join(f'<sheet name={quoteattr(name)} sheetId="{n}" r:id="rId{n}"/>'
+                for n, name in enumerate(sheet_names, 1)) +
+        '</sheets></workbook>'
+    )
+    workbook_rels = (
+        _XML_DECLARATION +
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">' +
+        ''.join(f'<Relationship Id="rId{n}" '
+                'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+                f'Target="worksheets/sheet{n}.xml"/>' for n in range(1, len(sheet_names) + 1)) +
+        f'<Relationship Id="rId{len(sheet_names) + 1}" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+        'Target="styles.xml"/>'
+        '</Relationships>'
+    )
+    return [
+        ('xl/workbook.xml', workbook),
+        ('xl/_rels/workbook.xml.rels', workbook_rels),
+        ('xl/styles.xml', _XLSX_STYLES),
+        ('_rels/.rels', _XLSX_ROOT_RELS),
+        ('[Content_Types].xml', content_types),
+    ]
+
+
+_SHEET_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<sheetViews><sheetView workbookViewId="0">'
+    '<pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/>'
+    '</sheetView></sheetViews><sheetData>'
+)
+
+_SHEET_TAIL = '</sheetData></worksheet>'
+
+
+def _xlsx_cell(value, style=''):
+    if value is None:
+        return '<c/>'
+    if isinstance(value, bool):
+        return f'<c t="b"{style}><v>{int(value)}</v></c>'
+    if isinstance(value, numbers.Real) and math.isfinite(value):
+        return f'<c{style}><v>{value!r}</v></c>'
+    text = escape(_ILLEGAL_XML_RE.sub('', str(value)))
+    return f'<c t="inlineStr"{style}><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _xlsx_row(values, style=''):
+    return ('<row>' + ''.join(_xlsx_cell(value, style) for value in values) + '</row>').encode('utf-8')
+
+
+def _sheet_name(title, number):
+    # Excel sheet names: at most 31 characters, none of []:*?/\
+    name = ' '.join(re.sub(r'[\[\]:*?/\\]', ' ', title).split()) or 'Export'
+    suffix = f" ({number})" if number > 1 else ''
+    return name[:31 - len(suffix)] + suffix
+
+
+def iter_xlsx(columns, rows, title='Export'):
+    """Yield an XLSX workbook: a bold, frozen header row, then one row per row
+
+    Rows beyond Excel's limit continue on further sheets, each with the
+    header. The sheets are zipped first and the workbook parts listing
+    them last, so the row count is never needed up front.
+    """
+    rows = iter(rows)
+    header = _xlsx_row(columns, ' s="1"')
+    names = []
+
+    def sheet(first):
+        yield _SHEET_HEAD.encode('utf-8')
+        yield header
+        if first is not None:
+            yield _xlsx_row(first)
+            for row in itertools.islice(rows, XLSX_MAX_ROWS - 2):
+                yield _xlsx_row(row)
+        yield _SHEET_TAIL.encode('utf-8')
+
+    def entries():
+        first = next(rows, None)
+        while True:
+            names.append(_sheet_name(title, len(names) + 1))
+            yield f"xl/worksheets/sheet{len(names)}.xml", sheet(first)
+            first = next(rows, None)
+            if first is None:
+                break
+        for name, xml in _xlsx_package(names):
+            yield name, [xml.encode('utf-8')]
+
+    return iter_zip(entries())
+
+
+def iter_export(fmt, columns, rows, title='Export'):
+    """Yield the rows encoded in one of FORMATS"""
+    if fmt == 'csv':
+        return iter_csv(columns, rows)
+    if fmt == 'ndjson':
+        return iter_ndjson(columns, rows)
+    if fmt == 'xlsx':
+        return iter_xlsx(columns, rows, title)
+    raise ValueError(f"Unknown export format: {fmt}")
+
+
+def stream_export(conn, cursor, columns, fmt, filename, title='Export', batch_size=500):
+    """Stream the cursor's rows as a downloadable file and close conn when the response is closed
+
+    A failure once the file has started is re-raised so the transfer is
+    aborted rather than delivering a truncated file with a 200.
+    """
+    cursor = prefetch(conn, cursor, batch_size)
+
+    def generate():
+        try:
+            yield from iter_export(fmt, columns, iter_rows(cursor, batch_size), title)
+        except Exception as e:
+            logger.error("Error streaming export %s: %s", filename, e)
+            raise
+
+    response = Response(generate(), mimetype=FORMATS[fmt][0])
+    response.call_on_close(conn.close)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+class ExportLimitError(Exception):
+    """A user, or this worker, already has as many export jobs as allowed"""
+
+
+class ExportJobs:
+    """Background exports written under `directory`, visible to every worker
+
+    At most `workers` jobs run at once per process, with up to `max_pending`
+    queued behind them; `per_user` caps one user's unfinished jobs across
+    all workers. A running job whose status has not been updated for
+    `stale_after` seconds, or a queued job whose worker process no longer
+    exists, is reported as failed.
+    """
+
+    def __init__(self, directory, ttl=86400, workers=2, max_pending=16, per_user=2, stale_after=900):
+        self.directory = directory
+        self.ttl = ttl
+        self.workers = workers
+        self.max_pending = max_pending
+        self.per_user = per_user
+        self.stale_after = stale_after
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._executor = None
+        self._executor_pid = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _meta_path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def path(self, job):
+        """File a job's export is written to"""
+        return os.path.join(self.directory, f"{job['id']}.{FORMATS[job['format']][1]}")
+
+    def _save(self, job):
+        tmp = self._meta_path(job['id']) + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(job, f)
+        os.replace(tmp, self._meta_path(job['id']))
+
+    def _load(self, job_id):
+        if not _JOB_ID_RE.match(job_id or ''):
+            return None
+        try:
+            with open(self._meta_path(job_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get(self, job_id):
+        """A job's status dict, or None when there is no such job"""
+        job = self._load(job_id)
+        if job is None:
+            return None
+        if job['status'] == 'running':
+            # Running jobs heartbeat; one that stopped doing so lost its worker
+            dead = time.time() - job.get('updated_at', job['created_at']) > self.stale_after
+        elif job['status'] == 'queued':
+            # Queued jobs only wait on their own worker's pool, however long that takes
+            dead = job.get('host') == socket.gethostname() and not _pid_alive(job.get('pid'))
+        else:
+            dead = False
+        if dead:
+            job.update(status='failed', error='Export stopped before finishing')
+        return job
+
+    def unfinished(self, user_id):
+        """Number of the user's jobs that are queued or running"""
+        count = 0
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                job = self.get(name[:-5])
+                if job is not None and job.get('user_id') == user_id and job['status'] in ('queued', 'running'):
+                    count += 1
+        return count
+
+    def _pool(self):
+        """This process's executor (threads do not survive a fork)"""
+        if self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='export')
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def start(self, produce, **fields):
+        """Queue produce() - an iterator of bytes - to be written to a file
+
+        `fields` (user_id, dataset, format, filters...) are stored with the
+        job's status; `format` picks the file extension. Returns the job, or
+        raises ExportLimitError when `user_id` already has `per_user`
+        unfinished jobs or this worker's queue is full.
+        """
+        self.cleanup()
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise ExportLimitError("Too many exports in progress, try again later")
+            if fields.get('user_id') is not None and self.unfinished(fields['user_id']) >= self.per_user:
+                raise ExportLimitError(f"You already have {self.per_user} exports in progress")
+            now = time.time()
+            job = dict(fields, id=uuid.uuid4().hex, status='queued', created_at=now, updated_at=now,
+                       pid=os.getpid(), host=socket.gethostname())
+            self._save(job)
+            self._pending += 1
+        try:
+            # The pool thread updates its own copy; the caller keeps the queued snapshot
+            self._pool().submit(self._run, dict(job), produce)
+        except RuntimeError as e:
+            self._finished()
+            job.update(status='failed', error=str(e), updated_at=time.time())
+            self._save(job)
+        return job
+
+    def _finished(self):
+        with self._lock:
+            self._pending -= 1
+
+    def _run(self, job, produce):
+        path = self.path(job)
+        tmp = path + '.tmp'
+        started = time.perf_counter()
+        job.update(status='running', updated_at=time.time())
+        self._save(job)
+        try:
+            with open(tmp, 'wb') as f:
+                for chunk in produce():
+                    f.write(chunk)
+                    # Heartbeat, so other workers can tell a slow job from a dead one
+                    if time.time() - job['updated_at'] >= HEARTBEAT_INTERVAL:
+                        job['updated_at'] = time.time()
+                        self._save(job)
+            os.replace(tmp, path)
+            job.update(status='done', bytes=os.path.getsize(path))
+        except Exception as e:
+            logger.error("Error running export job %s: %s", job['id'], e)
+            job.update(status='failed', error=str(e))
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        finally:
+            self._finished()
+        job.update(finished_at=time.time(), updated_at=time.time(), seconds=round(time.perf_counter() - started, 3))
+        self._save(job)
+        logger.info("Export job %s %s in %.2fs", job['id'], job['status'], job['seconds'])
+
+    def cleanup(self):
+        """Delete jobs, and their files, created more than `ttl` seconds ago"""
+        cutoff = time.time() - self.ttl
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            job = self._load(name[:-5])
+            if job is None or job.get('created_at', 0) >= cutoff:
+                continue
+            for path in (self.path(job), self._meta_path(job['id'])):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
@@ -0,0 +1,197 @@
+"""
+Template fragment caching and render-time metrics
+Wrap an expensive block of a template in
+
+    {% cache 'resource_grid', ['resources', 'subjects', 'users'], current_filters %}
+        ...
+    {% endcache %}
+
+The rendered HTML is keyed by the fragment name, the session's organization
+and role, the change counters of the listed tables and any extra values
+after them. A write that bumps one of those counters yields a new key, so
+stale fragments are never served and simply age out of the LRU.
+"""
+
+import json
+import logging
+import threading
+import time
+
+from flask import before_render_template, session, template_rendered
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+from web import versions
+from web.lru import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class Deferred:
+    """Value loaded on first use
+
+    Passing a view's data to the template as Deferred means a fragment
+    cache hit skips the queries as well as the rendering.
+    """
+
+    def __init__(self, loader, *args, **kwargs):
+        self._loader = loader
+        self._args = args
+        self._kwargs = kwargs
+        self._loaded = False
+        self._value = None
+
+    def get(self):
+        if not self._loaded:
+            self._value = self._loader(*self._args, **self._kwargs)
+            self._loaded = True
+        return self._value
+
+    def __iter__(self):
+        return iter(self.get())
+
+    def __len__(self):
+        return len(self.get())
+
+    def __bool__(self):
+        return bool(self.get())
+
+    def __getitem__(self, key):
+        return self.get()[key]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+
+class FragmentCacheExtension(Extension):
+    """Jinja {% cache name, tables, *vary %} ... {% endcache %} tag"""
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', [nodes.List(args)]),
+                               [], [], body).set_lineno(lineno)
+
+    def _render(self, args, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+        name, tables, *vary = args
+        return cache.render(name, tables, vary, caller)
+
+
+class FragmentCache:
+    """Per-process cache of rendered fragments plus per-template timings
+
+    `versions_for(organization_id, tables)` returns the change counters
+    the fragment keys are built from.
+    """
+
+    def __init__(self, app=None, versions_for=None, max_size=16 * 1024 * 1024, enabled=True):
+        self.versions_for = versions_for
+        self.enabled = enabled
+        self.store = LRUCache(max_size)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._templates = {}
+        self._fragments = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.jinja_env.add_extension(FragmentCacheExtension)
+        app.jinja_env.fragment_cache = self
+        before_render_template.connect(self._render_started, app, weak=False)
+        template_rendered.connect(self._render_finished, app, weak=False)
+
+    def key(self, name, tables, vary):
+        """Cache key for a fragment as seen by the current session"""
+        org_id = session.get('current_org_id')
+        table_versions = self.versions_for(org_id, tuple(tables))
+        etag = versions.make_etag(table_versions, *(json.dumps(v, sort_keys=True, default=str) for v in vary))
+        return (name, org_id, session.get('user_type'), session.get('current_org_role'), etag)
+
+    def render(self, name, tables, vary, caller):
+        """Return the cached fragment, rendering it with caller() on a miss"""
+        if not self.enabled:
+            return caller()
+        try:
+            key = self.key(name, tables, vary)
+        except Exception as e:
+            logger.error("Error building fragment cache key for %s: %s", name, e)
+            return caller()
+
+        html = self.store.get(key)
+        if html is not None:
+            self._record_fragment(name, True, 0.0)
+            return html
+        start = time.perf_counter()
+        html = caller()
+        self._record_fragment(name, False, time.perf_counter() - start)
+        self.store.set(key, html)
+        return html
+
+    def clear(self):
+        self.store.clear()
+
+    def _record_fragment(self, name, hit, seconds):
+        with self._lock:
+            stats = self._fragments.setdefault(name, {'hits': 0, 'misses': 0, 'render_seconds': 0.0})
+            stats['hits' if hit else 'misses'] += 1
+            stats['render_seconds'] += seconds
+
+    def _render_started(self, sender, template, context, **extra):
+        stack = getattr(self._local, 'starts', None)
+        if stack is None:
+            stack = self._local.starts = []
+        stack.append(time.perf_counter())
+
+    def _render_finished(self, sender, template, context, **extra):
+        stack = getattr(self._local, 'starts', None)
+        if not stack:
+            return
+        elapsed = time.perf_counter() - stack.pop()
+        with self._lock:
+            stats = self._templates.setdefault(template.name, {'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+            stats['count'] += 1
+            stats['total_seconds'] += elapsed
+            stats['max_seconds'] = max(stats['max_seconds'], elapsed)
+
+    def totals(self):
+        """Raw per-template and per-fragment counters for this process"""
+        with self._lock:
+            return ({name: dict(s) for name, s in self._templates.items()},
+                    {name: dict(s) for name, s in self._fragments.items()})
+
+    def stats(self):
+        """Render timings per template and hit ratios per fragment (this process)"""
+        with self._lock:
+            templates = {
+                name: {
+                    'count': s['count'],
+                    'avg_ms': round(s['total_seconds'] * 1000 / s['count'], 3),
+                    'max_ms': round(s['max_seconds'] * 1000, 3),
+                }
+                for name, s in self._templates.items()
+            }
+            fragments = {}
+            for name, s in self._fragments.items():
+                lookups = s['hits'] + s['misses']
+                fragments[name] = {
+                    'hits': s['hits'],
+                    'misses': s['misses'],
+                    'hit_ratio': round(s['hits'] / lookups, 4) if lookups else 0.0,
+                    'avg_render_ms': round(s['render_seconds'] * 1000 / s['misses'], 3) if s['misses'] else 0.0,
+                }
+        return {'templates': templates, 'fragments': fragments, 'entries': len(self.store)}
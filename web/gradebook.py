@@ -0,0 +1,182 @@
+"""
+Gradebook statistics for a class's students x assignments grid
+One set-based query returns a row per submission; its columns (student,
+assignment, grade, status, submission date) are mapped onto a students x
+assignments grid: grades (missing where there is no grade), status and a
+late flag. Per-student averages and per-assignment mean, median, standard
+deviation and grade distribution are computed over the grid. With NumPy the
+query columns go straight into arrays and every statistic is a whole-matrix
+operation; without it the statistics module gives the same numbers, up to
+float rounding in the last reported decimal.
+"""
+
+import math
+import statistics
+import warnings
+
+try:
+    import numpy
+except ImportError:  # numpy is optional; the statistics module gives the same results
+    numpy = None
+
+# Distribution bands as (label, lowest grade in the band), highest first
+GRADE_BANDS = [('90-100', 90), ('80-89', 80), ('70-79', 70), ('60-69', 60), ('0-59', None)]
+
+MISSING = 'missing'
+
+
+def is_late(submission_date, due_date):
+    """Whether a submission was made after the day it was due"""
+    if not submission_date or not due_date:
+        return False
+    return str(submission_date)[:10] > str(due_date)[:10]
+
+
+def _band(grade):
+    """Index in GRADE_BANDS of the band a grade falls in"""
+    for k, (_, lowest) in enumerate(GRADE_BANDS):
+        if lowest is None or grade >= lowest:
+            return k
+
+
+def _round(value):
+    return None if value is None or math.isnan(value) else round(float(value), 2)
+
+
+def _columns(cells):
+    """The query rows transposed into (student_ids, assignment_ids, grades, statuses, submission_dates)"""
+    return tuple(zip(*cells)) if cells else ((),) * 5
+
+
+def _positions(ids, order):
+    """Index of each of `ids` in the array `order`, or -1 when it is not there"""
+    ids = numpy.asarray(ids, dtype=numpy.int64)
+    sorter = numpy.argsort(order, kind='stable')
+    found = sorter[numpy.minimum(numpy.searchsorted(order, ids, sorter=sorter), order.size - 1)]
+    return numpy.where(order[found] == ids, found, -1)
+
+
+def _grid_numpy(students, assignments, cells):
+    n, m = len(students), len(assignments)
+    student_ids, assignment_ids, grade_values, states, dates = _columns(cells)
+    i = _positions(student_ids, numpy.array([student['id'] for student in students], dtype=numpy.int64))
+    j = _positions(assignment_ids, numpy.array([assignment['id'] for assignment in assignments], dtype=numpy.int64))
+    keep = (i >= 0) & (j >= 0)
+    i, j = i[keep], j[keep]
+
+    grades = numpy.full((n, m), numpy.nan)
+    grades[i, j] = numpy.array(grade_values, dtype=float)[keep]
+    graded = ~numpy.isnan(grades)
+    states = numpy.array(states, dtype=object)[keep]
+    status = numpy.full((n, m), MISSING, dtype=object)
+    status[i, j] = numpy.where(numpy.equal(states, None) | numpy.equal(states, ''), 'submitted', states)
+    present = numpy.zeros((n, m), dtype=bool)
+    present[i, j] = True
+    # Dates compare as YYYY-MM-DD strings, as in is_late()
+    due = numpy.array([str(assignment.get('due_date') or '')[:10] for assignment in assignments], dtype='U10')
+    dates = numpy.array(dates, dtype=object)[keep]
+    dates = numpy.where(numpy.equal(dates, None), '', dates).astype('U10')
+    late = numpy.zeros((n, m), dtype=bool)
+    late[i, j] = (dates != '') & (due[j] != '') & (dates > due[j])
+
+    with numpy.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # all-NaN columns give NaN statistics
+        student_counts = graded.sum(axis=1)
+        averages = numpy.nansum(grades, axis=1) / student_counts
+        counts = graded.sum(axis=0)
+        means = numpy.nansum(grades, axis=0) / counts
+        medians = numpy.nanmedian(grades, axis=0)
+        stddevs = numpy.sqrt(numpy.nansum((grades - means) ** 2, axis=0) / counts)
+    # Band index in GRADE_BANDS order for every grade, counted per column
+    thresholds = [lowest for _, lowest in reversed(GRADE_BANDS) if lowest is not None]
+    bands = len(GRADE_BANDS) - 1 - numpy.digitize(grades[graded], thresholds)
+    distribution = numpy.bincount(numpy.nonzero(graded)[1] * len(GRADE_BANDS) + bands,
+                                  minlength=m * len(GRADE_BANDS)).reshape(m, len(GRADE_BANDS))
+    return {
+        'grades': numpy.where(graded, grades, None).tolist(),
+        'status': status.tolist(),
+        'late': late.tolist(),
+        'averages': averages.tolist(),
+        'counts': student_counts.tolist(),
+        'student_submitted': present.sum(axis=1).tolist(),
+        'student_late': late.sum(axis=1).tolist(),
+        'columns': list(zip(counts.tolist(), means.tolist(), medians.tolist(), stddevs.tolist(),
+                            distribution.tolist(), present.sum(axis=0).tolist(), late.sum(axis=0).tolist())),
+    }
+
+
+def _grid_python(students, assignments, cells):
+    rows = {student['id']: i for i, student in enumerate(students)}
+    cols = {assignment['id']: j for j, assignment in enumerate(assignments)}
+    n, m = len(students), len(assignments)
+    grades = [[None] * m for _ in range(n)]
+    status = [[MISSING] * m for _ in range(n)]
+    late = [[False] * m for _ in range(n)]
+    for student_id, assignment_id, grade, state, submitted in cells:
+        i, j = rows.get(student_id), cols.get(assignment_id)
+        if i is None or j is None:
+            continue
+        grades[i][j] = float(grade) if grade is not None else None
+        status[i][j] = state or 'submitted'
+        late[i][j] = is_late(submitted, assignments[j].get('due_date'))
+
+    averages, counts = [], []
+    for row in grades:
+        values = [v for v in row if v is not None]
+        counts.append(len(values))
+        averages.append(sum(values) / len(values) if values else math.nan)
+    columns = []
+    for j in range(m):
+        values = [row[j] for row in grades if row[j] is not None]
+        distribution = [0] * len(GRADE_BANDS)
+        for value in values:
+            distribution[_band(value)] += 1
+        submitted = sum(1 for i in range(n) if status[i][j] != MISSING)
+        late_count = sum(1 for i in range(n) if late[i][j])
+        if values:
+            columns.append((len(values), statistics.mean(values), statistics.median(values),
+                            statistics.pstdev(values), distribution, submitted, late_count))
+        else:
+            columns.append((0, math.nan, math.nan, math.nan, distribution, submitted, late_count))
+    return {
+        'grades': grades,
+        'status': status,
+        'late': late,
+        'averages': averages,
+        'counts': counts,
+        'student_submitted': [sum(1 for s in row if s != MISSING) for row in status],
+        'student_late': [sum(row) for row in late],
+        'columns': columns,
+    }
+
+
+def build(students, assignments, cells):
+    """Assemble the gradebook for a class
+
+    `students` and `assignments` are lists of dicts with an 'id', in display
+    order (assignments need 'due_date'); `cells` are (student_id,
+    assignment_id, grade, status, submission_date) rows. Submissions from
+    students not in `students` are ignored.
+    """
+    if numpy is not None and students and assignments:
+        grid = _grid_numpy(students, assignments, cells)
+    else:
+        grid = _grid_python(students, assignments, cells)
+
+    student_rows = []
+    for i, student in enumerate(students):
+        student_rows.append(dict(student, average=_round(grid['averages'][i]), graded=int(grid['counts'][i]),
+                                 submitted=int(grid['student_submitted'][i]), late=int(grid['student_late'][i])))
+    assignment_columns = []
+    for assignment, (count, mean, median, stddev, bands, submitted, late) in zip(assignments, grid['columns']):
+        distribution = {label: int(bands[k]) for k, (label, _) in enumerate(GRADE_BANDS)}
+        assignment_columns.append(dict(assignment, graded=int(count), mean=_round(mean), median=_round(median),
+                                       stddev=_round(stddev), distribution=distribution,
+                                       submitted=int(submitted), late=int(late)))
+    return {
+        'students': student_rows,
+        'assignments': assignment_columns,
+        'grades': grid['grades'],
+        'status': grid['status'],
+        'late': grid['late'],
+    }
@@ -0,0 +1,206 @@
+"""
+Structured, non-blocking logging
+Records are tagged with the current request id, filtered by per-logger
+levels, rate limited when the same message repeats, and handed to a queue;
+a background thread formats them as JSON lines and writes them out, so a
+request never waits on stdout. Debug-level calls below the configured level
+return before formatting anything.
+
+    LOG_LEVEL=INFO LOG_LEVELS="web.querylog=DEBUG,werkzeug=WARNING" LOG_FORMAT=json
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, has_request_context, request, session
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+# Attributes every LogRecord has; anything else was passed via extra= and is emitted as a field
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class RequestContextFilter(logging.Filter):
+    """Attach the request id, endpoint and user to records logged during a request"""
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get('request_id')
+            record.endpoint = request.endpoint
+            record.user_id = session.get('user_id')
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """Let `burst` records per message template through every `interval` seconds
+
+    Records are grouped by logger, level and the unformatted message, so
+    `logger.error("Error getting resources: %s", e)` is limited as one
+    message whatever e is. The first record after a suppressed stretch
+    carries a `suppressed` count. Only WARNING and above are limited.
+    """
+
+    def __init__(self, interval=60.0, burst=5, min_level=logging.WARNING):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.min_level = min_level
+        self._lock = threading.Lock()
+        self._windows = {}
+
+    def filter(self, record):
+        if record.levelno < self.min_level:
+            return True
+        key = (record.name, record.levelno, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                self._windows[key] = [now, 1, 0]
+                if len(self._windows) > 10000:
+                    self._windows = {key: self._windows[key]}
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Readable single-line format for local development"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)-7s %(name)s: %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        request_id = getattr(record, 'request_id', None)
+        return f'{line} [{request_id}]' if request_id else line
+
+
+class AsyncHandler(QueueHandler):
+    """QueueHandler that never blocks: records are dropped (and counted) when the queue is full
+
+    The writer thread is started lazily in each process, so the handler
+    keeps working in gunicorn workers forked after it was configured.
+    """
+
+    def __init__(self, target, maxsize=10000):
+        super().__init__(queue.Queue(maxsize))
+        self.target = target
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_listener(self):
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._listener = QueueListener(self.queue, self.target, respect_handler_level=True)
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def prepare(self, record):
+        """Render the message and traceback now; the writer thread only serializes"""
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+            self._pid = None
+
+
+def parse_levels(spec):
+    """'web.querylog=DEBUG,werkzeug=WARNING' -> {'web.querylog': 'DEBUG', 'werkzeug': 'WARNING'}"""
+    levels = {}
+    for item in (spec or '').split(','):
+        name, _, level = item.partition('=')
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging(app=None, level='INFO', levels=None, fmt='json', stream=None,
+                      rate_limit_interval=60.0, rate_limit_burst=5):
+    """Route the root logger through the async handler and return it"""
+    target = logging.StreamHandler(stream or sys.stdout)
+    target.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+    handler = AsyncHandler(target)
+    handler.addFilter(RequestContextFilter())
+    if rate_limit_burst:
+        handler.addFilter(RateLimitFilter(rate_limit_interval, rate_limit_burst))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+    for name, logger_level in (levels or {}).items():
+        logging.getLogger(name).setLevel(logger_level)
+    atexit.register(handler.stop)
+
+    if app is not None:
+        # Flask's own handler would write to stderr synchronously
+        app.logger.handlers.clear()
+        app.logger.propagate = True
+        app.before_request(_assign_request_id)
+        app.after_request(_echo_request_id)
+    return handler
+
+
+def _assign_request_id():
+    g.request_id = request.headers.get(REQUEST_ID_HEADER, '')[:64] or uuid.uuid4().hex[:16]
+
+
+def _echo_request_id(response):
+    request_id = g.get('request_id')
+    if request_id:
+        response.headers[REQUEST_ID_HEADER] = request_id
+    return response
@@ -0,0 +1,185 @@
+"""
+tracemalloc-based memory accounting
+When enabled, every request records how far Python allocations rose above
+their level at the start of the request (peak) and how much of that was
+still allocated at the end (retained). Per-route totals show which handlers
+materialize large results; periodic snapshots of the top allocation sites,
+diffed against the first one, show where a worker's memory keeps growing.
+
+tracemalloc's peak is process-wide, so per-request figures are exact for
+sync workers and approximate when one worker serves requests on several
+threads. Tracing slows allocation-heavy code noticeably; leave it off
+unless investigating.
+"""
+
+import linecache
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+from flask import g, request
+
+_SNAPSHOT_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, linecache.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+
+def _format_stat(stat):
+    frame = stat.traceback[0]
+    entry = {
+        'site': f"{frame.filename}:{frame.lineno}",
+        'size_bytes': stat.size,
+        'count': stat.count,
+    }
+    if hasattr(stat, 'size_diff'):
+        entry['size_diff_bytes'] = stat.size_diff
+        entry['count_diff'] = stat.count_diff
+    return entry
+
+
+class MemoryTracker:
+    """Per-request and per-route allocation accounting plus snapshot history
+
+    `on_request(endpoint, peak_bytes, retained_bytes)` is called after each
+    tracked request, e.g. to feed a metrics histogram.
+    """
+
+    def __init__(self, app=None, enabled=False, frames=5, snapshot_interval=300.0, max_snapshots=12,
+                 on_request=None):
+        self.enabled = enabled
+        self.frames = frames
+        self.snapshot_interval = snapshot_interval
+        self.on_request = on_request
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._snapshots = deque(maxlen=max_snapshots)
+        self._baseline = None
+        self._last_snapshot = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not self.enabled:
+            return
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+
+    # Per-request accounting
+
+    def _before_request(self):
+        tracemalloc.reset_peak()
+        g.memory_start = tracemalloc.get_traced_memory()[0]
+
+    def _teardown_request(self, exc):
+        start = g.pop('memory_start', None)
+        if start is None:
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        peak_bytes = max(peak - start, 0)
+        retained_bytes = current - start
+        endpoint = request.endpoint or 'unmatched'
+        with self._lock:
+            route = self._routes.get(endpoint)
+            if route is None:
+                route = self._routes[endpoint] = {'requests': 0, 'peak_total': 0, 'peak_max': 0,
+                                                  'retained_total': 0, 'growth_total': 0, 'worst_path': None}
+            route['requests'] += 1
+            route['peak_total'] += peak_bytes
+            route['retained_total'] += retained_bytes
+            route['growth_total'] += max(retained_bytes, 0)
+            if peak_bytes > route['peak_max']:
+                route['peak_max'] = peak_bytes
+                route['worst_path'] = request.full_path.rstrip('?')
+        if self.on_request is not None:
+            self.on_request(endpoint, peak_bytes, retained_bytes)
+        if time.monotonic() - self._last_snapshot >= self.snapshot_interval:
+            self.take_snapshot()
+
+    def routes(self):
+        """Per-route figures, largest peak first"""
+        with self._lock:
+            routes = {name: dict(r) for name, r in self._routes.items()}
+        result = []
+        for name, r in routes.items():
+            result.append({
+                'endpoint': name,
+                'requests': r['requests'],
+                'avg_peak_bytes': r['peak_total'] // r['requests'],
+                'max_peak_bytes': r['peak_max'],
+                'worst_path': r['worst_path'],
+                'avg_retained_bytes': r['retained_total'] // r['requests'],
+                'retained_total_bytes': r['retained_total'],
+            })
+        result.sort(key=lambda r: -r['max_peak_bytes'])
+        return result
+
+    def totals(self):
+        """[(labels, value)] of bytes left allocated by requests, per route (for Metrics)"""
+        with self._lock:
+            return [({'endpoint': name}, r['growth_total']) for name, r in self._routes.items()]
+
+    # Snapshots
+
+    def take_snapshot(self):
+        """Record the current allocation sites; the first snapshot is the diff baseline"""
+        if not tracemalloc.is_tracing():
+            return None
+        self._last_snapshot = time.monotonic()
+        snapshot = tracemalloc.take_snapshot().filter_traces(_SNAPSHOT_FILTERS)
+        entry = {'taken_at': time.strftime('%Y-%m-%d %H:%M:%S'), 'snapshot': snapshot,
+                 'traced_bytes': tracemalloc.get_traced_memory()[0]}
+        with self._lock:
+            if self._baseline is None:
+                self._baseline = entry
+            self._snapshots.append(entry)
+        return entry
+
+    def top_sites(self, limit=20, key_type='lineno'):
+        """Largest allocation sites in the latest snapshot"""
+        with self._lock:
+            latest = self._snapshots[-1] if self._snapshots else None
+        if latest is None:
+            return []
+        return [_format_stat(stat) for stat in latest['snapshot'].statistics(key_type)[:limit]]
+
+    def diff(self, since=None, limit=20, key_type='lineno'):
+        """Growth by allocation site between a stored snapshot (default: baseline) and the latest"""
+        with self._lock:
+            snapshots = list(self._snapshots)
+            baseline = self._baseline
+        if not snapshots:
+            return None
+        old = baseline if since is None else snapshots[since]
+        new = snapshots[-1]
+        stats = new['snapshot'].compare_to(old['snapshot'], key_type)
+        return {
+            'from': old['taken_at'],
+            'to': new['taken_at'],
+            'traced_growth_bytes': new['traced_bytes'] - old['traced_bytes'],
+            'sites': [_format_stat(stat) for stat in stats[:limit]],
+        }
+
+    def snapshots(self):
+        with self._lock:
+            return [{'index': i, 'taken_at': s['taken_at'], 'traced_bytes': s['traced_bytes']}
+                    for i, s in enumerate(self._snapshots)]
+
+    def report(self, limit=20, since=None):
+        """Everything the admin endpoint shows"""
+        if not self.enabled:
+            return {'enabled': False}
+        return {
+            'enabled': True,
+            'traced_bytes': tracemalloc.get_traced_memory()[0],
+            'routes': self.routes(),
+            'top_sites': self.top_sites(limit),
+            'snapshots': self.snapshots(),
+            'diff': self.diff(since, limit),
+        }
@@ -0,0 +1,379 @@
+"""
+Prometheus metrics shared across gunicorn workers
+Each worker keeps its counters and histograms in memory and periodically
+writes a snapshot to <directory>/metrics-<pid>-<start>.json. /metrics merges
+the snapshots of every worker on the host into the Prometheus text format, so
+recording a request costs a few dict updates and no I/O. Snapshots of workers
+that have exited are folded into <directory>/retired.json at scrape time, so
+the directory holds one file per live worker plus one aggregate.
+"""
+
+import atexit
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+
+from flask import Response, g, has_request_context, request, session
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+MEMORY_BUCKETS = (10000, 100000, 1000000, 10000000, 50000000, 100000000, 500000000)
+
+METRICS = {
+    'staffroom_http_requests_total': ('counter', 'HTTP requests by endpoint, method and status'),
+    'staffroom_http_request_duration_seconds': ('histogram', 'Time to produce the response, by endpoint'),
+    'staffroom_http_response_size_bytes': ('histogram', 'Response body bytes sent, by endpoint'),
+    'staffroom_sql_queries_per_request': ('histogram', 'SQL statements executed per request, by endpoint'),
+    'staffroom_sql_seconds_per_request': ('histogram', 'Time spent executing SQL per request, by endpoint'),
+    'staffroom_sql_queries_total': ('counter', 'SQL statements executed, by endpoint'),
+    'staffroom_sql_seconds_total': ('counter', 'Time spent executing SQL, by endpoint'),
+    'staffroom_sql_n_plus_one_total': ('counter', 'Statements repeated past the N+1 threshold in one request, by endpoint'),
+    'staffroom_db_connections_opened_total': ('counter', 'Database connections opened (pool checkouts on PostgreSQL)'),
+    'staffroom_upload_bytes_total': ('counter', 'Multipart upload bytes received, by endpoint'),
+    'staffroom_request_memory_peak_bytes': ('histogram', 'Peak Python allocations above the request start, by endpoint'),
+}
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+
+
+def _snapshot_pid(filename):
+    """The pid in a metrics-<pid>-<start>.json name, or None"""
+    try:
+        return int(filename.split('-')[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def _add_snapshot(counters, histograms, snapshot):
+    """Sum one snapshot's counters and histograms into the running totals"""
+    for name, labels, value in snapshot['counters']:
+        key = (name, tuple(tuple(pair) for pair in labels))
+        counters[key] = counters.get(key, 0) + value
+    for name, labels, h in snapshot['histograms']:
+        key = (name, tuple(tuple(pair) for pair in labels))
+        merged = histograms.get(key)
+        if merged is None:
+            histograms[key] = {'buckets': h['buckets'], 'counts': list(h['counts']),
+                               'sum': h['sum'], 'count': h['count']}
+        else:
+            merged['counts'] = [a + b for a, b in zip(merged['counts'], h['counts'])]
+            merged['sum'] += h['sum']
+            merged['count'] += h['count']
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+class Metrics:
+    """Per-worker metric registry flushed to a shared directory"""
+
+    def __init__(self, app=None, directory='metrics', flush_interval=5.0, token=None):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.token = token
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._process_counters = []
+        self._collectors = []
+        self._last_flush = time.monotonic()
+        self._snapshot_pid = None
+        self._snapshot_name = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        os.makedirs(self.directory, exist_ok=True)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.add_url_rule('/metrics', 'metrics', self.view)
+        atexit.register(self.flush)
+
+    # Recording
+
+    def inc(self, name, labels=None, value=1):
+        key = (name, _labels_key(labels or {}))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets, labels=None):
+        key = (name, _labels_key(labels or {}))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': list(buckets), 'counts': [0] * len(buckets),
+                                                     'sum': 0, 'count': 0}
+            for i, bound in enumerate(histogram['buckets']):
+                if value <= bound:
+                    histogram['counts'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def record_query(self, sql, seconds):
+        """Query listener for web.database: attributes statements to the current request"""
+        if not has_request_context():
+            return
+        g.metrics_sql_count = g.get('metrics_sql_count', 0) + 1
+        g.metrics_sql_seconds = g.get('metrics_sql_seconds', 0.0) + seconds
+
+    def record_connect(self, url):
+        """Connect listener for web.database"""
+        self.inc('staffroom_db_connections_opened_total')
+
+    def register_process_counters(self, name, help_text, source):
+        """Add a per-process counter family; source() returns [(labels, value)]"""
+        METRICS.setdefault(name, ('counter', help_text))
+        self._process_counters.append((name, source))
+
+    def register_collector(self, collector):
+        """Add a scrape-time collector returning [(name, type, help, [(labels, value)])]
+
+        For values that are already shared between workers (e.g. stored in
+        the query cache database) and so must not be summed per worker.
+        """
+        self._collectors.append(collector)
+
+    def _before_request(self):
+        g.metrics_start = time.perf_counter()
+
+    def _after_request(self, response):
+        start = g.get('metrics_start')
+        if start is None or request.endpoint == 'metrics':
+            return response
+        endpoint = request.endpoint or 'unmatched'
+        labels = {'endpoint': endpoint}
+        self.inc('staffroom_http_requests_total',
+                 {'endpoint': endpoint, 'method': request.method, 'status': str(response.status_code)})
+        self.observe('staffroom_http_request_duration_seconds', time.perf_counter() - start, LATENCY_BUCKETS, labels)
+
+        sql_count = g.get('metrics_sql_count', 0)
+        sql_seconds = g.get('metrics_sql_seconds', 0.0)
+        self.observe('staffroom_sql_queries_per_request', sql_count, QUERY_COUNT_BUCKETS, labels)
+        self.observe('staffroom_sql_seconds_per_request', sql_seconds, LATENCY_BUCKETS, labels)
+        if sql_count:
+            self.inc('staffroom_sql_queries_total', labels, sql_count)
+            self.inc('staffroom_sql_seconds_total', labels, sql_seconds)
+
+        if request.mimetype == 'multipart/form-data' and request.content_length:
+            self.inc('staffroom_upload_bytes_total', labels, request.content_length)
+
+        if response.is_streamed and not response.direct_passthrough:
+            response.response = self._count_stream(response.response, labels)
+        else:
+            self.observe('staffroom_http_response_size_bytes', response.content_length or 0, SIZE_BUCKETS, labels)
+
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+        return response
+
+    def _count_stream(self, chunks, labels):
+        """Pass a streamed body through, recording its size once it is sent"""
+        size = 0
+        try:
+            for chunk in chunks:
+                size += len(chunk)
+                yield chunk
+        finally:
+            self.observe('staffroom_http_response_size_bytes', size, SIZE_BUCKETS, labels)
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+    # Sharing between workers
+
+    def _snapshot_path(self):
+        """This process's snapshot file
+
+        Named by pid and start time so a recycled worker never overwrites the
+        totals of the one it replaced.
+        """
+        pid = os.getpid()
+        if self._snapshot_pid != pid:
+            self._snapshot_pid = pid
+            self._snapshot_name = f'metrics-{pid}-{int(time.time() * 1000)}.json'
+        return os.path.join(self.directory, self._snapshot_name)
+
+    def flush(self):
+        """Write this worker's totals to its snapshot file"""
+        with self._lock:
+            counters = [[name, list(map(list, labels)), value] for (name, labels), value in self._counters.items()]
+            histograms = [[name, list(map(list, labels)), h] for (name, labels), h in self._histograms.items()]
+            self._last_flush = time.monotonic()
+        for name, source in self._process_counters:
+            try:
+                for labels, value in source():
+                    counters.append([name, sorted(labels.items()), value])
+            except Exception as e:
+                logger.error("Error collecting %s: %s", name, e)
+        path = self._snapshot_path()
+        try:
+            with open(path + '.tmp', 'w') as f:
+                json.dump({'counters': counters, 'histograms': histograms}, f)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            logger.error("Error writing metrics snapshot: %s", e)
+
+    def _read(self, filename):
+        try:
+            with open(os.path.join(self.directory, filename)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _merge_snapshots(self):
+        """Sum every worker's snapshot, folding exited workers into retired.json
+
+        Runs under an exclusive lock on the directory so two scrapes never
+        fold the same file; without fcntl the files are only merged.
+        """
+        lock = None
+        if fcntl is not None:
+            try:
+                lock = open(os.path.join(self.directory, '.lock'), 'w')
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            except OSError as e:
+                logger.error("Error locking metrics directory: %s", e)
+                lock = None
+        try:
+            return self._merge_locked(fold=lock is not None)
+        finally:
+            if lock is not None:
+                lock.close()
+
+    def _merge_locked(self, fold):
+        retired = self._read('retired.json') or {'counters': [], 'histograms': [], 'folded': []}
+        folded = set(retired.get('folded', []))
+        counters = {}
+        histograms = {}
+        _add_snapshot(counters, histograms, retired)
+        dead = {}
+        for filename in os.listdir(self.directory):
+            if not (filename.startswith('metrics-') and filename.endswith('.json')):
+                continue
+            if filename in folded:
+                # Absorbed by a fold that stopped before deleting it
+                if fold:
+                    try:
+                        os.remove(os.path.join(self.directory, filename))
+                    except OSError:
+                        pass
+                continue
+            snapshot = self._read(filename)
+            if snapshot is None:
+                continue
+            _add_snapshot(counters, histograms, snapshot)
+            pid = _snapshot_pid(filename)
+            if fold and pid is not None and pid != os.getpid() and not _pid_alive(pid):
+                dead[filename] = snapshot
+        if dead:
+            self._fold(retired, folded, dead)
+        return counters, histograms
+
+    def _fold(self, retired, folded, dead):
+        """Add exited workers' snapshots to retired.json, then delete them
+
+        The aggregate lists the files it has absorbed, so a crash before the
+        deletes cannot count them twice.
+        """
+        counters = {}
+        histograms = {}
+        _add_snapshot(counters, histograms, retired)
+        for snapshot in dead.values():
+            _add_snapshot(counters, histograms, snapshot)
+        remaining = [name for name in folded if os.path.exists(os.path.join(self.directory, name))]
+        path = os.path.join(self.directory, 'retired.json')
+        try:
+            with open(path + '.tmp', 'w') as f:
+                json.dump({
+                    'counters': [[name, list(map(list, labels)), value] for (name, labels), value in counters.items()],
+                    'histograms': [[name, list(map(list, labels)), h] for (name, labels), h in histograms.items()],
+                    'folded': sorted(remaining + list(dead)),
+                }, f)
+            os.replace(path + '.tmp', path)
+            for filename in dead:
+                os.remove(os.path.join(self.directory, filename))
+        except OSError as e:
+            logger.error("Error folding metrics snapshots: %s", e)
+
+    # Exposition
+
+    def render(self):
+        """All workers' metrics in the Prometheus text exposition format"""
+        self.flush()
+        counters, histograms = self._merge_snapshots()
+        families = {}
+        for (name, labels), value in counters.items():
+            families.setdefault(name, []).append((labels, [f'{name}{_format_labels(labels)} {_format_value(value)}']))
+        for (name, labels), h in histograms.items():
+            lines = []
+            for bound, count in zip(h['buckets'], h['counts']):
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", _format_value(bound)),))} {count}')
+            lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {h["count"]}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(h["sum"])}')
+            lines.append(f'{name}_count{_format_labels(labels)} {h["count"]}')
+            families.setdefault(name, []).append((labels, lines))
+
+        output = []
+        for name in sorted(families):
+            metric_type, help_text = METRICS.get(name, ('untyped', name))
+            output.append(f'# HELP {name} {help_text}')
+            output.append(f'# TYPE {name} {metric_type}')
+            for _, lines in sorted(families[name]):
+                output.extend(lines)
+        for collector in self._collectors:
+            try:
+                for name, metric_type, help_text, samples in collector():
+                    output.append(f'# HELP {name} {help_text}')
+                    output.append(f'# TYPE {name} {metric_type}')
+                    for labels, value in samples:
+                        output.append(f'{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}')
+            except Exception as e:
+                logger.error("Error collecting metrics: %s", e)
+        return '\n'.join(output) + '\n'
+
+    def _authorized(self):
+        if session.get('user_type') == 'admin':
+            return True
+        sent = request.headers.get('Authorization', '')
+        return bool(self.token and sent.startswith('Bearer ') and hmac.compare_digest(sent[7:], self.token))
+
+    def view(self):
+        """GET /metrics (an admin session or `Authorization: Bearer <token>`)"""
+        if not self._authorized():
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,341 @@
+"""
+On-demand request profiler
+Arming the profiler swaps app.wsgi_app for a middleware that profiles the
+next N requests matching an endpoint, path prefix and/or user; once they have
+been captured the original wsgi_app is put back. While disarmed nothing is
+installed, so unprofiled traffic runs exactly the code it would without this
+module. The profiler is armed in the worker that handles the admin request;
+results are written to a shared directory so any worker can serve them.
+
+Two modes:
+- cprofile: deterministic cProfile of the request thread, saved as pstats
+- sample: a background thread samples the request thread's stack every few
+  milliseconds, giving true collapsed stacks at a lower, fixed overhead
+
+Either session can be exported as a pstats file (cprofile), a text report,
+or collapsed stacks ("a;b;c 123" lines) for flamegraph.pl, speedscope or
+inferno.
+"""
+
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from werkzeug.wrappers import Request
+
+logger = logging.getLogger(__name__)
+
+MODES = ('cprofile', 'sample')
+
+
+def _frame_label(code):
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def _sample_stacks(thread_id, interval, stop, counts):
+    """Count the stacks seen on thread_id every `interval` seconds until stop is set"""
+    while not stop.wait(interval):
+        frame = sys._current_frames().get(thread_id)
+        stack = []
+        while frame is not None:
+            stack.append(_frame_label(frame.f_code))
+            frame = frame.f_back
+        if stack:
+            counts[';'.join(reversed(stack))] += 1
+
+
+def collapse_pstats(stats, max_depth=64, min_us=50):
+    """Approximate collapsed stacks (microseconds) from a cProfile call graph
+
+    cProfile only keeps caller/callee pairs, so a function's time is split
+    between its callers in proportion to each caller's share of its
+    cumulative time. Branches worth less than `min_us` are dropped, which
+    keeps the expansion of large call graphs bounded.
+    """
+    raw = stats.stats
+    lines = Counter()
+    min_seconds = min_us / 1e6
+
+    def label(func):
+        filename, _, name = func
+        return f"{os.path.basename(filename)}:{name}"
+
+    callees = {}
+    for func, (_, _, _, _, callers) in raw.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+
+    def walk(func, path, fraction, depth):
+        _, _, tt, ct, _ = raw[func]
+        path = path + [label(func)]
+        self_us = int(tt * fraction * 1e6)
+        if self_us:
+            lines[';'.join(path)] += self_us
+        if depth >= max_depth:
+            return
+        for callee, edge_ct in callees.get(func, []):
+            callee_ct = raw[callee][3]
+            if callee in stack_funcs or not callee_ct or edge_ct * fraction < min_seconds:
+                continue
+            stack_funcs.add(callee)
+            walk(callee, path, fraction * edge_ct / callee_ct, depth + 1)
+            stack_funcs.discard(callee)
+
+    roots = [func for func, value in raw.items() if not value[4]]
+    for root in roots:
+        stack_funcs = {root}
+        walk(root, [], 1.0, 0)
+    return lines
+
+
+class ProfilingMiddleware:
+    """WSGI middleware installed only while the profiler is armed"""
+
+    def __init__(self, profiler, wrapped):
+        self.profiler = profiler
+        self.wrapped = wrapped
+
+    def __call__(self, environ, start_response):
+        match = self.profiler.claim(environ)
+        if match is None:
+            return self.wrapped(environ, start_response)
+        return self.profiler.run(match, self.wrapped, environ, start_response)
+
+
+class Profiler:
+    """Arms, runs and stores on-demand profiles"""
+
+    def __init__(self, app=None, directory='profiles'):
+        self.directory = directory
+        self.app = None
+        self._lock = threading.Lock()
+        self._armed = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        os.makedirs(self.directory, exist_ok=True)
+
+    # Arming
+
+    def arm(self, count, mode='cprofile', endpoint=None, path=None, user_id=None, interval_ms=5):
+        """Profile the next `count` matching requests handled by this worker"""
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {', '.join(MODES)}")
+        if count < 1:
+            raise ValueError("count must be at least 1")
+        session_id = time.strftime('%Y%m%d-%H%M%S-') + uuid.uuid4().hex[:6]
+        armed = {
+            'session_id': session_id,
+            'mode': mode,
+            'endpoint': endpoint,
+            'path': path,
+            'user_id': user_id,
+            'interval': max(interval_ms, 1) / 1000.0,
+            'remaining': count,
+            'requested': count,
+            'pid': os.getpid(),
+        }
+        os.makedirs(os.path.join(self.directory, session_id), exist_ok=True)
+        self._write_meta(session_id, {k: v for k, v in armed.items() if k != 'remaining'})
+        with self._lock:
+            self._armed = armed
+            if not isinstance(self.app.wsgi_app, ProfilingMiddleware):
+                self.app.wsgi_app = ProfilingMiddleware(self, self.app.wsgi_app)
+        return session_id
+
+    def disarm(self):
+        with self._lock:
+            self._armed = None
+            if isinstance(self.app.wsgi_app, ProfilingMiddleware):
+                self.app.wsgi_app = self.app.wsgi_app.wrapped
+
+    def status(self):
+        with self._lock:
+            armed = dict(self._armed) if self._armed else None
+        return {'armed': armed, 'pid': os.getpid()}
+
+    def _matches(self, armed, environ):
+        if armed['path'] and not environ.get('PATH_INFO', '').startswith(armed['path']):
+            return None
+        endpoint = None
+        try:
+            endpoint, _ = self.app.url_map.bind_to_environ(environ).match()
+        except Exception:
+            pass
+        if armed['endpoint'] and endpoint != armed['endpoint']:
+            return None
+        user_id = None
+        if armed['user_id'] is not None:
+            session = self.app.session_interface.open_session(self.app, Request(environ))
+            user_id = session.get('user_id') if session is not None else None
+            if user_id != armed['user_id']:
+                return None
+        return {'endpoint': endpoint, 'user_id': user_id}
+
+    def claim(self, environ):
+        """Reserve one of the remaining profiles for this request, if it matches"""
+        armed = self._armed
+        if armed is None:
+            return None
+        match = self._matches(armed, environ)
+        if match is None:
+            return None
+        with self._lock:
+            if self._armed is not armed or armed['remaining'] < 1:
+                return None
+            armed['remaining'] -= 1
+            match['index'] = armed['requested'] - armed['remaining']
+            if armed['remaining'] == 0:
+                self._armed = None
+                if isinstance(self.app.wsgi_app, ProfilingMiddleware):
+                    self.app.wsgi_app = self.app.wsgi_app.wrapped
+        match.update(session_id=armed['session_id'], mode=armed['mode'], interval=armed['interval'],
+                     method=environ.get('REQUEST_METHOD'), path=environ.get('PATH_INFO'))
+        return match
+
+    # Running
+
+    def run(self, match, app, environ, start_response):
+        """Call the wrapped app under the profiler, including the body iteration"""
+        start = time.perf_counter()
+        if match['mode'] == 'cprofile':
+            profile = cProfile.Profile()
+            profile.enable()
+        else:
+            counts = Counter()
+            stop = threading.Event()
+            sampler = threading.Thread(target=_sample_stacks, daemon=True,
+                                       args=(threading.get_ident(), match['interval'], stop, counts))
+            sampler.start()
+
+        def finish():
+            if match['mode'] == 'cprofile':
+                profile.disable()
+                self._save(match, time.perf_counter() - start, profile=profile)
+            else:
+                stop.set()
+                sampler.join()
+                self._save(match, time.perf_counter() - start, counts=counts)
+
+        try:
+            body = app(environ, start_response)
+        except Exception:
+            finish()
+            raise
+        return self._iterate(body, finish)
+
+    def _iterate(self, body, finish):
+        try:
+            yield from body
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+            finish()
+
+    def _save(self, match, seconds, profile=None, counts=None):
+        folder = os.path.join(self.directory, match['session_id'])
+        name = f"{match['index']:04d}"
+        try:
+            if profile is not None:
+                profile.dump_stats(os.path.join(folder, name + '.pstats'))
+            else:
+                with open(os.path.join(folder, name + '.folded'), 'w') as f:
+                    for stack, count in counts.items():
+                        f.write(f"{stack} {count}\n")
+            with open(os.path.join(folder, name + '.json'), 'w') as f:
+                json.dump({
+                    'method': match['method'],
+                    'path': match['path'],
+                    'endpoint': match['endpoint'],
+                    'user_id': match['user_id'],
+                    'duration_ms': round(seconds * 1000, 3),
+                    'recorded_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+                }, f)
+        except OSError as e:
+            logger.error("Error saving profile: %s", e)
+
+    # Results
+
+    def _write_meta(self, session_id, meta):
+        with open(os.path.join(self.directory, session_id, 'session.json'), 'w') as f:
+            json.dump(meta, f)
+
+    def _session_dir(self, session_id):
+        folder = os.path.join(self.directory, os.path.basename(session_id))
+        return folder if os.path.isdir(folder) else None
+
+    def sessions(self):
+        """Stored sessions, newest first, with their captured requests"""
+        result = []
+        for session_id in sorted(os.listdir(self.directory), reverse=True):
+            folder = self._session_dir(session_id)
+            if folder is None:
+                continue
+            try:
+                with open(os.path.join(folder, 'session.json')) as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            requests = []
+            for filename in sorted(os.listdir(folder)):
+                if filename.endswith('.json') and filename != 'session.json':
+                    with open(os.path.join(folder, filename)) as f:
+                        requests.append(json.load(f))
+            meta['requests'] = requests
+            result.append(meta)
+        return result
+
+    def _files(self, session_id, suffix):
+        folder = self._session_dir(session_id)
+        if folder is None:
+            return None
+        return [os.path.join(folder, f) for f in sorted(os.listdir(folder)) if f.endswith(suffix)]
+
+    def pstats_path(self, session_id):
+        """Merge a cprofile session into one pstats file and return its path"""
+        files = self._files(session_id, '.pstats')
+        if not files:
+            return None
+        merged = os.path.join(self._session_dir(session_id), 'merged.prof')
+        stats = pstats.Stats(*files)
+        stats.dump_stats(merged)
+        return merged
+
+    def text_report(self, session_id, sort='cumulative', limit=60):
+        """pstats print_stats output (cprofile) or the hottest stacks (sample)"""
+        files = self._files(session_id, '.pstats')
+        if files:
+            out = io.StringIO()
+            pstats.Stats(*files, stream=out).sort_stats(sort).print_stats(limit)
+            return out.getvalue()
+        collapsed = self.collapsed(session_id)
+        if collapsed is None:
+            return None
+        lines = sorted(collapsed.items(), key=lambda item: -item[1])[:limit]
+        return '\n'.join(f"{count:>8}  {stack}" for stack, count in lines) + '\n'
+
+    def collapsed(self, session_id):
+        """Collapsed stacks for a session: sample counts, or microseconds for cprofile"""
+        files = self._files(session_id, '.folded')
+        if files:
+            counts = Counter()
+            for path in files:
+                with open(path) as f:
+                    for line in f:
+                        stack, _, count = line.rstrip('\n').rpartition(' ')
+                        counts[stack] += int(count)
+            return counts
+        files = self._files(session_id, '.pstats')
+        if files:
+            return collapse_pstats(pstats.Stats(*files))
+        return None
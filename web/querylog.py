@@ -0,0 +1,262 @@
+"""
+SQL statement instrumentation
+Connections handed out by WebDatabaseManager are wrapped so every statement
+is recorded with its normalized text, parameter shape, duration, rows and
+the line of app code that issued it; commits and failed statements (with
+their error) are recorded as well. Statements over the slow threshold go
+to a JSON-lines slow-query log, requests that repeat one normalized
+statement more than `repeat_threshold` times are flagged as likely N+1
+loops, and in debug mode a per-request report is logged.
+"""
+
+import json
+import logging
+import os
+import re
+import sys
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from flask import current_app, g, has_request_context, request
+
+logger = logging.getLogger(__name__)
+
+_WEB_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_WHITESPACE_RE = re.compile(r'\s+')
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+
+MAX_RECORDS_PER_REQUEST = 1000
+
+
+@lru_cache(maxsize=2048)
+def normalize(sql):
+    """Collapse whitespace and replace literals so equivalent statements group together"""
+    sql = _WHITESPACE_RE.sub(' ', sql).strip()
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    return _IN_LIST_RE.sub('(?...)', sql)
+
+
+def params_shape(params):
+    """Describe bound parameters by type only, never by value"""
+    if not params:
+        return ''
+    if isinstance(params, dict):
+        return ','.join(f'{key}:{type(value).__name__}' for key, value in sorted(params.items()))
+    return ','.join(type(value).__name__ for value in params)
+
+
+def call_site():
+    """file:line function of the first caller outside the web package"""
+    frame = sys._getframe(2)
+    while frame is not None and os.path.dirname(os.path.abspath(frame.f_code.co_filename)) == _WEB_DIR:
+        frame = frame.f_back
+    if frame is None:
+        return 'unknown'
+    return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno} {frame.f_code.co_name}"
+
+
+class _RecordingCursor:
+    """Cursor proxy counting the rows fetched for a statement record"""
+
+    def __init__(self, cursor, record):
+        self._cursor = cursor
+        self._record = record
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._record['rows'] += 1
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._cursor.fetchmany(*args)
+        self._record['rows'] += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._record['rows'] += len(rows)
+        return rows
+
+    def __iter__(self):
+        for row in self._cursor:
+            self._record['rows'] += 1
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class InstrumentedConnection:
+    """Connection proxy recording every statement it executes"""
+
+    def __init__(self, conn, recorder):
+        self._conn = conn
+        self._recorder = recorder
+
+    def execute(self, sql, params=()):
+        start = time.perf_counter()
+        try:
+            cursor = self._conn.execute(sql, params)
+        except Exception as e:
+            self._recorder.record(sql, params_shape(params), time.perf_counter() - start, None, error=e)
+            raise
+        record = self._recorder.record(sql, params_shape(params), time.perf_counter() - start, cursor)
+        return _RecordingCursor(cursor, record)
+
+    def executemany(self, sql, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        start = time.perf_counter()
+        shape = f"{len(seq_of_params)}x({params_shape(seq_of_params[0])})" if seq_of_params else ''
+        try:
+            cursor = self._conn.executemany(sql, seq_of_params)
+        except Exception as e:
+            self._recorder.record(sql, shape, time.perf_counter() - start, None, error=e)
+            raise
+        record = self._recorder.record(sql, shape, time.perf_counter() - start, cursor)
+        return _RecordingCursor(cursor, record)
+
+    def server_cursor(self, sql, params=(), batch_size=500):
+        start = time.perf_counter()
+        try:
+            cursor = self._conn.server_cursor(sql, params, batch_size)
+        except Exception as e:
+            self._recorder.record(sql, params_shape(params), time.perf_counter() - start, None, error=e)
+            raise
+        record = self._recorder.record(sql, params_shape(params), time.perf_counter() - start, cursor)
+        return _RecordingCursor(cursor, record)
+
+    def commit(self):
+        """Commits are recorded too: with SQLite that is where writers wait for the file lock"""
+        start = time.perf_counter()
+        try:
+            self._conn.commit()
+        except Exception as e:
+            self._recorder.record('COMMIT', '', time.perf_counter() - start, None, error=e)
+            raise
+        self._recorder.record('COMMIT', '', time.perf_counter() - start, None)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._conn.__exit__(exc_type, exc, tb)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class QueryRecorder:
+    """Collects statement records per request and reports on them
+
+    `on_repeated(endpoint, statement, count)` is called for each statement
+    a request repeated more than `repeat_threshold` times. `report=None`
+    logs the per-request report only when the app runs in debug mode.
+    """
+
+    def __init__(self, app=None, enabled=True, slow_ms=100.0, slow_log_path='slow_queries.log',
+                 repeat_threshold=10, report=None, on_repeated=None):
+        self.enabled = enabled
+        self.slow_ms = slow_ms
+        self.repeat_threshold = repeat_threshold
+        self.report = report
+        self.on_repeated = on_repeated
+        self.slow_log = logging.getLogger('staffroom.sql.slow')
+        self.slow_log.propagate = False
+        if slow_log_path and not self.slow_log.handlers:
+            handler = logging.FileHandler(slow_log_path, delay=True)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self.slow_log.addHandler(handler)
+            self.slow_log.setLevel(logging.INFO)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.after_request(self._after_request)
+
+    def instrument(self, conn):
+        """Wrap a web.database Connection (returned unchanged when disabled)"""
+        if not self.enabled:
+            return conn
+        return InstrumentedConnection(conn, self)
+
+    def record(self, sql, shape, seconds, cursor, error=None):
+        rowcount = getattr(cursor, 'rowcount', -1)
+        record = {
+            'statement': normalize(sql),
+            'params': shape,
+            'ms': seconds * 1000,
+            'rows': rowcount if rowcount and rowcount > 0 else 0,
+            'call_site': call_site(),
+        }
+        if error is not None:
+            record['error'] = str(error)
+        if has_request_context():
+            records = g.setdefault('sql_records', [])
+            if len(records) < MAX_RECORDS_PER_REQUEST:
+                records.append(record)
+            else:
+                g.sql_records_dropped = g.get('sql_records_dropped', 0) + 1
+        elif record['ms'] >= self.slow_ms:
+            self._log_slow(record, None)
+        return record
+
+    def _log_slow(self, record, endpoint):
+        entry = {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'endpoint': endpoint}
+        entry.update(record)
+        entry['ms'] = round(record['ms'], 3)
+        self.slow_log.info(json.dumps(entry))
+
+    def summarize(self, records):
+        """Group records by normalized statement: count, total ms, rows and call sites"""
+        groups = OrderedDict()
+        for record in records:
+            group = groups.get(record['statement'])
+            if group is None:
+                group = groups[record['statement']] = {'count': 0, 'ms': 0.0, 'rows': 0, 'call_sites': []}
+            group['count'] += 1
+            group['ms'] += record['ms']
+            group['rows'] += record['rows']
+            if record['call_site'] not in group['call_sites']:
+                group['call_sites'].append(record['call_site'])
+        return groups
+
+    def _after_request(self, response):
+        records = g.get('sql_records')
+        if not records:
+            return response
+        endpoint = request.endpoint or 'unmatched'
+
+        for record in records:
+            if record['ms'] >= self.slow_ms:
+                self._log_slow(record, endpoint)
+
+        groups = self.summarize(records)
+        for statement, group in groups.items():
+            if group['count'] > self.repeat_threshold:
+                logger.warning("N+1 query pattern in %s: %sx %s (from %s)",
+                               endpoint, group['count'], statement, ', '.join(group['call_sites']))
+                if self.on_repeated is not None:
+                    self.on_repeated(endpoint, statement, group['count'])
+
+        if self.report or (self.report is None and current_app.debug):
+            total_ms = sum(record['ms'] for record in records)
+            response.headers.add('Server-Timing', f'sql;dur={total_ms:.2f};desc="{len(records)} queries"')
+            self._log_report(endpoint, records, groups, total_ms)
+        return response
+
+    def _log_report(self, endpoint, records, groups, total_ms):
+        dropped = g.get('sql_records_dropped', 0)
+        lines = [f"SQL report: {request.method} {request.path} ({endpoint}) - "
+                 f"{len(records) + dropped} statements, {total_ms:.2f} ms"]
+        for statement, group in sorted(groups.items(), key=lambda item: -item[1]['ms']):
+            lines.append(f"{group['count']:>5}x {group['ms']:>9.2f} ms {group['rows']:>7} rows  {statement[:120]}")
+            for site in group['call_sites']:
+                lines.append(f"{'':>33}at {site}")
+        logger.info('\n'.join(lines))
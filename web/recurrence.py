@@ -0,0 +1,343 @@
+"""
+Recurring schedule events
+A recurring event is stored as one class_schedule row: its start and end
+time are the first occurrence and `recurrence_pattern` holds an RFC 5545
+style rule plus any cancelled occurrences, e.g.
+
+    RRULE:FREQ=WEEKLY;INTERVAL=1;BYDAY=MO,WE;UNTIL=20261218
+    EXDATE:20261111T090000,20261125T090000
+
+The supported subset is FREQ=DAILY, WEEKLY or MONTHLY with INTERVAL,
+COUNT, UNTIL and (for weekly and daily rules) BYDAY. Times are naive
+local times; a trailing Z is accepted and ignored.
+
+Occurrences are never materialized. Expansion jumps straight to the
+requested window by arithmetic on the rule (a daily rule asked for
+December does not walk September to November), so its cost depends on
+the window only, and expanded windows are kept in a per-process LRU
+keyed by the pattern text, which changes whenever the rule or its
+exceptions do.
+"""
+
+import logging
+import threading
+from datetime import datetime, time, timedelta
+from functools import lru_cache
+
+from web.lru import LRUCache
+
+logger = logging.getLogger(__name__)
+
+FREQUENCIES = ('DAILY', 'WEEKLY', 'MONTHLY')
+WEEKDAYS = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+
+# Occurrences returned for one series in one window at most
+MAX_OCCURRENCES = 1000
+
+# Limits on what a rule may describe: a series spans five years at most
+MAX_COUNT = 2000
+MAX_INTERVAL = 99
+MAX_SERIES_DAYS = 5 * 366
+
+
+def parse_datetime(value, end_of_day=False):
+    """datetime from ISO ('2026-10-20', '2026-10-20T09:00', '2026-10-20 09:00:00') or basic ('20261020T090000') text
+
+    A bare date is midnight, or the last moment of the day with
+    `end_of_day`. Raises ValueError for anything else.
+    """
+    if isinstance(value, datetime):
+        return value
+    text = str(value).strip().rstrip('Z')
+    if len(text) >= 8 and text[:8].isdigit() and (len(text) == 8 or text[8] == 'T'):
+        text = f"{text[:4]}-{text[4:6]}-{text[6:8]}" + (
+            f"T{text[9:11]}:{text[11:13]}:{text[13:15] or '00'}" if len(text) > 8 else '')
+    parsed = datetime.fromisoformat(text)
+    if len(text) == 10 and end_of_day:
+        parsed = datetime.combine(parsed.date(), time.max)
+    return parsed.replace(tzinfo=None)
+
+
+def format_like(value, like):
+    """Format a datetime the way the stored timestamp `like` is written (separator and precision)"""
+    like = str(like)
+    sep = like[10] if len(like) > 10 and like[10] in 'T ' else 'T'
+    return value.isoformat(sep=sep, timespec='minutes' if len(like) == 16 else 'seconds')
+
+
+def _basic(value):
+    return value.strftime('%Y%m%dT%H%M%S')
+
+
+def _add_months(value, months):
+    """Same day and time `months` later, or None when that month has no such day
+
+    Raises OverflowError once the result would be past datetime.max.
+    """
+    month = value.month - 1 + months
+    year, month = value.year + month // 12, month % 12 + 1
+    if year > datetime.max.year:
+        raise OverflowError("date value out of range")
+    try:
+        return value.replace(year=year, month=month)
+    except ValueError:
+        return None
+
+
+class Rule:
+    """A parsed recurrence pattern: the rule plus its cancelled occurrences"""
+
+    def __init__(self, freq, interval=1, count=None, until=None, byday=(), exdates=()):
+        if freq not in FREQUENCIES:
+            raise ValueError(f"Unsupported recurrence frequency: {freq}")
+        if not 1 <= interval <= MAX_INTERVAL:
+            raise ValueError(f"INTERVAL must be between 1 and {MAX_INTERVAL}")
+        if count is not None and not 1 <= count <= MAX_COUNT:
+            raise ValueError(f"COUNT must be between 1 and {MAX_COUNT}")
+        if count is not None and until is not None:
+            raise ValueError("COUNT and UNTIL cannot both be given")
+        if byday and freq == 'MONTHLY':
+            raise ValueError("BYDAY is only supported for DAILY and WEEKLY rules")
+        if byday and freq == 'DAILY':
+            if interval != 1:
+                raise ValueError("BYDAY with a DAILY rule requires INTERVAL=1")
+            # Every day restricted to some weekdays is the weekly rule on those days
+            freq = 'WEEKLY'
+        self.freq = freq
+        self.interval = interval
+        self.count = count
+        self.until = until
+        self.byday = tuple(sorted(set(byday)))
+        self.exdates = frozenset(exdates)
+
+    @classmethod
+    def parse(cls, text):
+        """Parse a stored pattern; raises ValueError when it is malformed or unsupported"""
+        fields, exdates = None, []
+        for line in str(text or '').splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            name, sep, value = line.partition(':')
+            if not sep or '=' in name:
+                # A bare 'FREQ=...' rule without the RRULE: prefix
+                name, value = 'RRULE', line
+            name = name.strip().upper()
+            if name == 'RRULE':
+                fields = dict(part.split('=', 1) for part in value.upper().split(';') if '=' in part)
+            elif name == 'EXDATE':
+                exdates.extend(parse_datetime(item) for item in value.split(',') if item.strip())
+            else:
+                raise ValueError(f"Unsupported recurrence property: {name}")
+        if not fields or 'FREQ' not in fields:
+            raise ValueError("Recurrence rule needs FREQ")
+        unknown = set(fields) - {'FREQ', 'INTERVAL', 'COUNT', 'UNTIL', 'BYDAY', 'WKST'}
+        if unknown:
+            raise ValueError(f"Unsupported recurrence rule parts: {', '.join(sorted(unknown))}")
+        byday = []
+        for day in filter(None, fields.get('BYDAY', '').split(',')):
+            if day not in WEEKDAYS:
+                raise ValueError(f"Unsupported BYDAY value: {day}")
+            byday.append(WEEKDAYS.index(day))
+        return cls(fields['FREQ'],
+                   interval=int(fields.get('INTERVAL', 1)),
+                   count=int(fields['COUNT']) if 'COUNT' in fields else None,
+                   until=parse_datetime(fields['UNTIL'], end_of_day=True) if 'UNTIL' in fields else None,
+                   byday=byday, exdates=exdates)
+
+    def __str__(self):
+        parts = [f"FREQ={self.freq}", f"INTERVAL={self.interval}"]
+        if self.byday:
+            parts.append('BYDAY=' + ','.join(WEEKDAYS[d] for d in self.byday))
+        if self.count is not None:
+            parts.append(f"COUNT={self.count}")
+        if self.until is not None:
+            parts.append('UNTIL=' + (self.until.strftime('%Y%m%d') if self.until.time() == time.max
+                                     else _basic(self.until)))
+        text = 'RRULE:' + ';'.join(parts)
+        if self.exdates:
+            text += '\nEXDATE:' + ','.join(_basic(d) for d in sorted(self.exdates))
+        return text
+
+    def with_exdate(self, occurrence):
+        """The same rule with one more cancelled occurrence"""
+        return Rule(self.freq, self.interval, self.count, self.until, self.byday, self.exdates | {occurrence})
+
+    def validate(self, dtstart):
+        """Raise ValueError unless the series starting at `dtstart` ends within MAX_SERIES_DAYS (or never)"""
+        bound = self.bound(dtstart)
+        if bound is not None and bound - dtstart > timedelta(days=MAX_SERIES_DAYS):
+            raise ValueError(f"A recurring event may span {MAX_SERIES_DAYS // 366} years at most")
+
+    def _days(self, dtstart):
+        return self.byday or (dtstart.weekday(),)
+
+    def _candidates(self, dtstart, after):
+        """Rule instances >= dtstart and >= `after`, in order, ignoring COUNT, UNTIL and EXDATE
+
+        The sequence ends where dates leave datetime's range.
+        """
+        try:
+            yield from self._instances(dtstart, max(after, dtstart))
+        except OverflowError:
+            return
+
+    def _instances(self, dtstart, after):
+        if self.freq == 'DAILY':
+            step = timedelta(days=self.interval)
+            k = max(0, -(-(after - dtstart) // step))
+            current = dtstart + k * step
+            while True:
+                yield current
+                current += step
+        elif self.freq == 'WEEKLY':
+            week0 = datetime.combine(dtstart.date() - timedelta(days=dtstart.weekday()), dtstart.time())
+            step = timedelta(weeks=self.interval)
+            w = max(0, (after - week0) // step)
+            days = self._days(dtstart)
+            while True:
+                base = week0 + w * step
+                for d in days:
+                    current = base + timedelta(days=d)
+                    if current >= after:
+                        yield current
+                w += 1
+        else:
+            months = (after.year - dtstart.year) * 12 + after.month - dtstart.month
+            m = max(0, months // self.interval - 1)
+            while True:
+                current = _add_months(dtstart, m * self.interval)
+                if current is not None and current >= after:
+                    yield current
+                m += 1
+
+    def bound(self, dtstart):
+        """Latest time an occurrence can start (UNTIL, or the COUNT-th instance), or None for an open-ended rule
+
+        A COUNT reaching past datetime's range is bounded by datetime.max.
+        """
+        if self.until is not None:
+            return self.until
+        if self.count is None:
+            return None
+        k = self.count - 1
+        try:
+            if self.freq == 'DAILY':
+                return dtstart + k * timedelta(days=self.interval)
+            if self.freq == 'WEEKLY':
+                days = self._days(dtstart)
+                skipped = sum(1 for d in days if d < dtstart.weekday())
+                w, i = divmod(k + skipped, len(days))
+                week0 = datetime.combine(dtstart.date() - timedelta(days=dtstart.weekday()), dtstart.time())
+                return week0 + w * timedelta(weeks=self.interval) + timedelta(days=days[i])
+        except OverflowError:
+            return datetime.max
+        for n, current in enumerate(self._candidates(dtstart, dtstart)):
+            if n == k:
+                return current
+        return datetime.max
+
+    def between(self, dtstart, start=None, end=None, limit=MAX_OCCURRENCES):
+        """Occurrence starts with start <= occurrence <= end, skipping cancelled ones"""
+        bound = self.bound(dtstart)
+        if bound is not None and (end is None or bound < end):
+            end = bound
+        if end is None:
+            raise ValueError("An open-ended rule needs a window end")
+        occurrences = []
+        for current in self._candidates(dtstart, start or dtstart):
+            if current > end:
+                break
+            if current in self.exdates:
+                continue
+            if len(occurrences) >= limit:
+                logger.warning("Recurrence expansion stopped at %s occurrences", limit)
+                break
+            occurrences.append(current)
+        return occurrences
+
+    def occurs_at(self, dtstart, occurrence):
+        """Whether `occurrence` is one of the rule's (not cancelled) occurrences"""
+        return occurrence in self.between(dtstart, occurrence, occurrence)
+
+
+@lru_cache(maxsize=1024)
+def parse(text):
+    """Rule.parse, cached: the same stored patterns are expanded over and over"""
+    return Rule.parse(text)
+
+
+def _sort_key(value):
+    try:
+        return parse_datetime(value)
+    except (TypeError, ValueError):
+        return datetime.min
+
+
+def _starts_within(value, start, end):
+    moment = _sort_key(value)
+    if moment == datetime.min:
+        return True  # unparseable legacy timestamps are never filtered out
+    return (start is None or moment >= start) and (end is None or moment <= end)
+
+
+class OccurrenceCache:
+    """Per-process LRU of expanded (start, end) occurrence pairs, bounded by their total count"""
+
+    def __init__(self, max_size=100000):
+        self.store = LRUCache(max_size)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def expand(self, pattern, start_time, end_time, window_start=None, window_end=None):
+        """Occurrences of a stored event in a window as (start, end) strings formatted like the stored times
+
+        A series that cannot be parsed yields just its first occurrence,
+        so a bad row degrades to a one-off event instead of failing the
+        whole schedule.
+        """
+        key = (pattern, start_time, end_time, window_start, window_end)
+        cached = self.store.get(key)
+        with self._lock:
+            if cached is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if cached is not None:
+            return cached
+        try:
+            dtstart, dtend = parse_datetime(start_time), parse_datetime(end_time)
+            starts = parse(pattern).between(dtstart, window_start, window_end)
+        except (ValueError, OverflowError) as e:
+            logger.warning("Unusable recurrence pattern %r: %s", pattern, e)
+            return [(start_time, end_time)] if _starts_within(start_time, window_start, window_end) else []
+        duration = dtend - dtstart
+        occurrences = tuple((format_like(s, start_time), format_like(s + duration, end_time)) for s in starts)
+        if occurrences:
+            self.store.set(key, occurrences)
+        return occurrences
+
+    def expand_events(self, events, window_start=None, window_end=None, horizon=None):
+        """Schedule rows with every recurring one replaced by its occurrences in the window, ordered by start
+
+        Each occurrence is a copy of its series row (so 'id' is the
+        series) with its own start and end time and a 'recurrence_id'
+        naming the occurrence. One-off rows are kept when they start in
+        the window. Without a window end, series are expanded up to
+        `horizon`.
+        """
+        expanded = []
+        for event in events:
+            if event.get('is_recurring') and event.get('recurrence_pattern'):
+                for start, end in self.expand(event['recurrence_pattern'], event['start_time'], event['end_time'],
+                                              window_start, window_end or horizon):
+                    expanded.append(dict(event, start_time=start, end_time=end, recurrence_id=start))
+            elif _starts_within(event['start_time'], window_start, window_end):
+                expanded.append(event)
+        expanded.sort(key=lambda event: _sort_key(event['start_time']))
+        return expanded
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.store)}
@@ -0,0 +1,297 @@
+"""
+Database-per-organization sharding for SQLite
+With every school in one file, one busy school's writes hold the database
+lock that every other school is waiting for. In sharded mode each
+organization's classes, resources, discussions, attendance, announcements
+and submissions live in their own file under the shard directory, and only
+users, organizations, memberships and the other cross-organization tables
+stay in the catalog (DATABASE_URL). Writes to different organizations then
+take different locks.
+
+Every shard connection has the catalog attached as `catalog`. SQLite
+resolves an unqualified table name to the first attached database that has
+it, so `users`, `organizations` and the rest fall through to the catalog and
+the existing queries, joins included, run unchanged on a shard. Rows that
+belong to no organization stay in the catalog's own copies of the org
+tables, which is what requests without a current organization read.
+
+Shards are created on first use with the catalog's schema for those tables,
+and get any columns the catalog gained since. Connections are pooled per
+shard and process, each keeping its ATTACH.
+
+Split an existing single-file database with:
+
+    python -m web.sharding split teacher_app_web.db --catalog catalog.db --shard-dir shards
+"""
+
+import argparse
+import contextvars
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from web.database import Connection, SQLITE, connect
+
+logger = logging.getLogger(__name__)
+
+# Tables holding one organization's data, parents before children, with how
+# a catalog row is matched to its organization (:org) when splitting
+ORG_TABLES = [
+    ('classes', "organization_id = :org"),
+    ('class_enrollments', "class_id IN (SELECT id FROM catalog.classes WHERE organization_id = :org)"),
+    ('class_students', "class_id IN (SELECT id FROM catalog.classes WHERE organization_id = :org)"),
+    ('class_schedule', "class_id IN (SELECT id FROM catalog.classes WHERE organization_id = :org)"),
+    ('resources', None),
+    ('assignment_submissions', None),
+    ('discussions', "organization_id = :org"),
+    ('discussion_replies', "discussion_id IN (SELECT id FROM catalog.discussions WHERE organization_id = :org)"),
+    ('discussion_attachments', """
+        discussion_id IN (SELECT id FROM catalog.discussions WHERE organization_id = :org)
+        OR reply_id IN (SELECT r.id FROM catalog.discussion_replies r
+                        JOIN catalog.discussions d ON r.discussion_id = d.id WHERE d.organization_id = :org)
+    """),
+    ('attendance', """
+        organization_id = :org
+        OR (organization_id IS NULL AND class_id IN (SELECT id FROM catalog.classes WHERE organization_id = :org))
+    """),
+    ('announcements', "organization_id = :org"),
+    ('data_versions', "organization_id = :org"),
+]
+
+SHARDED_TABLES = frozenset(table for table, _ in ORG_TABLES)
+
+_current = contextvars.ContextVar('shard_organization', default=None)
+
+
+def _resources_predicate(conn):
+    # Older databases have class-scoped resources without an organization_id column
+    columns = [row[1] for row in conn.execute("PRAGMA catalog.table_info(resources)").fetchall()]
+    if 'organization_id' in columns:
+        return "organization_id = :org"
+    return "class_id IN (SELECT id FROM catalog.classes WHERE organization_id = :org)"
+
+
+def split_predicates(conn):
+    """ORG_TABLES with the resource-dependent predicates filled in for this catalog"""
+    resources = _resources_predicate(conn)
+    predicates = []
+    for table, predicate in ORG_TABLES:
+        if table == 'resources':
+            predicate = resources
+        elif table == 'assignment_submissions':
+            predicate = f"assignment_id IN (SELECT id FROM catalog.resources WHERE {resources})"
+        predicates.append((table, predicate))
+    return predicates
+
+
+def create_shard_schema(raw):
+    """Create the org tables and their indexes from the catalog attached to raw, adding missing columns"""
+    existing = {row[0] for row in raw.execute("SELECT name FROM main.sqlite_master WHERE type = 'table'")}
+    statements = raw.execute("""
+        SELECT type, name, tbl_name, sql FROM catalog.sqlite_master
+        WHERE sql IS NOT NULL AND type IN ('table', 'index')
+        ORDER BY type DESC
+    """).fetchall()
+    for kind, name, table, sql in statements:
+        if table not in SHARDED_TABLES:
+            continue
+        if kind == 'table' and name not in existing:
+            raw.execute(sql)
+        elif kind == 'index':
+            raw.execute(sql.replace('CREATE INDEX ', 'CREATE INDEX IF NOT EXISTS ', 1)
+                        .replace('CREATE UNIQUE INDEX ', 'CREATE UNIQUE INDEX IF NOT EXISTS ', 1))
+        if kind == 'table' and name in existing:
+            present = {row[1] for row in raw.execute(f"PRAGMA main.table_info({name})")}
+            for column in raw.execute(f"PRAGMA catalog.table_info({name})").fetchall():
+                if column[1] not in present:
+                    # ALTER TABLE only takes constant defaults
+                    default = column[4]
+                    default = f" DEFAULT {default}" if default and not default.upper().startswith('CURRENT_') else ''
+                    raw.execute(f"ALTER TABLE main.{name} ADD COLUMN {column[1]} {column[2]}{default}")
+    raw.commit()
+
+
+class ShardRouter:
+    """Routes connections to a per-organization SQLite file with the catalog attached
+
+    `catalog_url` is the sqlite:/// DATABASE_URL and `directory` holds the
+    shards (org_<id>.db). Up to `pool_size` idle connections are kept per
+    shard in each process; `pragmas` apply to every connection.
+    """
+
+    def __init__(self, catalog_url, directory, pool_size=4, pragmas=None):
+        self.catalog_url = catalog_url
+        self.catalog_path = os.path.abspath(catalog_url.replace('sqlite:///', ''))
+        self.directory = directory
+        self.pool_size = pool_size
+        self.pragmas = pragmas or {}
+        self._pools = {}
+        self._ready = set()
+        self._lock = threading.Lock()
+        self._stats = {'opened': 0, 'reused': 0}
+        os.makedirs(directory, exist_ok=True)
+
+    def shard_url(self, organization_id):
+        """sqlite:/// URL of an organization's shard"""
+        return 'sqlite:///' + os.path.join(self.directory, f"org_{int(organization_id)}.db")
+
+    @contextmanager
+    def use(self, organization_id):
+        """Route this context's connections to organization_id's shard, whatever the session says"""
+        token = _current.set((organization_id,))
+        try:
+            yield
+        finally:
+            _current.reset(token)
+
+    def pinned(self):
+        """(organization_id,) inside use(), else None"""
+        return _current.get()
+
+    def connect(self, organization_id):
+        """Connection for an organization's shard, or the catalog when organization_id is None"""
+        if not organization_id:
+            return connect(self.catalog_url, pragmas=self.pragmas)
+        key = (os.getpid(), int(organization_id))
+        url = self.shard_url(organization_id)
+        raw = None
+        with self._lock:
+            idle = self._pools.get(key)
+            if idle:
+                raw = idle.pop()
+                self._stats['reused'] += 1
+        if raw is None:
+            raw = self._open(url, int(organization_id))
+
+        def release(raw):
+            try:
+                raw.rollback()
+            except sqlite3.Error:
+                raw.close()
+                return
+            with self._lock:
+                idle = self._pools.setdefault(key, [])
+                if len(idle) < self.pool_size:
+                    idle.append(raw)
+                    return
+            raw.close()
+
+        conn = Connection(raw, SQLITE, url, release=release)
+        conn.catalog = 'catalog'
+        return conn
+
+    def _open(self, url, organization_id):
+        raw = connect(url, pragmas=self.pragmas, shared=True).raw
+        try:
+            raw.execute("ATTACH DATABASE ? AS catalog", (self.catalog_path,))
+            if (os.getpid(), organization_id) not in self._ready:
+                create_shard_schema(raw)
+                self._ready.add((os.getpid(), organization_id))
+        except sqlite3.Error:
+            raw.close()
+            raise
+        with self._lock:
+            self._stats['opened'] += 1
+        return raw
+
+    def shards(self):
+        """Organization ids that have a shard file"""
+        ids = []
+        for name in os.listdir(self.directory):
+            if name.startswith('org_') and name.endswith('.db'):
+                try:
+                    ids.append(int(name[4:-3]))
+                except ValueError:
+                    pass
+        return sorted(ids)
+
+    def stats(self):
+        """Pool counters for this worker"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['idle'] = sum(len(idle) for (pid, _), idle in self._pools.items() if pid == os.getpid())
+        stats['shards'] = len(self.shards())
+        return stats
+
+    def close(self):
+        """Close this process's idle connections"""
+        with self._lock:
+            for (pid, _), idle in list(self._pools.items()):
+                if pid == os.getpid():
+                    while idle:
+                        idle.pop().close()
+
+
+def split(source, catalog, directory):
+    """Split a single-file database into a catalog and one shard per organization
+
+    The catalog starts as a copy of `source`; each organization's rows are
+    copied into its shard and then deleted from the catalog. Returns
+    {organization_id: rows moved}.
+    """
+    if os.path.exists(catalog):
+        raise FileExistsError(f"{catalog} already exists")
+    os.makedirs(directory, exist_ok=True)
+    src = sqlite3.connect(source)
+    dest = sqlite3.connect(catalog)
+    try:
+        src.backup(dest)
+        dest.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        src.close()
+        dest.close()
+
+    hub = sqlite3.connect(':memory:')
+    hub.execute("ATTACH DATABASE ? AS catalog", (os.path.abspath(catalog),))
+    tables = {row[0] for row in hub.execute("SELECT name FROM catalog.sqlite_master WHERE type = 'table'")}
+    predicates = [(table, predicate) for table, predicate in split_predicates(hub) if table in tables]
+    organizations = [row[0] for row in hub.execute("SELECT id FROM catalog.organizations ORDER BY id")]
+    moved = {}
+    for organization_id in organizations:
+        path = os.path.join(directory, f"org_{organization_id}.db")
+        if os.path.exists(path):
+            raise FileExistsError(f"{path} already exists")
+        shard = sqlite3.connect(path)
+        shard.execute("ATTACH DATABASE ? AS catalog", (os.path.abspath(catalog),))
+        create_shard_schema(shard)
+        shard.close()
+        hub.execute("ATTACH DATABASE ? AS shard", (os.path.abspath(path),))
+        count = 0
+        for table, predicate in predicates:
+            count += hub.execute(f"INSERT INTO shard.{table} SELECT * FROM catalog.{table} WHERE {predicate}",
+                                 {'org': organization_id}).rowcount
+        hub.commit()
+        hub.execute("DETACH DATABASE shard")
+        moved[organization_id] = count
+        logger.info("Organization %s: %s rows moved to %s", organization_id, count, path)
+    # Children first, so the predicates can still find their parents
+    for table, predicate in reversed(predicates):
+        for organization_id in organizations:
+            hub.execute(f"DELETE FROM catalog.{table} WHERE {predicate}", {'org': organization_id})
+    hub.commit()
+    hub.close()
+    vacuum = sqlite3.connect(catalog)
+    vacuum.execute("VACUUM")
+    vacuum.close()
+    return moved
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="StaffRoom database-per-organization sharding")
+    commands = parser.add_subparsers(dest='command', required=True)
+    split_parser = commands.add_parser('split', help="split a single-file database into a catalog and shards")
+    split_parser.add_argument('source', help="existing database file (left unchanged)")
+    split_parser.add_argument('--catalog', required=True, help="catalog database file to create")
+    split_parser.add_argument('--shard-dir', default='shards', help="directory for the org_<id>.db shards")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    moved = split(args.source, args.catalog, args.shard_dir)
+    print(f"Split {args.source} into {args.catalog} and {len(moved)} shards in {args.shard_dir}: "
+          f"{sum(moved.values())} rows moved")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
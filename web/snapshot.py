@@ -0,0 +1,215 @@
+"""
+Read-only reporting replica of the SQLite database
+Attendance percentages, dashboard counters and submission listings scan
+whole tables; run against the live database they compete with teachers'
+writes. The replica gives them a copy of their own, refreshed every
+`interval` seconds by a background thread with sqlite3's online backup API.
+The copy runs `pages` pages per step and sleeps between steps, so a writer
+never waits for more than one step. A write to the live database between
+steps makes SQLite restart the copy; if restarts keep it from finishing
+within `max_seconds` it is redone in a single step, which in WAL mode only
+holds a read transaction.
+
+The copy is written next to the replica and renamed over it, so readers
+never see a half-written file: connections already open finish on the old
+copy and new ones get the new one. The file's modification time records
+when the copy was taken. A lock file lets one worker per host refresh while
+the others skip that round.
+
+current() says whether to read the replica: it returns None (read the live
+database) while there is no copy yet, or when the copy is older than
+`max_staleness` seconds because refreshes are failing.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from web.database import connect
+
+try:
+    import fcntl
+except ImportError:  # Windows: refreshes are only serialized within a process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class _CopyTooSlow(Exception):
+    pass
+
+
+class SnapshotReplica:
+    """Periodically refreshed read-only copy of a SQLite database
+
+    `source_url` is the live sqlite:/// DATABASE_URL and `path` the replica
+    file; `max_staleness` defaults to three refresh intervals.
+    """
+
+    def __init__(self, source_url, path, interval=300, pages=256, sleep=0.005, max_seconds=30,
+                 max_staleness=None):
+        self.source_path = source_url.replace('sqlite:///', '')
+        self.path = path
+        self.url = 'sqlite:///' + path
+        self.interval = interval
+        self.pages = pages
+        self.sleep = sleep
+        self.max_seconds = max_seconds
+        self.max_staleness = max_staleness if max_staleness is not None else interval * 3
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._stats_lock = threading.Lock()
+        self._stats = {'refreshes': 0, 'failures': 0, 'skipped': 0, 'restarts': 0, 'single_step': 0,
+                       'last_seconds': 0.0, 'last_pages': 0, 'last_error': None}
+
+    def _ensure_thread(self):
+        # Started lazily in each process so gunicorn workers forked after import get their own
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._loop, name='snapshot-refresh', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def taken_at(self):
+        """Unix time the replica was copied, or None when there is none"""
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return None
+
+    def current(self):
+        """Unix time of the replica reads should use, or None to read the live database"""
+        if self._pid != os.getpid():
+            self._ensure_thread()
+        taken = self.taken_at()
+        if taken is None or time.time() - taken > self.max_staleness:
+            return None
+        return taken
+
+    def connect(self):
+        """Open a read-only Connection to the replica"""
+        return connect(self.url, read_only=True)
+
+    def _loop(self):
+        while not self._stopping.is_set():
+            wait = self.interval
+            try:
+                self.refresh(max_age=self.interval)
+                taken = self.taken_at()
+                if taken is not None:
+                    wait = min(max(taken + self.interval - time.time(), 1.0), self.interval)
+            except Exception as e:
+                logger.error("Error refreshing reporting snapshot: %s", e)
+            self._stopping.wait(wait)
+
+    def refresh(self, max_age=None):
+        """Copy the live database over the replica
+
+        Returns False without copying when another worker holds the refresh
+        lock, or when the replica is already younger than `max_age` seconds.
+        """
+        with self._refresh_lock, open(self.path + '.lock', 'a') as lock_file:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    self._count('skipped')
+                    return False
+            taken = self.taken_at()
+            if max_age is not None and taken is not None and time.time() - taken < max_age:
+                return False
+            try:
+                self._copy()
+            except Exception as e:
+                with self._stats_lock:
+                    self._stats['failures'] += 1
+                    self._stats['last_error'] = str(e)
+                raise
+            return True
+
+    def _copy(self):
+        started = time.perf_counter()
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        deadline = started + self.max_seconds
+        progress = {'remaining': None, 'restarts': 0, 'pages': 0}
+
+        def on_step(status, remaining, total):
+            # remaining going back up means a write restarted the copy
+            if progress['remaining'] is not None and remaining > progress['remaining']:
+                progress['restarts'] += 1
+            progress['remaining'] = remaining
+            progress['pages'] = total
+            if time.perf_counter() > deadline:
+                raise _CopyTooSlow()
+            # backup() itself only sleeps when the source is locked; pause so writers get a turn
+            if remaining and self.sleep:
+                time.sleep(self.sleep)
+
+        single_step = False
+        source = sqlite3.connect(self.source_path, timeout=int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)) / 1000.0)
+        dest = sqlite3.connect(tmp)
+        try:
+            try:
+                source.backup(dest, pages=self.pages, progress=on_step, sleep=self.sleep)
+            except _CopyTooSlow:
+                logger.warning("Reporting snapshot restarted %s times in %ss; copying in one step",
+                               progress['restarts'], self.max_seconds)
+                single_step = True
+                source.backup(dest)
+            # Readers open the copy read-only, which needs a rollback journal rather than WAL
+            dest.execute("PRAGMA journal_mode = DELETE")
+            dest.commit()
+        except Exception:
+            dest.close()
+            os.remove(tmp)
+            raise
+        finally:
+            source.close()
+        dest.close()
+        taken = time.time()
+        os.utime(tmp, (taken, taken))
+        os.replace(tmp, self.path)
+        seconds = time.perf_counter() - started
+        with self._stats_lock:
+            stats = self._stats
+            stats['refreshes'] += 1
+            stats['restarts'] += progress['restarts']
+            stats['single_step'] += int(single_step)
+            stats['last_seconds'] = round(seconds, 4)
+            stats['last_pages'] = progress['pages']
+            stats['last_error'] = None
+        logger.info("Reporting snapshot refreshed: %s pages in %.3fs (%s restarts)",
+                    progress['pages'], seconds, progress['restarts'])
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        """Refresh counters for this worker plus the replica's current age"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        taken = self.taken_at()
+        stats['taken_at'] = taken
+        stats['age_seconds'] = round(time.time() - taken, 3) if taken is not None else None
+        stats['serving'] = 'snapshot' if self.current() is not None else 'live'
+        stats['interval'] = self.interval
+        stats['max_staleness'] = self.max_staleness
+        return stats
+
+    def stop(self, timeout=5.0):
+        """Stop the refresh thread (a copy in progress is finished first)"""
+        if self._pid != os.getpid() or self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        self._pid = None
@@ -0,0 +1,119 @@
+"""
+Streaming JSON responses for large result sets
+Rows are pulled from the cursor with fetchmany and encoded one at a time,
+so only one batch is ever held in memory instead of the full row list, the
+list of dicts and the finished JSON string
+
+The first batch is fetched before the response starts, so a failing query
+is still an ordinary 500. A failure after that is logged and re-raised,
+which makes the server abort the chunked response instead of ending it
+cleanly, so clients never take a truncated body for a complete one. The
+connection is closed by the response's close hook, which the server calls
+even when the body is never read (HEAD requests, clients that disconnect
+before the first chunk, a later hook replacing the response).
+"""
+
+import json
+import logging
+
+from flask import Response
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the stdlib C encoder
+    orjson = None
+
+CHUNK_SIZE = 64 * 1024
+
+_json_encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False, default=str)
+
+
+def encode(value):
+    """Serialize a value straight to JSON bytes with the fastest encoder available"""
+    if orjson is not None:
+        return orjson.dumps(value, default=str)
+    return _json_encoder.encode(value).encode('utf-8')
+
+
+def iter_rows(cursor, batch_size=500):
+    """Yield rows from a cursor one fetchmany batch at a time"""
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+
+class _PrefetchedCursor:
+    """Cursor proxy handing out a batch fetched up front before reading further"""
+
+    def __init__(self, cursor, rows):
+        self._cursor = cursor
+        self._rows = rows
+
+    def fetchmany(self, size):
+        if self._rows is not None:
+            rows, self._rows = self._rows, None
+            return rows
+        return self._cursor.fetchmany(size)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def prefetch(conn, cursor, batch_size=500):
+    """Fetch the cursor's first batch now, closing conn and re-raising if the query fails"""
+    try:
+        return _PrefetchedCursor(cursor, cursor.fetchmany(batch_size))
+    except Exception:
+        conn.close()
+        raise
+
+
+def iter_json_array(cursor, defaults=None, transform=None, batch_size=500):
+    """Yield JSON byte chunks for the cursor's rows as an array of objects
+
+    `defaults` fills in keys missing from every row; `transform` may rewrite
+    each row dict before it is encoded.
+    """
+    columns = [col[0] for col in cursor.description]
+    buffer = bytearray(b'[')
+    first = True
+    for row in iter_rows(cursor, batch_size):
+        item = dict(zip(columns, row))
+        if defaults:
+            for field, value in defaults.items():
+                item.setdefault(field, value)
+        if transform is not None:
+            item = transform(item)
+        if not first:
+            buffer += b','
+        buffer += encode(item)
+        first = False
+        if len(buffer) >= CHUNK_SIZE:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += b']'
+    yield bytes(buffer)
+
+
+def stream_json(conn, cursor, key, extra=None, defaults=None, transform=None, batch_size=500):
+    """Stream {"success": true, <key>: [rows], **extra} and close conn when the response is closed"""
+    cursor = prefetch(conn, cursor, batch_size)
+
+    def generate():
+        try:
+            head = {'success': True}
+            head.update(extra or {})
+            yield encode(head)[:-1] + b',' + encode(key) + b':'
+            yield from iter_json_array(cursor, defaults, transform, batch_size)
+            yield b'}'
+        except Exception as e:
+            logger.error("Error streaming %s: %s", key, e)
+            raise
+
+    response = Response(generate(), mimetype='application/json')
+    response.call_on_close(conn.close)
+    return response
@@ -0,0 +1,244 @@
+"""
+Lightweight request tracing
+A sampled request (TRACE_SAMPLE_RATE, or forced with an `X-Trace: 1` header
+from an admin session or carrying the `X-Trace-Token` secret) gets a tree of timed spans: auth checks, SQL statements, file I/O, template
+rendering and anything wrapped in tracer.span(). Finished traces go into a
+per-worker ring buffer and can be exported as JSON or in the Chrome trace
+event format (chrome://tracing, Perfetto). Unsampled requests only pay for
+one random() call and a few g lookups.
+"""
+
+import hmac
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import before_render_template, g, has_request_context, request, session, template_rendered
+
+from web.querylog import normalize
+
+
+class Span:
+    """Timed operation with attributes and child spans"""
+
+    __slots__ = ('name', 'start', 'end', 'attrs', 'children')
+
+    def __init__(self, name, start=None, attrs=None):
+        self.name = name
+        self.start = time.perf_counter() if start is None else start
+        self.end = None
+        self.attrs = attrs or {}
+        self.children = []
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def to_dict(self, origin):
+        end = self.end if self.end is not None else time.perf_counter()
+        return {
+            'name': self.name,
+            'start_ms': round((self.start - origin) * 1000, 3),
+            'duration_ms': round((end - self.start) * 1000, 3),
+            'attrs': self.attrs,
+            'children': [child.to_dict(origin) for child in self.children],
+        }
+
+
+class _NullSpan:
+    """Stand-in yielded by tracer.span() when the request is not traced"""
+
+    def set(self, **attrs):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Trace:
+    """Span tree for one request"""
+
+    def __init__(self, name, attrs):
+        self.id = uuid.uuid4().hex[:16]
+        self.started_at = time.time()
+        self.root = Span(name, attrs=attrs)
+        self.stack = [self.root]
+
+    def to_dict(self):
+        return {
+            'trace_id': self.id,
+            'started_at': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(self.started_at)),
+            'duration_ms': round(((self.root.end or time.perf_counter()) - self.root.start) * 1000, 3),
+            'root': self.root.to_dict(self.root.start),
+        }
+
+    def chrome_events(self, tid):
+        """Complete ('X') events for the Chrome trace event format"""
+        events = []
+        base_us = self.started_at * 1e6
+
+        def walk(span):
+            end = span.end if span.end is not None else time.perf_counter()
+            events.append({
+                'name': span.name,
+                'cat': 'request' if span is self.root else span.name.split('.')[0],
+                'ph': 'X',
+                'ts': round(base_us + (span.start - self.root.start) * 1e6, 1),
+                'dur': round((end - span.start) * 1e6, 1),
+                'pid': 1,
+                'tid': tid,
+                'args': dict(span.attrs, trace_id=self.id),
+            })
+            for child in span.children:
+                walk(child)
+
+        walk(self.root)
+        return events
+
+
+class Tracer:
+    """Samples requests, builds their span trees and keeps the latest in a ring buffer
+
+    The force header is honoured only for admin sessions, or when the
+    request also sends `token` in the X-Trace-Token header.
+    """
+
+    def __init__(self, app=None, sample_rate=0.0, buffer_size=200, force_header='X-Trace', token=None):
+        self.sample_rate = sample_rate
+        self.force_header = force_header
+        self.token = token
+        self._buffer = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        before_render_template.connect(self._render_started, app, weak=False)
+        template_rendered.connect(self._render_finished, app, weak=False)
+
+    # Spans
+
+    def current(self):
+        """The active Trace for this request, or None"""
+        if not has_request_context():
+            return None
+        return g.get('trace')
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """Time a block as a child of the current span"""
+        trace = self.current()
+        if trace is None:
+            yield _NULL_SPAN
+            return
+        span = Span(name, attrs=attrs)
+        trace.stack[-1].children.append(span)
+        trace.stack.append(span)
+        try:
+            yield span
+        finally:
+            span.end = time.perf_counter()
+            trace.stack.pop()
+
+    def traced(self, name):
+        """Decorator running the function inside a span"""
+        def decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                if self.current() is None:
+                    return f(*args, **kwargs)
+                with self.span(name):
+                    return f(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def annotate(self, **attrs):
+        """Add attributes to the innermost open span"""
+        trace = self.current()
+        if trace is not None:
+            trace.stack[-1].set(**attrs)
+
+    def record_query(self, sql, seconds):
+        """Query listener for web.database: adds a finished sql span"""
+        trace = self.current()
+        if trace is None:
+            return
+        end = time.perf_counter()
+        span = Span('sql', start=end - seconds, attrs={'statement': normalize(sql)[:300]})
+        span.end = end
+        trace.stack[-1].children.append(span)
+
+    def _render_started(self, sender, template, context, **extra):
+        trace = self.current()
+        if trace is not None:
+            span = Span('template.render', attrs={'template': template.name})
+            trace.stack[-1].children.append(span)
+            trace.stack.append(span)
+
+    def _render_finished(self, sender, template, context, **extra):
+        trace = self.current()
+        if trace is not None and len(trace.stack) > 1 and trace.stack[-1].name == 'template.render':
+            trace.stack.pop().end = time.perf_counter()
+
+    # Request lifecycle
+
+    def _may_force(self):
+        if session.get('user_type') == 'admin':
+            return True
+        sent = request.headers.get('X-Trace-Token')
+        return bool(self.token and sent and hmac.compare_digest(sent, self.token))
+
+    def _before_request(self):
+        forced = request.headers.get(self.force_header) == '1' and self._may_force()
+        if forced or (self.sample_rate and random.random() < self.sample_rate):
+            g.trace = Trace(f'{request.method} {request.path}', {
+                'endpoint': request.endpoint,
+                'forced': forced,
+            })
+
+    def _after_request(self, response):
+        trace = g.get('trace')
+        if trace is not None:
+            trace.root.set(status=response.status_code)
+            response.headers['X-Trace-Id'] = trace.id
+        return response
+
+    def _teardown_request(self, exc):
+        trace = g.pop('trace', None)
+        if trace is None:
+            return
+        now = time.perf_counter()
+        for span in trace.stack:
+            if span.end is None:
+                span.end = now
+        if exc is not None:
+            trace.root.set(error=str(exc))
+        with self._lock:
+            self._buffer.append(trace)
+
+    # Export
+
+    def traces(self, limit=None):
+        """Most recent traces first"""
+        with self._lock:
+            traces = list(self._buffer)
+        traces.reverse()
+        return traces[:limit] if limit else traces
+
+    def get(self, trace_id):
+        return next((trace for trace in self.traces() if trace.id == trace_id), None)
+
+    def export_json(self, traces):
+        return {'traces': [trace.to_dict() for trace in traces]}
+
+    def export_chrome(self, traces):
+        events = []
+        for tid, trace in enumerate(traces, start=1):
+            events.extend(trace.chrome_events(tid))
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
@@ -0,0 +1,103 @@
+"""
+Per-organization, per-table change counters
+Writes bump a counter in the same transaction; readers combine the counters
+of the tables a response depends on into a cheap ETag / Last-Modified
+without running the response's own queries
+"""
+
+import hashlib
+from datetime import datetime, timezone
+
+# Organization id used for tables that are not scoped to one organization,
+# and as a catch-all when a write's organization cannot be determined
+GLOBAL = 0
+
+GLOBAL_TABLES = frozenset({
+    'users',
+    'subjects',
+    'organizations',
+    'organization_memberships',
+    'global_discussions',
+    'global_discussion_replies',
+})
+
+VERSIONS_DDL = """
+    CREATE TABLE IF NOT EXISTS data_versions (
+        organization_id INTEGER NOT NULL,
+        table_name TEXT NOT NULL,
+        version INTEGER NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (organization_id, table_name)
+    )
+"""
+
+
+def scope_for(table, organization_id):
+    """Counter row a table's writes land on"""
+    if table in GLOBAL_TABLES or not organization_id:
+        return GLOBAL
+    return int(organization_id)
+
+
+def _counters(conn, scope):
+    # A shard keeps its organization's counters; GLOBAL ones stay in the catalog every shard attaches
+    if scope == GLOBAL and conn.catalog:
+        return f"{conn.catalog}.data_versions"
+    return 'data_versions'
+
+
+def bump(conn, organization_id, *tables):
+    """Increment the change counters for tables (call before commit)"""
+    for table in tables:
+        conn.note_change(table)
+        scope = scope_for(table, organization_id)
+        conn.execute(f"""
+            INSERT INTO {_counters(conn, scope)} (organization_id, table_name, version, updated_at)
+            VALUES (?, ?, 1, CURRENT_TIMESTAMP)
+            ON CONFLICT (organization_id, table_name)
+            DO UPDATE SET version = data_versions.version + 1, updated_at = CURRENT_TIMESTAMP
+        """, (scope, table))
+
+
+def fetch(conn, organization_id, tables):
+    """Return {table: (version, updated_at)} for an organization
+
+    Org-scoped tables also fold in their GLOBAL row so writes whose
+    organization was unknown still invalidate every organization.
+    """
+    orgs = {GLOBAL, int(organization_id) if organization_id else GLOBAL}
+    placeholders = ', '.join('?' for _ in tables)
+    sources = {}
+    for scope in orgs:
+        sources.setdefault(_counters(conn, scope), []).append(scope)
+    rows = []
+    for source, scopes in sources.items():
+        org_placeholders = ', '.join('?' for _ in scopes)
+        rows += conn.execute(f"""
+            SELECT organization_id, table_name, version, updated_at
+            FROM {source}
+            WHERE table_name IN ({placeholders}) AND organization_id IN ({org_placeholders})
+        """, list(tables) + sorted(scopes)).fetchall()
+    versions = {table: (0, None) for table in tables}
+    for row in rows:
+        table = row['table_name']
+        version, updated_at = versions[table]
+        if updated_at is None or (row['updated_at'] and row['updated_at'] > updated_at):
+            updated_at = row['updated_at']
+        versions[table] = (version + row['version'], updated_at)
+    return versions
+
+
+def make_etag(versions, *vary):
+    """Build an ETag from table versions plus whatever else the response varies on"""
+    parts = [f"{table}={versions[table][0]}" for table in sorted(versions)]
+    parts.extend(str(v) for v in vary)
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()[:20]
+
+
+def last_modified(versions):
+    """Most recent change among the tables, as an aware datetime (or None)"""
+    stamps = [updated_at for _, updated_at in versions.values() if updated_at]
+    if not stamps:
+        return None
+    return datetime.strptime(max(stamps)[:19], '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
@@ -0,0 +1,261 @@
+"""
+Serialized SQLite writer with group commit
+SQLite lets one connection write at a time. When every handler writes on its
+own connection, concurrent writers spin on the busy timeout and the unlucky
+ones fail with "database is locked". The writer gives each process one write
+connection, owned by a background thread, and callers hand it their writes
+as functions instead:
+
+    reply_id = writer.run(lambda conn: conn.execute(...).lastrowid)
+
+Writes that arrive while a transaction is running queue up and the next
+transaction runs them together. Each job gets its own SAVEPOINT, so a
+failing job rolls back alone, and the batch shares one COMMIT (one fsync).
+run() returns once the job's batch has committed.
+
+The write connection puts the database in WAL mode, so readers on their own
+connections keep reading the last committed state while the writer works.
+Worker processes each have their own writer and still take turns on the
+file lock, waiting up to the busy timeout.
+
+Jobs run on the writer thread: they must not touch the request, session or
+g, and should only execute statements, since a slow job holds up every
+queued write behind it. A job that itself calls run() has the nested write
+run inline in its own savepoint, since queueing it would wait on the very
+thread that is running it. Callers wait at most `timeout` seconds for their
+job to start; a job still queued by then is dropped (it will never run) and
+the caller gets WriterError. A job that has started is always waited for,
+so an error means the write did not happen. A writer thread that died is
+replaced by the next submit().
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class WriterError(Exception):
+    """The writer could not run a job (queue full, writer stopped or timed out)"""
+
+
+class _Job:
+    __slots__ = ('fn', 'enqueued', 'done', 'result', 'error', 'state', 'lock')
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.state = 'queued'  # -> 'running', or 'abandoned' when the caller gave up first
+        self.lock = threading.Lock()
+
+    def claim(self, state):
+        """Move a queued job to `state`; False when it already left the queue"""
+        with self.lock:
+            if self.state != 'queued':
+                return False
+            self.state = state
+            return True
+
+
+class _JobConnection:
+    """The writer's connection as one job sees it
+
+    commit() and close() are no-ops (the batch commits), and rollback()
+    rolls back only this job's savepoint, so existing
+    execute/commit/rollback-style code can run as a job unchanged.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+    def rollback(self):
+        self._conn.execute("ROLLBACK TO job")
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class SQLiteWriter:
+    """Per-process write queue draining into group-committed transactions
+
+    `connect()` opens the write connection (it should enable WAL).
+    Up to `max_batch` queued jobs share a transaction; `queue_size` bounds
+    how many writes may wait before run() raises WriterError, and `timeout`
+    how many seconds run() waits by default for a write to start (None: forever).
+    """
+
+    def __init__(self, connect, max_batch=64, queue_size=10000, timeout=None):
+        self.connect = connect
+        self.max_batch = max_batch
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._conn = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {'batches': 0, 'committed': 0, 'failed': 0, 'wait_seconds': 0.0, 'commit_seconds': 0.0,
+                       'largest_batch': 0}
+
+    def _ensure_thread(self):
+        # Started lazily in each process so gunicorn workers forked after import get their own
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid == os.getpid():
+                logger.error("SQLite writer thread died; starting a new one")
+            self._queue = queue.Queue(self.queue_size)
+            self._conn = None
+            self._thread = threading.Thread(target=self._loop, name='sqlite-writer', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def submit(self, fn):
+        """Queue fn(conn) and return the job; see run()"""
+        if self._pid != os.getpid() or not self._thread.is_alive():
+            self._ensure_thread()
+        job = _Job(fn)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            raise WriterError("SQLite write queue is full")
+        return job
+
+    def run(self, fn, timeout=None):
+        """Run fn(conn) in a write transaction; returns its result once committed
+
+        Exceptions raised by fn, or by the batch's commit, are re-raised here.
+        `timeout` defaults to the writer's and bounds the wait for the job to
+        start: a job still queued then is dropped and WriterError raised, but
+        one already running is waited for, since it may yet commit. On the
+        writer thread itself fn runs inline as part of the current job.
+        """
+        if threading.current_thread() is self._thread:
+            return self._run_nested(fn)
+        timeout = self.timeout if timeout is None else timeout
+        job = self.submit(fn)
+        if not job.done.wait(timeout):
+            if job.claim('abandoned'):
+                raise WriterError(f"SQLite write did not start within {timeout}s")
+            # Already running: its batch may still commit, so only its outcome can be reported
+            job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def _run_nested(self, fn):
+        conn = self._connection()
+        # Savepoint names nest: ROLLBACK TO job undoes only this innermost one
+        conn.execute("SAVEPOINT job")
+        try:
+            result = fn(_JobConnection(conn))
+        except Exception:
+            conn.execute("ROLLBACK TO job")
+            conn.execute("RELEASE job")
+            raise
+        conn.execute("RELEASE job")
+        return result
+
+    def _loop(self):
+        stopping = False
+        while not stopping:
+            job = self._queue.get()
+            if job is None:
+                break
+            batch = [job] if job.claim('running') else []
+            while len(batch) < self.max_batch:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    stopping = True
+                    break
+                if job.claim('running'):
+                    batch.append(job)
+            if batch:
+                self._run_batch(batch)
+        self._reset()
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = self.connect()
+        return self._conn
+
+    def _run_batch(self, batch):
+        started = time.perf_counter()
+        try:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            for job in batch:
+                conn.execute("SAVEPOINT job")
+                try:
+                    job.result = job.fn(_JobConnection(conn))
+                except Exception as e:
+                    job.error = e
+                    conn.execute("ROLLBACK TO job")
+                conn.execute("RELEASE job")
+            commit_started = time.perf_counter()
+            conn.commit()
+        except Exception as e:
+            logger.error("SQLite writer transaction of %s jobs failed: %s", len(batch), e)
+            # Closing the connection discards whatever the transaction had written
+            self._reset()
+            self._finish(batch, started, e)
+            return
+        with self._stats_lock:
+            self._stats['commit_seconds'] += time.perf_counter() - commit_started
+        self._finish(batch, started, None)
+
+    def _reset(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+        self._conn = None
+
+    def _finish(self, batch, started, error):
+        with self._stats_lock:
+            stats = self._stats
+            stats['batches'] += 1
+            stats['largest_batch'] = max(stats['largest_batch'], len(batch))
+            for job in batch:
+                stats['wait_seconds'] += started - job.enqueued
+                if error is not None and job.error is None:
+                    job.error = error
+                stats['failed' if job.error is not None else 'committed'] += 1
+        for job in batch:
+            job.done.set()
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['queued'] = self._queue.qsize() if self._queue is not None and self._pid == os.getpid() else 0
+        stats['mean_batch'] = round((stats['committed'] + stats['failed']) / stats['batches'], 2) \
+            if stats['batches'] else 0.0
+        return stats
+
+    def stop(self, timeout=5.0):
+        """Finish the queued writes and stop the thread"""
+        if self._pid != os.getpid() or self._thread is None:
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+        self._pid = None
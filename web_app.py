@@ -4,15 +4,39 @@ StaffRoom Web Version - Flask Web Application
 Modern web interface for teacher management system
 """
 
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_file, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_file, send_from_directory, make_response, Response, g, has_request_context
 from werkzeug.security import generate_password_hash, check_password_hash
-import sqlite3
 import os
 from datetime import datetime, timedelta
+import atexit
+import contextlib
 import json
+import logging
+import math
+import time
 import uuid
 from werkzeug.utils import secure_filename
+from werkzeug.http import http_date
 import re
+from functools import wraps
+from web.database import connect, add_commit_listener, add_query_listener, add_connect_listener, IntegrityError, dialect_for, sqlite_pragmas, SQLITE
+from web import versions, gradebook
+from web.cache import QueryCache
+from web.streaming import stream_json, iter_rows
+from web.metrics import Metrics, MEMORY_BUCKETS
+from web.querylog import QueryRecorder
+from web.tracing import Tracer
+from web.profiler import Profiler
+from web.memory import MemoryTracker
+from web.compression import Compression
+from web.fragments import FragmentCache, Deferred
+from web.logs import configure_logging, parse_levels
+from web.writer import SQLiteWriter
+from web.snapshot import SnapshotReplica
+from web.archive import Archiver, parse_year_start
+from web.sharding import ShardRouter
+from web.recurrence import OccurrenceCache, parse as parse_recurrence, parse_datetime, format_like
+from web.exports import ExportJobs, ExportLimitError, FORMATS as EXPORT_FORMATS, iter_export, stream_export, iter_csv, iter_file, iter_zip, should_deflate
 
 app = Flask(__name__)
 
@@ -24,6 +48,15 @@ app.config.update(
     DATABASE_URL=os.environ.get('DATABASE_URL', 'sqlite:///teacher_app_web.db')
 )
 
+# JSON-lines logs written by a background thread (LOG_LEVEL, per-logger LOG_LEVELS, LOG_FORMAT=json|text)
+configure_logging(
+    app,
+    level=os.environ.get('LOG_LEVEL', 'INFO'),
+    levels=parse_levels(os.environ.get('LOG_LEVELS')),
+    fmt=os.environ.get('LOG_FORMAT', 'json')
+)
+logger = logging.getLogger('staffroom')
+
 # AI Summarization is always enabled (using simple extractive method)
 AI_ENABLED = True
 
@@ -44,28 +77,309 @@ DB_PATH = get_database_url()
 UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'doc', 'docx', 'ppt', 'pptx', 'xls', 'xlsx'}
 MAX_FILE_SIZE = 16 * 1024 * 1024  # 16MB max file size
+MAX_BULK_GRADES = 500  # submissions per /api/grade_submissions_bulk request
+SCHEDULE_HORIZON_DAYS = 180  # days past the window start open-ended recurring events are expanded to when no end date is asked for
 
 # Configure upload folder
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
 
+# Query result cache shared by all workers on this host (QUERY_CACHE=0 disables it)
+query_cache = QueryCache(
+    os.environ.get('QUERY_CACHE_PATH', 'query_cache.db'),
+    max_entries=int(os.environ.get('QUERY_CACHE_MAX_ENTRIES', 5000)),
+    enabled=os.environ.get('QUERY_CACHE', '1') != '0'
+)
+add_commit_listener(query_cache.invalidate)
+
+# Prometheus metrics at /metrics, aggregated across workers through METRICS_DIR
+# (registered before compression so response sizes are measured on the wire)
+metrics = Metrics(
+    app,
+    directory=os.environ.get('METRICS_DIR', 'metrics'),
+    token=os.environ.get('METRICS_TOKEN')
+)
+add_query_listener(metrics.record_query)
+add_connect_listener(metrics.record_connect)
+
+# Per-statement recording: slow-query log, N+1 detection and, in debug mode,
+# a SQL report for every request
+query_recorder = QueryRecorder(
+    app,
+    enabled=os.environ.get('SQL_INSTRUMENTATION', '1') != '0',
+    slow_ms=float(os.environ.get('SLOW_QUERY_MS', 100)),
+    slow_log_path=os.environ.get('SLOW_QUERY_LOG', 'slow_queries.log'),
+    repeat_threshold=int(os.environ.get('SQL_REPEAT_THRESHOLD', 10)),
+    on_repeated=lambda endpoint, statement, count: metrics.inc('staffroom_sql_n_plus_one_total', {'endpoint': endpoint})
+)
+
+# Database-per-organization mode (SHARDING=1; SQLite only): DATABASE_URL holds the catalog of users,
+# organizations and memberships, and each organization's data lives in SHARD_DIR/org_<id>.db
+shards = None
+if dialect_for(DB_PATH) == SQLITE and os.environ.get('SHARDING', '0') == '1':
+    shards = ShardRouter(
+        DB_PATH,
+        os.environ.get('SHARD_DIR', 'shards'),
+        pool_size=int(os.environ.get('SHARD_POOL_SIZE', 4)),
+        pragmas=sqlite_pragmas(
+            journal_mode=os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+            synchronous=os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+        )
+    )
+    atexit.register(shards.close)
+    metrics.register_process_counters(
+        'staffroom_shard_connections_total', 'Shard connections by whether they came from the pool',
+        lambda: [({'source': 'opened'}, shards.stats()['opened']), ({'source': 'pool'}, shards.stats()['reused'])])
+
+def current_shard():
+    """Organization whose shard this context's queries go to - shards.use() if set, else the session's"""
+    pinned = shards.pinned()
+    if pinned is not None:
+        return pinned[0]
+    if has_request_context():
+        return session.get('current_org_id')
+    return None
+
+# SQLite writes queued to one connection per worker and group committed, with the database in WAL
+# mode so reads never wait for them (SQLITE_WRITER=0 writes on each request's own connection;
+# sharded databases already take one write lock per organization)
+writer = None
+if dialect_for(DB_PATH) == SQLITE and shards is None and os.environ.get('SQLITE_WRITER', '1') != '0':
+    writer = SQLiteWriter(
+        lambda: query_recorder.instrument(connect(DB_PATH, pragmas=sqlite_pragmas(
+            journal_mode=os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+            synchronous=os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+            cache_size_kb=os.environ.get('SQLITE_CACHE_SIZE_KB', 16384),
+            mmap_size_mb=os.environ.get('SQLITE_MMAP_SIZE_MB', 256)
+        ))),
+        max_batch=int(os.environ.get('SQLITE_WRITER_BATCH', 64)),
+        # Queue wait plus the batch's own wait for the file lock, each bounded by the busy timeout
+        timeout=float(os.environ.get('SQLITE_WRITER_TIMEOUT', 2 * int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)) / 1000.0))
+    )
+    atexit.register(writer.stop)
+    metrics.register_process_counters(
+        'staffroom_sqlite_writer_jobs_total', 'Writes run by the SQLite writer by outcome',
+        lambda: [({'outcome': outcome}, writer.stats()[outcome]) for outcome in ('committed', 'failed')])
+    metrics.register_process_counters(
+        'staffroom_sqlite_writer_batches_total', 'Transactions committed by the SQLite writer',
+        lambda: [({}, writer.stats()['batches'])])
+    metrics.register_process_counters(
+        'staffroom_sqlite_writer_wait_seconds_total', 'Time writes spent queued for the SQLite writer',
+        lambda: [({}, writer.stats()['wait_seconds'])])
+
+# Read-only reporting replica copied from the live SQLite database with the online backup API
+# (SNAPSHOT=1); attendance percentages, dashboard stats and submission listings read it
+snapshot = None
+if dialect_for(DB_PATH) == SQLITE and shards is None and os.environ.get('SNAPSHOT', '0') == '1':
+    snapshot = SnapshotReplica(
+        DB_PATH,
+        os.environ.get('SNAPSHOT_PATH') or os.path.splitext(DB_PATH.replace('sqlite:///', ''))[0] + '_snapshot.db',
+        interval=float(os.environ.get('SNAPSHOT_INTERVAL', 300)),
+        pages=int(os.environ.get('SNAPSHOT_PAGES', 256)),
+        max_seconds=float(os.environ.get('SNAPSHOT_MAX_SECONDS', 30)),
+        max_staleness=float(os.environ['SNAPSHOT_MAX_STALENESS']) if os.environ.get('SNAPSHOT_MAX_STALENESS') else None
+    )
+    atexit.register(snapshot.stop)
+    metrics.register_process_counters(
+        'staffroom_snapshot_refreshes_total', 'Reporting snapshot refreshes by outcome',
+        lambda: [({'outcome': outcome}, snapshot.stats()[key])
+                 for outcome, key in (('copied', 'refreshes'), ('failed', 'failures'), ('skipped', 'skipped'))])
+    metrics.register_process_counters(
+        'staffroom_snapshot_restarts_total', 'Reporting snapshot copies restarted by concurrent writes',
+        lambda: [({}, snapshot.stats()['restarts'])])
+
+    def snapshot_metrics():
+        """Age of the replica file, the same for every worker"""
+        age = snapshot.stats()['age_seconds']
+        return [('staffroom_snapshot_age_seconds', 'gauge', 'Age of the reporting snapshot replica in seconds',
+                 [({}, age)] if age is not None else [])]
+
+    metrics.register_collector(snapshot_metrics)
+
+# Attendance, replies and submissions older than the kept academic years moved to an attached
+# archive file (ARCHIVE=1; SQLite only); reads add the archive only for ranges reaching back that far
+archive = None
+if dialect_for(DB_PATH) == SQLITE and shards is None and os.environ.get('ARCHIVE', '0') == '1':
+    archive = Archiver(
+        lambda: query_recorder.instrument(connect(DB_PATH)),
+        os.environ.get('ARCHIVE_PATH') or os.path.splitext(DB_PATH.replace('sqlite:///', ''))[0] + '_archive.db',
+        year_start=parse_year_start(os.environ.get('ARCHIVE_YEAR_START', '08-01')),
+        keep_years=int(os.environ.get('ARCHIVE_KEEP_YEARS', 1)),
+        batch_size=int(os.environ.get('ARCHIVE_BATCH', 500)),
+        interval=float(os.environ.get('ARCHIVE_INTERVAL', 3600))
+    )
+    app.before_request(archive.start)
+    atexit.register(archive.stop)
+    metrics.register_process_counters(
+        'staffroom_archive_rows_moved_total', 'Rows moved into the archive by table',
+        lambda: [({'table': table}, count) for table, count in archive.stats()['moved'].items()])
+    metrics.register_process_counters(
+        'staffroom_archive_rows_restored_total', 'Archived rows moved back to the live tables before a write',
+        lambda: [({}, archive.stats()['restored'])])
+    metrics.register_process_counters(
+        'staffroom_archive_rows_dropped_total', 'Archived rows discarded on restore because a live row had the same key',
+        lambda: [({}, archive.stats()['dropped'])])
+
+def table_source(conn, table, since=None):
+    """FROM-clause source for an archivable table covering rows dated from since (None for all time)"""
+    if archive is None:
+        return table
+    return archive.source(conn, table, since)
+
+def assignment_created_at(conn, assignment_id):
+    """When an assignment was posted - its submissions can't be older (None when archival is off)"""
+    if archive is None:
+        return None
+    row = conn.execute("SELECT created_at FROM resources WHERE id = ?", (assignment_id,)).fetchone()
+    return row['created_at'] if row else None
+
+# Exports too large to stream while the client waits run as background jobs writing to EXPORT_DIR
+export_jobs = ExportJobs(
+    os.environ.get('EXPORT_DIR', 'exports'),
+    ttl=float(os.environ.get('EXPORT_TTL', 86400)),
+    workers=int(os.environ.get('EXPORT_WORKERS', 2)),
+    per_user=int(os.environ.get('EXPORT_JOBS_PER_USER', 2)),
+    stale_after=float(os.environ.get('EXPORT_STALE_SECONDS', 900))
+)
+
+# Sampled request tracing (TRACE_SAMPLE_RATE, or forced per request with an X-Trace: 1 header
+# from an admin session or a request carrying the TRACE_TOKEN secret in X-Trace-Token)
+tracer = Tracer(
+    app,
+    sample_rate=float(os.environ.get('TRACE_SAMPLE_RATE', 0)),
+    buffer_size=int(os.environ.get('TRACE_BUFFER_SIZE', 200)),
+    token=os.environ.get('TRACE_TOKEN')
+)
+add_query_listener(tracer.record_query)
+
+# On-demand profiling of the next N matching requests, armed by an admin (nothing runs while disarmed)
+profiler = Profiler(app, directory=os.environ.get('PROFILE_DIR', 'profiles'))
+
+# tracemalloc accounting of peak and retained allocations per request and route (MEMORY_TRACKING=1)
+memory_tracker = MemoryTracker(
+    app,
+    enabled=os.environ.get('MEMORY_TRACKING', '0') == '1',
+    frames=int(os.environ.get('MEMORY_TRACE_FRAMES', 5)),
+    snapshot_interval=float(os.environ.get('MEMORY_SNAPSHOT_INTERVAL', 300)),
+    on_request=lambda endpoint, peak, retained: metrics.observe(
+        'staffroom_request_memory_peak_bytes', peak, MEMORY_BUCKETS, {'endpoint': endpoint})
+)
+
+# gzip/brotli compression for JSON and page responses above COMPRESS_MIN_SIZE bytes
+compression = Compression(app, min_size=int(os.environ.get('COMPRESS_MIN_SIZE', 500)))
+
+# Uploads saved under a random uuid name never change
+UUID_FILENAME = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\.\w+$')
+
+def save_upload(file, path):
+    """Save an uploaded file, traced as file I/O"""
+    with tracer.span('file.save', path=path) as span:
+        file.save(path)
+        span.set(bytes=os.path.getsize(path))
+
+# Rendered template fragments keyed by organization, role and data version (FRAGMENT_CACHE=0 disables it)
+fragment_cache = FragmentCache(
+    app,
+    versions_for=lambda organization_id, tables: db.get_data_versions(organization_id, tables),
+    enabled=os.environ.get('FRAGMENT_CACHE', '1') != '0'
+)
+
+# Expanded occurrences of recurring schedule events, bounded by OCCURRENCE_CACHE_SIZE occurrences
+occurrence_cache = OccurrenceCache(max_size=int(os.environ.get('OCCURRENCE_CACHE_SIZE', 100000)))
+
+def query_cache_metrics():
+    """Query cache counters, already summed across workers in the cache database"""
+    stats = query_cache.stats()
+    return [
+        ('staffroom_query_cache_hits_total', 'counter', 'Query cache hits by method',
+         [({'method': name}, s['hits']) for name, s in stats.items()]),
+        ('staffroom_query_cache_misses_total', 'counter', 'Query cache misses by method',
+         [({'method': name}, s['misses']) for name, s in stats.items()]),
+        ('staffroom_query_cache_hit_ratio', 'gauge', 'Query cache hit ratio by method',
+         [({'method': name}, s['hit_ratio']) for name, s in stats.items()]),
+    ]
+
+metrics.register_collector(query_cache_metrics)
+metrics.register_process_counters(
+    'staffroom_fragment_cache_hits_total', 'Template fragment cache hits by fragment',
+    lambda: [({'fragment': name}, s['hits']) for name, s in fragment_cache.totals()[1].items()])
+metrics.register_process_counters(
+    'staffroom_fragment_cache_misses_total', 'Template fragment cache misses by fragment',
+    lambda: [({'fragment': name}, s['misses']) for name, s in fragment_cache.totals()[1].items()])
+metrics.register_process_counters(
+    'staffroom_template_renders_total', 'Template renders by template',
+    lambda: [({'template': name}, s['count']) for name, s in fragment_cache.totals()[0].items()])
+metrics.register_process_counters(
+    'staffroom_template_render_seconds_total', 'Time spent rendering templates by template',
+    lambda: [({'template': name}, s['total_seconds']) for name, s in fragment_cache.totals()[0].items()])
+metrics.register_process_counters(
+    'staffroom_occurrence_cache_hits_total', 'Recurring event expansions served from the occurrence cache',
+    lambda: [({}, occurrence_cache.stats()['hits'])])
+metrics.register_process_counters(
+    'staffroom_occurrence_cache_misses_total', 'Recurring event expansions computed',
+    lambda: [({}, occurrence_cache.stats()['misses'])])
+metrics.register_process_counters(
+    'staffroom_request_memory_retained_bytes_total', 'Bytes still allocated when a request finished, by endpoint',
+    memory_tracker.totals)
+
 class WebDatabaseManager:
     def __init__(self, db_path=DB_PATH):
         self.db_path = db_path
         self.init_database()
     
+    @property
+    def cache_scope(self):
+        """The copy of the data this manager reads, as part of its query cache keys"""
+        if shards is not None and self.db_path == DB_PATH:
+            organization_id = current_shard()
+            return shards.shard_url(organization_id) if organization_id else self.db_path
+        return self.db_path
+    
     def get_connection(self):
-        """Get database connection - supports both SQLite and PostgreSQL"""
-        if self.db_path.startswith('postgresql://'):
-            import psycopg2
-            from psycopg2.extras import RealDictCursor
-            conn = psycopg2.connect(self.db_path, cursor_factory=RealDictCursor)
-        else:
-            # For SQLite, use a simple filename
-            db_file = self.db_path.replace('sqlite:///', '')
-            conn = sqlite3.connect(db_file)
-            conn.row_factory = sqlite3.Row
-        return conn
+        """Get database connection - supports both SQLite and PostgreSQL (pooled), routed to the current organization's shard when sharded"""
+        if shards is not None and self.db_path == DB_PATH:
+            return query_recorder.instrument(shards.connect(current_shard()))
+        return query_recorder.instrument(connect(self.db_path))
+    
+    def write(self, fn):
+        """Run fn(conn) in a write transaction and return its result - through the SQLite writer queue when enabled"""
+        if writer is None or self.db_path != DB_PATH:
+            conn = self.get_connection()
+            try:
+                result = fn(conn)
+                conn.commit()
+                return result
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+        start = time.perf_counter()
+        try:
+            return writer.run(fn)
+        finally:
+            # The statements ran on the writer thread; the request sees one record for the queued write
+            query_recorder.record(f'WRITER {fn.__name__}', '', time.perf_counter() - start, None)
+    
+    def get_data_versions(self, organization_id, tables):
+        """Get change counters for tables as seen by an organization"""
+        conn = self.get_connection()
+        try:
+            return versions.fetch(conn, organization_id, tables)
+        finally:
+            conn.close()
+    
+    def get_class_organization_id(self, conn, class_id):
+        """Get the organization a class belongs to (None if unknown)"""
+        row = conn.execute("SELECT organization_id FROM classes WHERE id = ?", (class_id,)).fetchone()
+        return row['organization_id'] if row else None
+    
+    def get_resource_organization_id(self, conn, resource_id):
+        """Get the organization a resource belongs to (None if unknown)"""
+        if 'organization_id' not in conn.table_columns('resources'):
+            return None
+        row = conn.execute("SELECT organization_id FROM resources WHERE id = ?", (resource_id,)).fetchone()
+        return row['organization_id'] if row else None
     
     def init_database(self):
         """Initialize database with web-optimized schema"""
@@ -91,22 +405,10 @@ class WebDatabaseManager:
         """)
         
         # Add columns if they don't exist (for existing databases)
-        try:
-            conn.execute("ALTER TABLE users ADD COLUMN phone_number TEXT")
-        except:
-            pass
-        try:
-            conn.execute("ALTER TABLE users ADD COLUMN profile_photo_path TEXT")
-        except:
-            pass
-        try:
-            conn.execute("ALTER TABLE users ADD COLUMN bio TEXT")
-        except:
-            pass
-        try:
-            conn.execute("ALTER TABLE users ADD COLUMN updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
-        except:
-            pass
+        conn.add_column('users', 'phone_number TEXT')
+        conn.add_column('users', 'profile_photo_path TEXT')
+        conn.add_column('users', 'bio TEXT')
+        conn.add_column('users', 'updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP')
         
         # Subjects table
         conn.execute("""
@@ -257,20 +559,11 @@ class WebDatabaseManager:
         """)
         
         # Add banner columns if they don't exist (for existing databases)
-        try:
-            conn.execute("ALTER TABLE organizations ADD COLUMN banner_filename TEXT")
-        except:
-            pass
-        try:
-            conn.execute("ALTER TABLE organizations ADD COLUMN banner_path TEXT")
-        except:
-            pass
+        conn.add_column('organizations', 'banner_filename TEXT')
+        conn.add_column('organizations', 'banner_path TEXT')
         
         # Add organization_tag column (unique identifier for search)
-        try:
-            conn.execute("ALTER TABLE organizations ADD COLUMN organization_tag TEXT UNIQUE")
-        except:
-            pass
+        conn.add_column('organizations', 'organization_tag TEXT UNIQUE')
         
         # Organization memberships
         conn.execute("""
@@ -304,13 +597,23 @@ class WebDatabaseManager:
         """)
         
         # Update discussions table to include organization_id (if not exists)
-        try:
-            conn.execute("""
-                ALTER TABLE discussions ADD COLUMN organization_id INTEGER REFERENCES organizations (id)
-            """)
-        except sqlite3.OperationalError:
-            # Column already exists, ignore
-            pass
+        conn.add_column('discussions', 'organization_id INTEGER REFERENCES organizations (id)')
+        
+        # Classes belong to an organization
+        conn.add_column('classes', 'organization_id INTEGER')
+        
+        # Class rosters (student enrollments used by the web app)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS class_students (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                class_id INTEGER NOT NULL,
+                student_id INTEGER NOT NULL,
+                enrolled_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (class_id) REFERENCES classes (id),
+                FOREIGN KEY (student_id) REFERENCES users (id),
+                UNIQUE(class_id, student_id)
+            )
+        """)
         
         # Resources table
         conn.execute("""
@@ -429,21 +732,19 @@ class WebDatabaseManager:
         """)
         
         # Add resource_category column to resources if it doesn't exist
-        try:
-            conn.execute("ALTER TABLE resources ADD COLUMN resource_category TEXT DEFAULT 'other'")
-        except:
-            pass
+        conn.add_column('resources', "resource_category TEXT DEFAULT 'other'")
+        conn.add_column('resources', 'due_date DATE')
         
-        try:
-            conn.execute("ALTER TABLE resources ADD COLUMN due_date DATE")
-        except:
-            pass
+        # Start of the last occurrence of a recurring event (NULL when it repeats without end), for range queries
+        conn.add_column('class_schedule', 'recurrence_end TIMESTAMP')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_class_schedule_class_start ON class_schedule (class_id, start_time)")
         
         # Migrate old is_homework to resource_category
-        try:
+        if 'is_homework' in conn.table_columns('resources'):
             conn.execute("UPDATE resources SET resource_category = 'assignment' WHERE is_homework = 1")
-        except:
-            pass
+        
+        # Change counters used for conditional GET (ETag / Last-Modified)
+        conn.execute(versions.VERSIONS_DDL)
         
         conn.commit()
         
@@ -456,6 +757,10 @@ class WebDatabaseManager:
         # Create demo students
         self.create_demo_students()
         
+        # Generations only see this app's own commits: entries may predate a split,
+        # a manual edit, a recreated database or a crash before invalidate()
+        query_cache.clear()
+        
         conn.close()
     
     def create_default_admin(self):
@@ -547,6 +852,7 @@ class WebDatabaseManager:
             conn.commit()
         conn.close()
     
+    @tracer.traced('auth.authenticate_user')
     def authenticate_user(self, username, password):
         """Authenticate user and return with organization context"""
         conn = self.get_connection()
@@ -589,14 +895,17 @@ class WebDatabaseManager:
                     INSERT INTO organization_memberships (organization_id, user_id, role)
                     VALUES (?, ?, ?)
                 """, (organization_id, user_id, user_type))
+                versions.bump(conn, None, 'organization_memberships')
             
+            versions.bump(conn, None, 'users')
             conn.commit()
             return user_id
-        except sqlite3.IntegrityError:
+        except IntegrityError:
             return None
         finally:
             conn.close()
     
+    @query_cache.cached('subjects')
     def get_all_subjects(self):
         """Get all subjects"""
         conn = self.get_connection()
@@ -622,11 +931,13 @@ class WebDatabaseManager:
             INSERT INTO classes (name, description, subject_id, grade_level, teacher_id, organization_id)
             VALUES (?, ?, ?, ?, ?, ?)
         """, (name, description, subject_id, grade_level, teacher_id, organization_id))
+        versions.bump(conn, organization_id, 'classes')
         conn.commit()
         class_id = cursor.lastrowid
         conn.close()
         return class_id
     
+    @query_cache.cached('classes', 'subjects')
     def get_teacher_classes(self, teacher_id):
         """Get all classes for a teacher"""
         conn = self.get_connection()
@@ -657,9 +968,10 @@ class WebDatabaseManager:
                 INSERT INTO class_students (class_id, student_id)
                 VALUES (?, ?)
             """, (class_id, student_id))
+            versions.bump(conn, self.get_class_organization_id(conn, class_id), 'class_students')
             conn.commit()
             return True
-        except sqlite3.IntegrityError:
+        except IntegrityError:
             return False
         finally:
             conn.close()
@@ -672,14 +984,70 @@ class WebDatabaseManager:
                 DELETE FROM class_students 
                 WHERE class_id = ? AND student_id = ?
             """, (class_id, student_id))
+            versions.bump(conn, self.get_class_organization_id(conn, class_id), 'class_students')
             conn.commit()
             return True
         except Exception as e:
-            print(f"Error unenrolling student: {e}")
+            logger.error("Error unenrolling student: %s", e)
             return False
         finally:
             conn.close()
-    
+
+    def sync_class_roster(self, class_id, student_ids):
+        """Make a class's roster exactly student_ids in one transaction and return the diff
+
+        Every id must be a student account and, when the class belongs to an
+        organization, a member of it; otherwise nothing changes and the diff
+        is {'invalid': [ids]}.
+        """
+        student_ids = sorted({int(student_id) for student_id in student_ids})
+
+        def sync(conn):
+            organization_id = self.get_class_organization_id(conn, class_id)
+            # The desired roster goes into a temp table so the diff is set-based SQL
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS roster_sync (student_id INTEGER PRIMARY KEY)")
+            conn.execute("DELETE FROM roster_sync")
+            conn.executemany("INSERT INTO roster_sync (student_id) VALUES (?)", [(s,) for s in student_ids])
+            invalid = [row[0] for row in conn.execute("""
+                SELECT r.student_id FROM roster_sync r
+                LEFT JOIN users u ON u.id = r.student_id AND u.user_type = 'student'
+                WHERE u.id IS NULL OR (? IS NOT NULL AND NOT EXISTS (
+                    SELECT 1 FROM organization_memberships om
+                    WHERE om.organization_id = ? AND om.user_id = r.student_id
+                ))
+                ORDER BY r.student_id
+            """, (organization_id, organization_id)).fetchall()]
+            if invalid:
+                conn.execute("DELETE FROM roster_sync")
+                return {'invalid': invalid}
+            added = [row[0] for row in conn.execute("""
+                SELECT r.student_id FROM roster_sync r
+                WHERE NOT EXISTS (SELECT 1 FROM class_students cs WHERE cs.class_id = ? AND cs.student_id = r.student_id)
+                ORDER BY r.student_id
+            """, (class_id,)).fetchall()]
+            removed = [row[0] for row in conn.execute("""
+                SELECT cs.student_id FROM class_students cs
+                WHERE cs.class_id = ? AND cs.student_id NOT IN (SELECT student_id FROM roster_sync)
+                ORDER BY cs.student_id
+            """, (class_id,)).fetchall()]
+            if added:
+                conn.execute("""
+                    INSERT INTO class_students (class_id, student_id)
+                    SELECT ?, r.student_id FROM roster_sync r
+                    WHERE NOT EXISTS (SELECT 1 FROM class_students cs WHERE cs.class_id = ? AND cs.student_id = r.student_id)
+                """, (class_id, class_id))
+            if removed:
+                conn.execute("""
+                    DELETE FROM class_students
+                    WHERE class_id = ? AND student_id NOT IN (SELECT student_id FROM roster_sync)
+                """, (class_id,))
+            if added or removed:
+                versions.bump(conn, organization_id, 'class_students')
+            conn.execute("DELETE FROM roster_sync")
+            return {'added': added, 'removed': removed, 'unchanged': len(student_ids) - len(added)}
+
+        return self.write(sync)
+
     def get_class_students(self, class_id):
         """Get all students in a class"""
         conn = self.get_connection()
@@ -708,13 +1076,97 @@ class WebDatabaseManager:
         conn.close()
         return classes
     
+    def grade_submissions(self, grades, grader_id, owner_id=None):
+        """Grade many submissions in one transaction
+        
+        grades is a list of (submission_id, grade, feedback). With owner_id,
+        every submission must be for an assignment in that teacher's class or
+        posted by them. Nothing is written when a submission is missing or not
+        owned; the result then lists them instead of the graded count.
+        """
+        ids = [submission_id for submission_id, _, _ in grades]
+        
+        def grade_all(conn):
+            access = self.check_submission_access(conn, ids, owner_id)
+            if access['missing'] or access['forbidden']:
+                return {'missing': access['missing'], 'forbidden': access['forbidden']}
+            conn.executemany("""
+                UPDATE assignment_submissions
+                SET grade = ?, feedback = ?, status = 'graded', graded_by = ?, graded_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            """, [(grade, feedback, grader_id, submission_id) for submission_id, grade, feedback in grades])
+            # One bump per organization, however many submissions were graded
+            for organization_id in sorted(set(access['organizations']), key=str):
+                versions.bump(conn, organization_id, 'assignment_submissions')
+            return {'graded': len(grades)}
+        
+        return self.write(grade_all)
+    
+    def check_submission_access(self, conn, ids, owner_id=None, source='assignment_submissions'):
+        """Which submission ids are missing, and which are not owner_id's to grade
+        
+        A teacher owns submissions for assignments in their class or posted by
+        them; owner_id None allows all. Returns missing and forbidden id lists
+        plus the organization of each found submission.
+        """
+        columns = conn.table_columns('resources')
+        creator = 'created_by' if 'created_by' in columns else 'uploaded_by'
+        organization = 'r.organization_id' if 'organization_id' in columns else 'NULL'
+        rows = conn.execute(f"""
+            SELECT s.id, {organization} AS organization_id,
+                   CASE WHEN c.teacher_id = ? OR r.{creator} = ? THEN 1 ELSE 0 END AS owned
+            FROM {source} s
+            LEFT JOIN resources r ON s.assignment_id = r.id
+            LEFT JOIN classes c ON r.class_id = c.id
+            WHERE s.id IN ({', '.join('?' for _ in ids)})
+        """, [owner_id, owner_id] + list(ids)).fetchall()
+        found = {row['id'] for row in rows}
+        return {
+            'missing': [submission_id for submission_id in ids if submission_id not in found],
+            'forbidden': sorted(row['id'] for row in rows if owner_id is not None and not row['owned']),
+            'organizations': [row['organization_id'] for row in rows],
+        }
+    
+    @query_cache.cached('class_students', 'users', 'resources', 'assignment_submissions')
+    def get_gradebook(self, class_id):
+        """Get the students x assignments grade grid of a class with per-student and per-assignment statistics"""
+        conn = self.get_connection()
+        try:
+            students = [dict(row) for row in conn.execute("""
+                SELECT u.id, u.first_name, u.last_name FROM users u
+                JOIN class_students cs ON u.id = cs.student_id
+                WHERE cs.class_id = ?
+                ORDER BY u.last_name, u.first_name, u.id
+            """, (class_id,)).fetchall()]
+            assignments = [dict(row) for row in conn.execute("""
+                SELECT id, title, due_date, created_at FROM resources
+                WHERE class_id = ? AND resource_category = 'assignment'
+                ORDER BY due_date IS NULL, due_date, id
+            """, (class_id,)).fetchall()]
+            cells = []
+            if students and assignments:
+                # Submissions can't predate the class's oldest assignment
+                since = min(str(a['created_at']) for a in assignments) if all(a['created_at'] for a in assignments) else None
+                cells = conn.execute(f"""
+                    SELECT s.student_id, s.assignment_id, s.grade, s.status, s.submission_date
+                    FROM {table_source(conn, 'assignment_submissions', since)} s
+                    JOIN resources r ON s.assignment_id = r.id
+                    WHERE r.class_id = ? AND r.resource_category = 'assignment'
+                """, (class_id,)).fetchall()
+        finally:
+            conn.close()
+        for assignment in assignments:
+            assignment['due_date'] = str(assignment['due_date']) if assignment['due_date'] else None
+            del assignment['created_at']
+        return gradebook.build(students, assignments, [tuple(row) for row in cells])
+    
     def get_discussions_by_organization(self, organization_id):
         """Get discussions for an organization"""
         conn = self.get_connection()
         try:
-            cursor = conn.execute("""
+            cursor = conn.execute(f"""
                 SELECT d.*, u.first_name, u.last_name,
-                       (SELECT COUNT(*) FROM discussion_replies dr WHERE dr.discussion_id = d.id) as reply_count
+                       (SELECT COUNT(*) FROM {table_source(conn, 'discussion_replies')} dr WHERE dr.discussion_id = d.id) as reply_count
                 FROM discussions d
                 LEFT JOIN users u ON d.author_id = u.id
                 WHERE d.organization_id = ?
@@ -723,7 +1175,7 @@ class WebDatabaseManager:
             discussions = [dict(row) for row in cursor.fetchall()]
             return discussions
         except Exception as e:
-            print(f"Error getting discussions by organization: {e}")
+            logger.error("Error getting discussions by organization: %s", e)
             return []
         finally:
             conn.close()
@@ -743,40 +1195,44 @@ class WebDatabaseManager:
     
     def create_discussion(self, title, content, author_id, category='general', organization_id=None):
         """Create a new discussion"""
-        conn = self.get_connection()
-        try:
+        def insert_discussion(conn):
             cursor = conn.execute("""
                 INSERT INTO discussions (title, content, author_id, category, organization_id)
                 VALUES (?, ?, ?, ?, ?)
             """, (title, content, author_id, category, organization_id))
             discussion_id = cursor.lastrowid
-            conn.commit()
+            versions.bump(conn, organization_id, 'discussions')
             return discussion_id
+        try:
+            return self.write(insert_discussion)
         except Exception as e:
-            print(f"Error creating discussion: {e}")
-            conn.rollback()
+            logger.error("Error creating discussion: %s", e)
             return None
-        finally:
-            conn.close()
     
     def add_discussion_reply(self, discussion_id, content, author_id):
         """Add a reply to a discussion"""
-        conn = self.get_connection()
-        cursor = conn.execute("""
-            INSERT INTO discussion_replies (discussion_id, content, author_id)
-            VALUES (?, ?, ?)
-        """, (discussion_id, content, author_id))
-        reply_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return reply_id
+        def insert_reply(conn):
+            cursor = conn.execute("""
+                INSERT INTO discussion_replies (discussion_id, content, author_id)
+                VALUES (?, ?, ?)
+            """, (discussion_id, content, author_id))
+            reply_id = cursor.lastrowid
+            row = conn.execute("SELECT organization_id FROM discussions WHERE id = ?", (discussion_id,)).fetchone()
+            versions.bump(conn, row['organization_id'] if row else None, 'discussion_replies')
+            return reply_id
+        return self.write(insert_reply)
     
     def get_discussion_replies(self, discussion_id):
         """Get replies for a discussion"""
         conn = self.get_connection()
-        cursor = conn.execute("""
+        since = None
+        if archive is not None:
+            # Replies can't predate their discussion
+            row = conn.execute("SELECT created_at FROM discussions WHERE id = ?", (discussion_id,)).fetchone()
+            since = row['created_at'] if row else None
+        cursor = conn.execute(f"""
             SELECT dr.*, u.first_name, u.last_name, u.username
-            FROM discussion_replies dr
+            FROM {table_source(conn, 'discussion_replies', since)} dr
             JOIN users u ON dr.author_id = u.id
             WHERE dr.discussion_id = ?
             ORDER BY dr.created_at ASC
@@ -812,6 +1268,25 @@ class WebDatabaseManager:
         conn.close()
         return attachments
     
+    def get_attachments_for_discussions(self, discussion_ids):
+        """Get attachments for several discussions in one query, keyed by discussion id"""
+        attachments = {discussion_id: [] for discussion_id in discussion_ids}
+        if not attachments:
+            return attachments
+        conn = self.get_connection()
+        placeholders = ', '.join('?' for _ in attachments)
+        cursor = conn.execute(f"""
+            SELECT da.*, u.first_name, u.last_name
+            FROM discussion_attachments da
+            JOIN users u ON da.uploaded_by = u.id
+            WHERE da.discussion_id IN ({placeholders})
+            ORDER BY da.uploaded_at ASC
+        """, list(attachments))
+        for row in cursor.fetchall():
+            attachments[row['discussion_id']].append(dict(row))
+        conn.close()
+        return attachments
+    
     def get_reply_attachments(self, reply_id):
         """Get attachments for a reply"""
         conn = self.get_connection()
@@ -830,9 +1305,9 @@ class WebDatabaseManager:
         """Get discussions for an organization"""
         conn = self.get_connection()
         try:
-            cursor = conn.execute("""
+            cursor = conn.execute(f"""
                 SELECT d.*, u.first_name, u.last_name,
-                       (SELECT COUNT(*) FROM discussion_replies dr WHERE dr.discussion_id = d.id) as reply_count
+                       (SELECT COUNT(*) FROM {table_source(conn, 'discussion_replies')} dr WHERE dr.discussion_id = d.id) as reply_count
                 FROM discussions d
                 LEFT JOIN users u ON d.author_id = u.id
                 WHERE d.organization_id = ?
@@ -841,7 +1316,7 @@ class WebDatabaseManager:
             discussions = [dict(row) for row in cursor.fetchall()]
             return discussions
         except Exception as e:
-            print(f"Error getting discussions by organization: {e}")
+            logger.error("Error getting discussions by organization: %s", e)
             return []
         finally:
             conn.close()
@@ -856,15 +1331,17 @@ class WebDatabaseManager:
                 VALUES (?, ?, ?, ?, ?, ?)
             """, (title, content, author_id, author_organization, category, tags))
             discussion_id = cursor.lastrowid
+            versions.bump(conn, None, 'global_discussions')
             conn.commit()
             return discussion_id
         except Exception as e:
-            print(f"Error creating global discussion: {e}")
+            logger.error("Error creating global discussion: %s", e)
             conn.rollback()
             return None
         finally:
             conn.close()
     
+    @query_cache.cached('global_discussions', 'global_discussion_replies', 'users')
     def get_global_discussions(self, category=None, limit=50):
         """Get global discussions with optional category filter"""
         conn = self.get_connection()
@@ -888,29 +1365,27 @@ class WebDatabaseManager:
             discussions = [dict(row) for row in cursor.fetchall()]
             return discussions
         except Exception as e:
-            print(f"Error getting global discussions: {e}")
+            logger.error("Error getting global discussions: %s", e)
             return []
         finally:
             conn.close()
     
     def add_global_discussion_reply(self, discussion_id, author_id, author_organization, content):
         """Add a reply to a global discussion"""
-        conn = self.get_connection()
-        try:
+        def insert_global_reply(conn):
             cursor = conn.execute("""
                 INSERT INTO global_discussion_replies 
                 (discussion_id, author_id, author_organization, content)
                 VALUES (?, ?, ?, ?)
             """, (discussion_id, author_id, author_organization, content))
             reply_id = cursor.lastrowid
-            conn.commit()
+            versions.bump(conn, None, 'global_discussion_replies')
             return reply_id
+        try:
+            return self.write(insert_global_reply)
         except Exception as e:
-            print(f"Error adding global discussion reply: {e}")
-            conn.rollback()
+            logger.error("Error adding global discussion reply: %s", e)
             return None
-        finally:
-            conn.close()
     
     def get_global_discussion_replies(self, discussion_id):
         """Get replies for a global discussion"""
@@ -926,7 +1401,7 @@ class WebDatabaseManager:
             replies = [dict(row) for row in cursor.fetchall()]
             return replies
         except Exception as e:
-            print(f"Error getting global discussion replies: {e}")
+            logger.error("Error getting global discussion replies: %s", e)
             return []
         finally:
             conn.close()
@@ -936,8 +1411,7 @@ class WebDatabaseManager:
         conn = self.get_connection()
         try:
             # Check which columns exist in the table
-            cursor = conn.execute("PRAGMA table_info(resources)")
-            columns = [col[1] for col in cursor.fetchall()]
+            columns = conn.table_columns('resources')
             
             # Build dynamic insert based on available columns
             insert_cols = ['title', 'description', 'resource_type']
@@ -977,22 +1451,23 @@ class WebDatabaseManager:
             query = f"INSERT INTO resources ({', '.join(insert_cols)}) VALUES ({', '.join(['?' for _ in insert_vals])})"
             cursor = conn.execute(query, insert_vals)
             resource_id = cursor.lastrowid
+            versions.bump(conn, organization_id if 'organization_id' in columns else None, 'resources')
             conn.commit()
             return resource_id
         except Exception as e:
-            print(f"Error creating resource: {e}")
+            logger.error("Error creating resource: %s", e)
             conn.rollback()
             return None
         finally:
             conn.close()
     
+    @query_cache.cached('resources', 'subjects', 'users')
     def get_resources_by_organization(self, organization_id, grade_level=None, subject_id=None, resource_type=None):
         """Get resources for an organization with optional filters"""
         conn = self.get_connection()
         try:
             # Check if organization_id column exists
-            cursor = conn.execute("PRAGMA table_info(resources)")
-            columns = [row[1] for row in cursor.fetchall()]
+            columns = conn.table_columns('resources')
             
             if 'organization_id' not in columns:
                 # Fallback: get all resources if organization_id column doesn't exist
@@ -1031,7 +1506,7 @@ class WebDatabaseManager:
             resources = [dict(row) for row in cursor.fetchall()]
             return resources
         except Exception as e:
-            print(f"Error getting resources: {e}")
+            logger.error("Error getting resources: %s", e)
             return []
         finally:
             conn.close()
@@ -1041,8 +1516,7 @@ class WebDatabaseManager:
         conn = self.get_connection()
         try:
             # Check what columns exist in resources table
-            cursor = conn.execute("PRAGMA table_info(resources)")
-            columns = [row[1] for row in cursor.fetchall()]
+            columns = conn.table_columns('resources')
             
             # Build query based on available columns
             base_query = "SELECT r.*, u.first_name, u.last_name"
@@ -1061,7 +1535,7 @@ class WebDatabaseManager:
             resources = [dict(row) for row in cursor.fetchall()]
             return resources
         except Exception as e:
-            print(f"Error getting class resources: {e}")
+            logger.error("Error getting class resources: %s", e)
             return []
         finally:
             conn.close()
@@ -1070,11 +1544,13 @@ class WebDatabaseManager:
         """Delete a resource"""
         conn = self.get_connection()
         try:
+            organization_id = self.get_resource_organization_id(conn, resource_id)
             cursor = conn.execute("DELETE FROM resources WHERE id = ?", (resource_id,))
+            versions.bump(conn, organization_id, 'resources')
             conn.commit()
             return cursor.rowcount > 0
         except Exception as e:
-            print(f"Error deleting resource: {e}")
+            logger.error("Error deleting resource: %s", e)
             conn.rollback()
             return False
         finally:
@@ -1109,58 +1585,72 @@ class WebDatabaseManager:
                 
                 query = f"UPDATE resources SET {', '.join(updates)} WHERE id = ?"
                 cursor = conn.execute(query, params)
+                versions.bump(conn, self.get_resource_organization_id(conn, resource_id), 'resources')
                 conn.commit()
                 return cursor.rowcount > 0
             
             return True
         except Exception as e:
-            print(f"Error updating resource: {e}")
+            logger.error("Error updating resource: %s", e)
             conn.rollback()
             return False
         finally:
             conn.close()
 
-    def create_schedule_event(self, class_id, title, description, start_time, end_time, created_by):
-        """Create a schedule event"""
+    def create_schedule_event(self, class_id, title, description, start_time, end_time, created_by, recurrence_pattern=None):
+        """Create a schedule event; with a recurrence pattern the one row stands for the whole series"""
         conn = self.get_connection()
         try:
+            recurrence_end = None
+            if recurrence_pattern:
+                bound = parse_recurrence(recurrence_pattern).bound(parse_datetime(start_time))
+                recurrence_end = format_like(bound, start_time) if bound else None
             cursor = conn.execute("""
-                INSERT INTO class_schedule (class_id, title, description, start_time, end_time, created_by)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (class_id, title, description, start_time, end_time, created_by))
+                INSERT INTO class_schedule (class_id, title, description, start_time, end_time, created_by,
+                                            is_recurring, recurrence_pattern, recurrence_end)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (class_id, title, description, start_time, end_time, created_by,
+                  bool(recurrence_pattern), recurrence_pattern or None, recurrence_end))
             event_id = cursor.lastrowid
+            versions.bump(conn, self.get_class_organization_id(conn, class_id) if class_id else None, 'class_schedule')
             conn.commit()
             return event_id
         except Exception as e:
-            print(f"Error creating schedule event: {e}")
+            logger.error("Error creating schedule event: %s", e)
             conn.rollback()
             return None
         finally:
             conn.close()
     
     def get_teacher_schedule(self, teacher_id, start_date=None, end_date=None):
-        """Get all schedule events for a teacher"""
+        """Get a teacher's schedule events from start_date (default today), recurring ones expanded into their occurrences"""
         conn = self.get_connection()
         try:
+            window_start = parse_datetime(start_date) if start_date else datetime.combine(datetime.now().date(), datetime.min.time())
+            window_end = parse_datetime(end_date, end_of_day=True) if end_date else None
             query = """
                 SELECT cs.*, c.name as class_name
                 FROM class_schedule cs
                 LEFT JOIN classes c ON cs.class_id = c.id
-                WHERE c.teacher_id = ? OR cs.class_id IS NULL
+                WHERE (c.teacher_id = ? OR cs.class_id IS NULL)
+                  AND (cs.start_time >= ? OR (cs.is_recurring = 1
+                       AND (cs.recurrence_end IS NULL OR cs.recurrence_end >= ?)))
             """
-            params = [teacher_id]
-            
-            if start_date and end_date:
-                query += " AND cs.start_time BETWEEN ? AND ?"
-                params.extend([start_date, end_date])
+            # Bounds are whole days so they compare correctly against 'T' and ' ' separated timestamps;
+            # the exact window is applied while expanding
+            params = [teacher_id] + [window_start.date().isoformat()] * 2
+            if window_end is not None:
+                query += " AND cs.start_time < ?"
+                params.append((window_end.date() + timedelta(days=1)).isoformat())
             
             query += " ORDER BY cs.start_time ASC"
             
             cursor = conn.execute(query, params)
             events = [dict(row) for row in cursor.fetchall()]
-            return events
+            horizon = datetime.combine(window_start.date() + timedelta(days=SCHEDULE_HORIZON_DAYS), datetime.max.time())
+            return occurrence_cache.expand_events(events, window_start, window_end, horizon=horizon)
         except Exception as e:
-            print(f"Error getting teacher schedule: {e}")
+            logger.error("Error getting teacher schedule: %s", e)
             return []
         finally:
             conn.close()
@@ -1177,7 +1667,7 @@ class WebDatabaseManager:
             events = [dict(row) for row in cursor.fetchall()]
             return events
         except Exception as e:
-            print(f"Error getting class schedule: {e}")
+            logger.error("Error getting class schedule: %s", e)
             return []
         finally:
             conn.close()
@@ -1186,23 +1676,69 @@ class WebDatabaseManager:
         """Delete a schedule event"""
         conn = self.get_connection()
         try:
+            row = conn.execute("SELECT class_id FROM class_schedule WHERE id = ?", (event_id,)).fetchone()
             cursor = conn.execute("DELETE FROM class_schedule WHERE id = ?", (event_id,))
+            if row:
+                versions.bump(conn, self.get_class_organization_id(conn, row['class_id']) if row['class_id'] else None, 'class_schedule')
             conn.commit()
             return cursor.rowcount > 0
         except Exception as e:
-            print(f"Error deleting schedule event: {e}")
+            logger.error("Error deleting schedule event: %s", e)
             conn.rollback()
             return False
         finally:
             conn.close()
 
+    def get_schedule_event(self, event_id):
+        """Get a schedule event row with the teacher of its class"""
+        conn = self.get_connection()
+        try:
+            row = conn.execute("""
+                SELECT cs.*, c.teacher_id
+                FROM class_schedule cs
+                LEFT JOIN classes c ON cs.class_id = c.id
+                WHERE cs.id = ?
+            """, (event_id,)).fetchone()
+            return dict(row) if row else None
+        except Exception as e:
+            logger.error("Error getting schedule event: %s", e)
+            return None
+        finally:
+            conn.close()
+    
+    def cancel_schedule_occurrence(self, event_id, occurrence):
+        """Cancel one occurrence of a recurring event by adding it to the series' exceptions
+
+        Returns the updated recurrence pattern, or None when the event is not
+        recurring or `occurrence` (a datetime) is not one of its occurrences.
+        """
+        conn = self.get_connection()
+        try:
+            row = conn.execute("SELECT class_id, start_time, is_recurring, recurrence_pattern FROM class_schedule WHERE id = ?",
+                               (event_id,)).fetchone()
+            if not row or not row['is_recurring'] or not row['recurrence_pattern']:
+                return None
+            rule = parse_recurrence(row['recurrence_pattern'])
+            if not rule.occurs_at(parse_datetime(row['start_time']), occurrence):
+                return None
+            pattern = str(rule.with_exdate(occurrence))
+            conn.execute("UPDATE class_schedule SET recurrence_pattern = ? WHERE id = ?", (pattern, event_id))
+            versions.bump(conn, self.get_class_organization_id(conn, row['class_id']) if row['class_id'] else None, 'class_schedule')
+            conn.commit()
+            return pattern
+        except Exception as e:
+            logger.error("Error cancelling schedule occurrence: %s", e)
+            conn.rollback()
+            return None
+        finally:
+            conn.close()
+
     def create_organization(self, name, description, about, location, contact_email, contact_phone, website, logo_filename, logo_path, created_by, is_public=True, discussion_privacy='public', organization_tag=None):
         """Create a new organization"""
         conn = self.get_connection()
         try:
             # Check if organization_tag column exists
-            cursor = conn.execute("PRAGMA table_info(organizations)")
-            columns = [row[1] for row in cursor.fetchall()]
+            columns = conn.table_columns('organizations')
             has_tag = 'organization_tag' in columns
             
             if has_tag and organization_tag:
@@ -1219,10 +1755,11 @@ class WebDatabaseManager:
                 """, (name, description, about, location, contact_email, contact_phone, website, logo_filename, logo_path, created_by, is_public, discussion_privacy))
             
             org_id = cursor.lastrowid
+            versions.bump(conn, None, 'organizations')
             conn.commit()
             return org_id
         except Exception as e:
-            print(f"Error creating organization: {e}")
+            logger.error("Error creating organization: %s", e)
             conn.rollback()
             return None
         finally:
@@ -1241,6 +1778,7 @@ class WebDatabaseManager:
         conn.close()
         return organizations
     
+    @query_cache.cached('organizations', 'users')
     def get_organization_by_id(self, org_id):
         """Get organization by ID"""
         conn = self.get_connection()
@@ -1264,6 +1802,7 @@ class WebDatabaseManager:
                 is_public = ?, discussion_privacy = ?, updated_at = CURRENT_TIMESTAMP
             WHERE id = ?
         """, (name, description, about, location, contact_email, contact_phone, website, logo_filename, logo_path, is_public, discussion_privacy, org_id))
+        versions.bump(conn, None, 'organizations')
         conn.commit()
         conn.close()
         return cursor.rowcount > 0
@@ -1301,10 +1840,11 @@ class WebDatabaseManager:
                 INSERT INTO organization_memberships (organization_id, user_id, role)
                 VALUES (?, ?, ?)
             """, (organization_id, user_id, role))
+            versions.bump(conn, None, 'organization_memberships')
             conn.commit()
             return True
         except Exception as e:
-            print(f"Error adding organization member: {e}")
+            logger.error("Error adding organization member: %s", e)
             conn.rollback()
             return False
         finally:
@@ -1351,7 +1891,7 @@ class WebDatabaseManager:
             conn.commit()
             return True
         except Exception as e:
-            print(f"Error creating join request: {e}")
+            logger.error("Error creating join request: %s", e)
             conn.rollback()
             return False
         finally:
@@ -1409,10 +1949,11 @@ class WebDatabaseManager:
                 WHERE id = ?
             """, (reviewer_id, request_id))
             
+            versions.bump(conn, None, 'organization_memberships')
             conn.commit()
             return True
         except Exception as e:
-            print(f"Error approving join request: {e}")
+            logger.error("Error approving join request: %s", e)
             conn.rollback()
             return False
         finally:
@@ -1430,12 +1971,13 @@ class WebDatabaseManager:
             conn.commit()
             return True
         except Exception as e:
-            print(f"Error rejecting join request: {e}")
+            logger.error("Error rejecting join request: %s", e)
             conn.rollback()
             return False
         finally:
             conn.close()
     
+    @query_cache.cached('organization_memberships', 'users')
     def get_organization_members(self, organization_id):
         """Get all members of an organization"""
         conn = self.get_connection()
@@ -1468,12 +2010,13 @@ class WebDatabaseManager:
                 conn.execute("DELETE FROM discussions WHERE organization_id = ?", (organization_id,))
                 conn.execute("DELETE FROM classes WHERE organization_id = ?", (organization_id,))
                 conn.execute("DELETE FROM organizations WHERE id = ?", (organization_id,))
+                versions.bump(conn, organization_id, 'resources', 'discussions', 'classes', 'organizations')
                 conn.commit()
-                print(f"Deleted empty organization {organization_id}")
+                logger.info("Deleted empty organization %s", organization_id)
                 return True
             return False
         except Exception as e:
-            print(f"Error deleting organization: {e}")
+            logger.error("Error deleting organization: %s", e)
             conn.rollback()
             return False
         finally:
@@ -1524,6 +2067,7 @@ class WebDatabaseManager:
         conn.close()
         return dict(result) if result else None
     
+    @tracer.traced('auth.is_organization_member')
     def is_organization_member(self, organization_id, user_id):
         """Check if user is member of organization"""
         conn = self.get_connection()
@@ -1537,6 +2081,57 @@ class WebDatabaseManager:
 
 # Initialize database
 db = WebDatabaseManager()
+if archive is not None:
+    archive.ensure_schema()
+
+class ReportingDatabaseManager(WebDatabaseManager):
+    """WebDatabaseManager for reporting reads - served from the snapshot replica while it is fresh enough"""
+    def __init__(self, db_path=DB_PATH):
+        # The schema is set up by db; the replica is read-only
+        self.db_path = db_path
+    
+    @property
+    def cache_scope(self):
+        """The replica version being read, so cached results never outlive their snapshot"""
+        taken = data_snapshot()
+        return self.db_path if taken is None else f"{snapshot.url}@{taken}"
+    
+    def get_connection(self):
+        """Read-only connection to the replica, or to the live database when there is no fresh snapshot"""
+        if data_snapshot() is None:
+            return super().get_connection()
+        return query_recorder.instrument(snapshot.connect())
+
+reports = ReportingDatabaseManager()
+
+def data_snapshot():
+    """Unix time of the snapshot this request's reporting reads use, or None for the live database"""
+    if snapshot is None:
+        return None
+    if not has_request_context():
+        return snapshot.current()
+    if 'data_snapshot' not in g:
+        g.data_snapshot = snapshot.current()
+    return g.data_snapshot
+
+@app.template_global()
+def data_as_of():
+    """When the reporting figures on this page were taken, or None when they are live"""
+    taken = data_snapshot()
+    return datetime.fromtimestamp(taken).strftime('%Y-%m-%d %H:%M:%S') if taken is not None else None
+
+@app.after_request
+def add_snapshot_headers(response):
+    """Tell clients how stale reporting data is when the request read from the snapshot replica"""
+    if snapshot is not None and 'data_snapshot' in g:
+        taken = g.data_snapshot
+        if taken is None:
+            response.headers['X-Data-Source'] = 'live'
+        else:
+            response.headers['X-Data-Source'] = 'snapshot'
+            response.headers['X-Data-As-Of'] = http_date(taken)
+            response.headers['X-Data-Age'] = str(int(time.time() - taken))
+    return response
 
 # Utility functions
 def allowed_file(filename):
@@ -1568,7 +2163,8 @@ def require_organization_access(f):
         if 'user_id' not in session:
             return redirect(url_for('login'))
         
-        user_organizations = db.get_user_organizations(session['user_id'])
+        with tracer.span('auth.organization_access'):
+            user_organizations = db.get_user_organizations(session['user_id'])
         if not user_organizations:
             flash('You must join an organization to access this feature.', 'warning')
             return redirect(url_for('organizations'))
@@ -1577,6 +2173,59 @@ def require_organization_access(f):
     decorated_function.__name__ = f.__name__
     return decorated_function
 
+def require_admin(f):
+    """Decorator restricting an API route to admin users"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            return jsonify({'error': 'Not authenticated'}), 401
+        if session.get('user_type') != 'admin':
+            return jsonify({'error': 'Admin access required'}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
+def conditional_get(*tables, use_session_org=False):
+    """Decorator answering If-None-Match with 304 from the data version counters
+    
+    The ETag covers the user, their organization, the query string and the
+    change counter of every table the response reads, so a match is detected
+    without running the handler's queries.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if 'user_id' not in session:
+                return f(*args, **kwargs)
+            
+            with tracer.span('cache.etag'):
+                if all(table in versions.GLOBAL_TABLES for table in tables):
+                    org_id = None
+                elif use_session_org:
+                    org_id = session.get('current_org_id')
+                else:
+                    org = db.get_user_current_organization(session['user_id'])
+                    org_id = org['id'] if org else None
+                
+                table_versions = db.get_data_versions(org_id, tables)
+                etag = versions.make_etag(table_versions, session['user_id'], session.get('user_type'),
+                                          org_id, request.full_path)
+            
+            if request.if_none_match.contains_weak(etag):
+                response = app.response_class(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            
+            response.set_etag(etag)
+            modified = versions.last_modified(table_versions)
+            if modified:
+                response.last_modified = modified
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return decorated_function
+    return decorator
+
 # Routes
 @app.route('/', methods=['GET', 'POST'])
 def index():
@@ -1652,36 +2301,23 @@ def register():
 @app.route('/uploads/<path:filename>')
 def serve_upload(filename):
     """Serve uploaded files (images, resources, etc.)"""
-    return send_from_directory('uploads', filename)
+    with tracer.span('file.send', path=filename):
+        if not UUID_FILENAME.match(os.path.basename(filename)):
+            return send_from_directory('uploads', filename)
+        response = send_from_directory('uploads', filename, max_age=31536000)
+    response.cache_control.immutable = True
+    return response
 
-@app.route('/dashboard')
-@require_organization_access
-def dashboard():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
-    user_type = session['user_type']
-    user_id = session['user_id']
-    
-    # Get organization-specific data (always fetch from DB to ensure accuracy)
-    current_org = db.get_user_current_organization(user_id)
-    current_org_id = current_org['id'] if current_org else None
-    current_org_name = current_org['name'] if current_org else 'No Organization'
-    
-    # Update session with current organization data
-    if current_org:
-        session['current_org_id'] = current_org['id']
-        session['current_org_role'] = current_org['role']
-        session['current_org_name'] = current_org['name']
-    
+def build_dashboard_stats(user_type, user_id, current_org_id, current_org_name):
+    """Collect the dashboard counters for a user in their current organization (from the reporting snapshot)"""
     if user_type == 'teacher':
         # Get classes for this teacher in the current organization
-        classes = db.get_teacher_classes(user_id)
+        classes = reports.get_teacher_classes(user_id)
         # Filter classes by organization (if classes have organization_id field)
         org_classes = [c for c in classes if c.get('organization_id') == current_org_id] if current_org_id else classes
         
         # Get more useful stats
-        total_students = sum(len(db.get_class_students(c['id'])) for c in org_classes)
+        total_students = sum(len(reports.get_class_students(c['id'])) for c in org_classes)
         
         # Group classes by subject for better insights
         subjects = {}
@@ -1692,14 +2328,15 @@ def dashboard():
             subjects[subject] += 1
         
         # Get resources count
-        resources_count = len(db.get_resources_by_organization(current_org_id)) if current_org_id else 0
+        resources_count = len(reports.get_resources_by_organization(current_org_id)) if current_org_id else 0
         
         # Get events count
-        events = db.get_teacher_schedule(user_id) if user_type == 'teacher' else []
-        events_count = len(events)
+        events = reports.get_teacher_schedule(user_id) if user_type == 'teacher' else []
+        # A recurring event counts once, however many upcoming occurrences it has
+        events_count = len({event['id'] for event in events})
         
         # Get discussions count
-        discussions = db.get_discussions_by_organization(current_org_id) if current_org_id else []
+        discussions = reports.get_discussions_by_organization(current_org_id) if current_org_id else []
         discussions_count = len(discussions)
         
         stats = {
@@ -1714,18 +2351,18 @@ def dashboard():
         }
     elif user_type == 'admin':
         # Get organization-specific data for admin
-        org_members = db.get_organization_members(current_org_id) if current_org_id else []
+        org_members = reports.get_organization_members(current_org_id) if current_org_id else []
         teachers_in_org = [m for m in org_members if m['user_type'] == 'teacher']
         students_in_org = [m for m in org_members if m['user_type'] == 'student']
         
         # Get resources count
-        resources_count = len(db.get_resources_by_organization(current_org_id)) if current_org_id else 0
+        resources_count = len(reports.get_resources_by_organization(current_org_id)) if current_org_id else 0
         
         # Get events count (admin can see all events in organization)
         events_count = 0  # We'll implement this later if needed
         
         # Get discussions count
-        discussions = db.get_discussions_by_organization(current_org_id) if current_org_id else []
+        discussions = reports.get_discussions_by_organization(current_org_id) if current_org_id else []
         discussions_count = len(discussions)
         
         stats = {
@@ -1743,7 +2380,32 @@ def dashboard():
             'organization_name': current_org_name
         }
     
-    return render_template('dashboard.html', user_type=user_type, stats=stats)
+    return stats
+
+@app.route('/dashboard')
+@require_organization_access
+def dashboard():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    user_type = session['user_type']
+    user_id = session['user_id']
+    
+    # Get organization-specific data (always fetch from DB to ensure accuracy)
+    current_org = db.get_user_current_organization(user_id)
+    current_org_id = current_org['id'] if current_org else None
+    current_org_name = current_org['name'] if current_org else 'No Organization'
+    
+    # Update session with current organization data
+    if current_org:
+        session['current_org_id'] = current_org['id']
+        session['current_org_role'] = current_org['role']
+        session['current_org_name'] = current_org['name']
+    
+    # Stats are only computed when the cached dashboard fragment is stale
+    stats = Deferred(build_dashboard_stats, user_type, user_id, current_org_id, current_org_name)
+    
+    return render_template('dashboard.html', user_type=user_type, stats=stats, organization_name=current_org_name)
 
 @app.route('/classes')
 @require_organization_access
@@ -1792,8 +2454,9 @@ def resources():
     subject_filter = request.args.get('subject')
     type_filter = request.args.get('type')
     
-    # Get resources with filters
-    resources = db.get_resources_by_organization(
+    # Get resources with filters (loaded only if the cached resource grid is stale)
+    resources = Deferred(
+        db.get_resources_by_organization,
         current_org_id, 
         grade_level=int(grade_filter) if grade_filter else None,
         subject_id=int(subject_filter) if subject_filter else None,
@@ -1864,7 +2527,7 @@ def api_create_resource():
                     os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], 'resources'), exist_ok=True)
                     
                     # Save file
-                    file.save(file_path)
+                    save_upload(file, file_path)
                     file_size = os.path.getsize(file_path)
             
             # Create resource
@@ -1893,7 +2556,7 @@ def api_create_resource():
                 return jsonify({'error': 'Failed to create resource'}), 500
                 
     except Exception as e:
-        print(f"Error creating resource: {e}")
+        logger.error("Error creating resource: %s", e)
         return jsonify({'error': f'Failed to create resource: {str(e)}'}), 500
     
     return jsonify({'error': 'Invalid request'}), 400
@@ -1911,7 +2574,7 @@ def api_delete_resource(resource_id):
         else:
             return jsonify({'error': 'Failed to delete resource'}), 500
     except Exception as e:
-        print(f"Error deleting resource: {e}")
+        logger.error("Error deleting resource: %s", e)
         return jsonify({'error': f'Failed to delete resource: {str(e)}'}), 500
 
 @app.route('/global-discussions')
@@ -1949,12 +2612,8 @@ def api_create_global_discussion():
         category = data.get('category', 'general')
         tags = data.get('tags', '')
         
-        # Debug logging
-        print(f"=== CREATING GLOBAL DISCUSSION ===")
-        print(f"Received title: '{title}'")
-        print(f"Received content length: {len(content) if content else 0}")
-        print(f"Received content preview: {content[:100] if content and len(content) > 100 else content}")
-        print("=" * 50)
+        tracer.annotate(title_length=len(title) if title else 0, content_length=len(content) if content else 0,
+                        category=category)
         
         if not title or not content:
             return jsonify({'error': 'Title and content are required'}), 400
@@ -1978,7 +2637,7 @@ def api_create_global_discussion():
             return jsonify({'error': 'Failed to create discussion'}), 500
             
     except Exception as e:
-        print(f"Error creating global discussion: {e}")
+        logger.error("Error creating global discussion: %s", e)
         return jsonify({'error': f'Failed to create discussion: {str(e)}'}), 500
 
 @app.route('/api/add_global_reply', methods=['POST'])
@@ -2012,7 +2671,7 @@ def api_add_global_reply():
             return jsonify({'error': 'Failed to add reply'}), 500
             
     except Exception as e:
-        print(f"Error adding global reply: {e}")
+        logger.error("Error adding global reply: %s", e)
         return jsonify({'error': f'Failed to add reply: {str(e)}'}), 500
 
 @app.route('/schedule')
@@ -2111,6 +2770,7 @@ def api_register():
         return jsonify({'success': False, 'error': 'Username or email already exists'}), 400
 
 @app.route('/api/get_classes', methods=['GET'])
+@conditional_get('classes', 'class_students', 'subjects')
 def api_get_classes():
     """Get classes for user's organization (students only see enrolled classes)"""
     if 'user_id' not in session:
@@ -2145,10 +2805,7 @@ def api_get_classes():
             ORDER BY c.name
         """, (org['id'],))
     
-    classes = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    
-    return jsonify({'success': True, 'classes': classes})
+    return stream_json(conn, cursor, 'classes')
 
 @app.route('/api/get_students', methods=['GET'])
 def api_get_students():
@@ -2173,9 +2830,7 @@ def api_get_students():
         ORDER BY u.first_name, u.last_name
     """, (org['id'],))
     
-    students = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return jsonify({'success': True, 'students': students})
+    return stream_json(conn, cursor, 'students')
 
 @app.route('/api/update_student', methods=['POST'])
 def api_update_student():
@@ -2209,6 +2864,7 @@ def api_update_student():
             SET first_name = ?, last_name = ?, email = ?, phone_number = ?, updated_at = CURRENT_TIMESTAMP
             WHERE id = ? AND user_type = 'student'
         """, (first_name, last_name, email, phone_number, student_id))
+        versions.bump(conn, None, 'users')
         conn.commit()
         conn.close()
         return jsonify({'success': True, 'message': 'Student updated successfully'})
@@ -2225,9 +2881,9 @@ def api_mark_attendance():
     # Check if user is a student (students cannot mark attendance)
     conn = db.get_connection()
     user = conn.execute("SELECT user_type FROM users WHERE id = ?", (session['user_id'],)).fetchone()
+    conn.close()
     
     if user and user['user_type'] == 'student':
-        conn.close()
         return jsonify({'error': 'Students cannot mark attendance'}), 403
     
     data = request.json
@@ -2235,8 +2891,10 @@ def api_mark_attendance():
     status = data.get('status', 'present')
     date = data.get('date', datetime.now().strftime('%Y-%m-%d'))
     notes = data.get('notes', '')
+    marked_by = session['user_id']
+    organization_id = session.get('current_org_id')
     
-    try:
+    def mark_attendance(conn):
         # Check if attendance already exists for this student today
         cursor = conn.execute("""
             SELECT id FROM attendance 
@@ -2250,19 +2908,20 @@ def api_mark_attendance():
                 UPDATE attendance 
                 SET status = ?, notes = ?, marked_by = ?
                 WHERE student_id = ? AND date = ?
-            """, (status, notes, session['user_id'], student_id, date))
+            """, (status, notes, marked_by, student_id, date))
         else:
             # Create new attendance record
             conn.execute("""
                 INSERT INTO attendance (student_id, organization_id, date, status, marked_by, notes)
                 VALUES (?, ?, ?, ?, ?, ?)
-            """, (student_id, session.get('current_org_id'), date, status, session['user_id'], notes))
-        
-        conn.commit()
-        conn.close()
+            """, (student_id, organization_id, date, status, marked_by, notes))
+    
+    try:
+        if archive is not None and archive.covers(date):
+            archive.restore('attendance', 'student_id = ? AND date = ?', (student_id, date))
+        db.write(mark_attendance)
         return jsonify({'success': True, 'message': 'Attendance marked successfully'})
     except Exception as e:
-        conn.close()
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/get_attendance', methods=['GET'])
@@ -2275,51 +2934,53 @@ def api_get_attendance():
     student_id = request.args.get('student_id')
     
     conn = db.get_connection()
+    attendance = table_source(conn, 'attendance', date)
     
     if student_id:
         # Get attendance for specific student
-        cursor = conn.execute("""
+        cursor = conn.execute(f"""
             SELECT a.*, u.first_name, u.last_name 
-            FROM attendance a
+            FROM {attendance} a
             JOIN users u ON a.student_id = u.id
             WHERE a.student_id = ? AND a.date = ?
         """, (student_id, date))
     else:
         # Get all attendance for date
-        cursor = conn.execute("""
+        cursor = conn.execute(f"""
             SELECT a.*, u.first_name, u.last_name 
-            FROM attendance a
+            FROM {attendance} a
             JOIN users u ON a.student_id = u.id
             WHERE a.date = ?
             ORDER BY u.first_name, u.last_name
         """, (date,))
     
-    attendance = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    
-    return jsonify({'success': True, 'attendance': attendance})
+    return stream_json(conn, cursor, 'attendance')
 
 @app.route('/api/get_attendance_percentage', methods=['GET'])
 def api_get_attendance_percentage():
-    """Get attendance percentage for all students"""
+    """Get attendance percentage for all students, optionally between start_date and end_date"""
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
     
-    conn = db.get_connection()
+    start_date = request.args.get('start_date') or None
+    end_date = request.args.get('end_date') or None
+    
+    conn = reports.get_connection()
     try:
         # Get attendance percentage for each student
-        cursor = conn.execute("""
+        cursor = conn.execute(f"""
             SELECT 
                 u.id as student_id,
                 COUNT(CASE WHEN a.status = 'present' THEN 1 END) as present_count,
                 COUNT(a.id) as total_count,
-                ROUND(CAST(COUNT(CASE WHEN a.status = 'present' THEN 1 END) AS FLOAT) / 
-                      NULLIF(COUNT(a.id), 0) * 100, 1) as percentage
+                ROUND(100.0 * COUNT(CASE WHEN a.status = 'present' THEN 1 END) / 
+                      NULLIF(COUNT(a.id), 0), 1) as percentage
             FROM users u
-            LEFT JOIN attendance a ON u.id = a.student_id
+            LEFT JOIN {table_source(conn, 'attendance', start_date)} a ON u.id = a.student_id
+                AND (? IS NULL OR a.date >= ?) AND (? IS NULL OR a.date <= ?)
             WHERE u.user_type = 'student'
             GROUP BY u.id
-        """)
+        """, (start_date, start_date, end_date, end_date))
         
         percentages = {}
         for row in cursor.fetchall():
@@ -2333,10 +2994,11 @@ def api_get_attendance_percentage():
         return jsonify({'success': True, 'percentages': percentages})
     except Exception as e:
         conn.close()
-        print(f"Error getting attendance percentage: {e}")
+        logger.error("Error getting attendance percentage: %s", e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/get_subjects', methods=['GET'])
+@conditional_get('subjects')
 def api_get_subjects():
     """Get all subjects"""
     if 'user_id' not in session:
@@ -2346,6 +3008,7 @@ def api_get_subjects():
     return jsonify({'success': True, 'subjects': subjects})
 
 @app.route('/api/get_organizations', methods=['GET'])
+@conditional_get('organizations', 'organization_memberships', 'users')
 def api_get_organizations():
     """Get all organizations with optional search"""
     if 'user_id' not in session:
@@ -2378,10 +3041,11 @@ def api_get_organizations():
         })
     except Exception as e:
         conn.close()
-        print(f"Error fetching organizations: {e}")
+        logger.error("Error fetching organizations: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/get_resources', methods=['GET'])
+@conditional_get('resources', 'classes', 'class_students', 'subjects', 'users')
 def api_get_resources():
     """Get resources for current organization with optional homework filter"""
     if 'user_id' not in session:
@@ -2402,8 +3066,7 @@ def api_get_resources():
     conn = db.get_connection()
     try:
         # Check which columns exist
-        cursor = conn.execute("PRAGMA table_info(resources)")
-        columns = [row[1] for row in cursor.fetchall()]
+        columns = conn.table_columns('resources')
         has_category = 'resource_category' in columns
         has_org_id = 'organization_id' in columns
         has_subject_id = 'subject_id' in columns
@@ -2467,27 +3130,25 @@ def api_get_resources():
                 query = f"{select_clause} ORDER BY r.created_at DESC"
                 cursor = conn.execute(query)
         
-        resources = [dict(row) for row in cursor.fetchall()]
-        
         # Add default values for missing fields
-        for resource in resources:
-            if not has_category:
-                resource['resource_category'] = 'other'
-            if not has_org_id:
-                resource['organization_id'] = None
-            if not has_subject_id:
-                resource['subject_id'] = None
-            if not has_uploaded_by:
-                resource['uploaded_by'] = session.get('user_id')
-        
-        conn.close()
-        return jsonify({'success': True, 'resources': resources})
+        defaults = {}
+        if not has_category:
+            defaults['resource_category'] = 'other'
+        if not has_org_id:
+            defaults['organization_id'] = None
+        if not has_subject_id:
+            defaults['subject_id'] = None
+        if not has_uploaded_by:
+            defaults['uploaded_by'] = session.get('user_id')
+        
+        return stream_json(conn, cursor, 'resources', defaults=defaults)
     except Exception as e:
         conn.close()
-        print(f"Error in get_resources: {e}")
+        logger.error("Error in get_resources: %s", e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/get_discussions', methods=['GET'])
+@conditional_get('discussions', 'discussion_replies', 'users')
 def api_get_discussions():
     """Get discussions for current organization"""
     if 'user_id' not in session:
@@ -2565,29 +3226,15 @@ def api_update_profile():
             filename = f"profile_{session['user_id']}_{timestamp}_{filename}"
             filepath = os.path.join('uploads', 'profiles', filename)
             os.makedirs(os.path.dirname(filepath), exist_ok=True)
-            file.save(filepath)
+            save_upload(file, filepath)
             profile_photo_path = filepath
     
     conn = db.get_connection()
     try:
         # Ensure columns exist
-        try:
-            conn.execute("SELECT phone_number, bio, profile_photo_path FROM users LIMIT 1")
-        except:
-            # Add missing columns
-            try:
-                conn.execute("ALTER TABLE users ADD COLUMN phone_number TEXT")
-            except:
-                pass
-            try:
-                conn.execute("ALTER TABLE users ADD COLUMN bio TEXT")
-            except:
-                pass
-            try:
-                conn.execute("ALTER TABLE users ADD COLUMN profile_photo_path TEXT")
-            except:
-                pass
-            conn.commit()
+        conn.add_column('users', 'phone_number TEXT')
+        conn.add_column('users', 'bio TEXT')
+        conn.add_column('users', 'profile_photo_path TEXT')
         
         updates = []
         params = []
@@ -2618,6 +3265,7 @@ def api_update_profile():
             params.append(session['user_id'])
             query = f"UPDATE users SET {', '.join(updates)} WHERE id = ?"
             conn.execute(query, params)
+            versions.bump(conn, None, 'users')
             conn.commit()
         
         conn.close()
@@ -2628,7 +3276,7 @@ def api_update_profile():
         })
     except Exception as e:
         conn.close()
-        print(f"Error updating profile: {e}")
+        logger.error("Error updating profile: %s", e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/create_student', methods=['POST'])
@@ -2671,9 +3319,47 @@ def api_get_schedule():
     if session['user_type'] != 'teacher':
         return jsonify({'error': 'Only teachers can access schedule'}), 403
     
-    events = db.get_teacher_schedule(session['user_id'])
+    # Optional ?start=&end= window (dates or datetimes); recurring events are expanded within it
+    start_date = request.args.get('start')
+    end_date = request.args.get('end')
+    try:
+        for value in (start_date, end_date):
+            if value:
+                parse_datetime(value)
+    except ValueError:
+        return jsonify({'error': 'start and end must be ISO dates or datetimes'}), 400
+    
+    events = db.get_teacher_schedule(session['user_id'], start_date, end_date)
     return jsonify({'success': True, 'events': events})
 
+@app.route('/api/schedule_event/<int:event_id>/exceptions', methods=['POST'])
+def api_cancel_schedule_occurrence(event_id):
+    """Cancel one occurrence of a recurring event (teachers only)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    if session['user_type'] != 'teacher':
+        return jsonify({'error': 'Only teachers can change the schedule'}), 403
+    
+    data = request.get_json() or {}
+    try:
+        occurrence = parse_datetime(data['occurrence'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'occurrence (the start time of the occurrence to cancel) is required'}), 400
+    
+    event = db.get_schedule_event(event_id)
+    if not event:
+        return jsonify({'error': 'Event not found'}), 404
+    if session['user_id'] not in (event['created_by'], event['teacher_id']):
+        return jsonify({'error': 'Permission denied'}), 403
+    if not event['is_recurring']:
+        return jsonify({'error': 'Event is not recurring'}), 400
+    
+    pattern = db.cancel_schedule_occurrence(event_id, occurrence)
+    if pattern is None:
+        return jsonify({'error': 'No such occurrence in this series'}), 400
+    return jsonify({'success': True, 'recurrence_pattern': pattern})
+
 # API Routes
 @app.route('/api/create_class', methods=['POST'])
 def api_create_class():
@@ -2739,6 +3425,49 @@ def api_unenroll_student():
     else:
         return jsonify({'success': False, 'error': 'Failed to remove student'}), 400
 
+@app.route('/api/sync_class_roster', methods=['POST'])
+def api_sync_class_roster():
+    """Set a class's enrolled students to the given list, enrolling and removing the difference"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    if session['user_type'] not in ['teacher', 'admin']:
+        return jsonify({'error': 'Only teachers and admins can change class rosters'}), 403
+
+    data = request.get_json() or {}
+    class_id = data.get('class_id')
+    student_ids = data.get('student_ids')
+
+    if not class_id or not isinstance(student_ids, list):
+        return jsonify({'error': 'class_id and a student_ids list are required'}), 400
+    try:
+        student_ids = [int(student_id) for student_id in student_ids]
+    except (TypeError, ValueError):
+        return jsonify({'error': 'student_ids must be integers'}), 400
+
+    conn = db.get_connection()
+    try:
+        cls = conn.execute("SELECT teacher_id, organization_id FROM classes WHERE id = ?", (class_id,)).fetchone()
+    finally:
+        conn.close()
+    if cls is None:
+        return jsonify({'error': 'Class not found'}), 404
+    if session['user_type'] == 'teacher' and cls['teacher_id'] != session['user_id']:
+        return jsonify({'error': 'You can only change rosters of your own classes'}), 403
+    if session['user_type'] == 'admin' and (cls['organization_id'] is None
+                                            or cls['organization_id'] != session.get('current_org_id')):
+        return jsonify({'error': 'You can only change rosters of classes in your current organization'}), 403
+
+    try:
+        diff = db.sync_class_roster(class_id, student_ids)
+    except Exception as e:
+        logger.error("Error syncing class roster: %s", e)
+        return jsonify({'success': False, 'error': str(e)}), 500
+    if 'invalid' in diff:
+        return jsonify({'success': False, 'error': "Not students of the class's organization",
+                        'invalid': diff['invalid']}), 400
+    return jsonify({'success': True, 'class_id': class_id, **diff})
+
 @app.route('/api/get_class_students/<int:class_id>', methods=['GET'])
 def api_get_class_students(class_id):
     """Get all students enrolled in a class"""
@@ -2782,20 +3511,24 @@ def discussions():
     user_id = session['user_id']
     current_org_id = session.get('current_org_id')
     
-    # Get organization discussions
-    # For now, get all discussions since organization_id column might not exist
-    try:
-        org_discussions = db.get_discussions_by_organization(current_org_id) if current_org_id else []
-    except Exception as e:
-        print(f"Error getting discussions by organization: {e}")
-        # Fallback: get all discussions
-        org_discussions = db.get_all_discussions()
-    
-    for discussion in org_discussions:
-        discussion['attachments'] = db.get_discussion_attachments(discussion['id'])
+    def load_discussions():
+        # Get organization discussions
+        # For now, get all discussions since organization_id column might not exist
+        try:
+            org_discussions = db.get_discussions_by_organization(current_org_id) if current_org_id else []
+        except Exception as e:
+            logger.error("Error getting discussions by organization: %s", e)
+            # Fallback: get all discussions
+            org_discussions = db.get_all_discussions()
+        
+        attachments = db.get_attachments_for_discussions([d['id'] for d in org_discussions])
+        for discussion in org_discussions:
+            discussion['attachments'] = attachments[discussion['id']]
+        return org_discussions
     
+    # Discussions are only loaded when the cached discussion cards are stale
     return render_template('discussions.html', 
-                         discussions=org_discussions,
+                         discussions=Deferred(load_discussions),
                          user_type=user_type,
                          get_file_icon=get_file_icon)
 
@@ -2845,7 +3578,7 @@ def api_create_discussion():
                         os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
                         
                         # Save file
-                        file.save(file_path)
+                        save_upload(file, file_path)
                         
                         # Get file info
                         file_size = os.path.getsize(file_path)
@@ -2915,7 +3648,7 @@ def api_add_reply():
                         os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
                         
                         # Save file
-                        file.save(file_path)
+                        save_upload(file, file_path)
                         
                         # Get file info
                         file_size = os.path.getsize(file_path)
@@ -2958,7 +3691,7 @@ def organizations():
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
-    organizations = db.get_all_organizations()
+    organizations = Deferred(db.get_all_organizations)
     user_organizations = db.get_user_organizations(session['user_id'])
     
     return render_template('organizations.html', 
@@ -3040,6 +3773,7 @@ def api_create_organization():
                     DELETE FROM organization_memberships 
                     WHERE user_id = ?
                 """, (session['user_id'],))
+                versions.bump(conn, None, 'organization_memberships')
                 conn.commit()
                 
                 # Add creator as owner
@@ -3096,7 +3830,7 @@ def api_create_organization():
                 os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], 'logos'), exist_ok=True)
                 
                 # Save logo
-                logo_file.save(logo_path)
+                save_upload(logo_file, logo_path)
         
         # Create organization
         try:
@@ -3113,6 +3847,7 @@ def api_create_organization():
                     DELETE FROM organization_memberships 
                     WHERE user_id = ?
                 """, (session['user_id'],))
+                versions.bump(conn, None, 'organization_memberships')
                 conn.commit()
                 
                 # Add creator as owner
@@ -3139,7 +3874,7 @@ def api_create_organization():
             else:
                 return jsonify({'error': 'Failed to create organization'}), 500
         except Exception as e:
-            print(f"Error in API create_organization: {e}")
+            logger.error("Error in API create_organization: %s", e)
             return jsonify({'error': f'Failed to create organization: {str(e)}'}), 500
     
     return jsonify({'error': 'Invalid request'}), 400
@@ -3193,7 +3928,7 @@ def api_update_organization():
             filename = f"org_{org_id}_logo_{timestamp}_{filename}"
             filepath = os.path.join('uploads', 'logos', filename)
             os.makedirs(os.path.dirname(filepath), exist_ok=True)
-            file.save(filepath)
+            save_upload(file, filepath)
             updates.append("logo_path = ?")
             params.append(filepath)
     
@@ -3206,7 +3941,7 @@ def api_update_organization():
             filename = f"org_{org_id}_banner_{timestamp}_{filename}"
             filepath = os.path.join('uploads', 'banners', filename)
             os.makedirs(os.path.dirname(filepath), exist_ok=True)
-            file.save(filepath)
+            save_upload(file, filepath)
             updates.append("banner_path = ?")
             params.append(filepath)
     
@@ -3216,6 +3951,7 @@ def api_update_organization():
         
         query = f"UPDATE organizations SET {', '.join(updates)} WHERE id = ?"
         conn.execute(query, params)
+        versions.bump(conn, None, 'organizations')
         conn.commit()
     
     conn.close()
@@ -3240,7 +3976,7 @@ def api_get_organization_members(org_id):
         return jsonify({'error': 'Not a member of this organization'}), 403
     
     # Get all members
-    members = conn.execute("""
+    cursor = conn.execute("""
         SELECT u.id, u.username, u.first_name, u.last_name, u.email, 
                u.user_type, u.profile_photo_path, om.role, om.joined_at
         FROM users u
@@ -3253,14 +3989,9 @@ def api_get_organization_members(org_id):
                 WHEN 'member' THEN 3
             END,
             om.joined_at
-    """, (org_id,)).fetchall()
+    """, (org_id,))
     
-    conn.close()
-    return jsonify({
-        'success': True,
-        'members': [dict(m) for m in members],
-        'user_role': membership['role']
-    })
+    return stream_json(conn, cursor, 'members', extra={'user_role': membership['role']})
 
 @app.route('/api/update_member_role', methods=['POST'])
 def api_update_member_role():
@@ -3313,6 +4044,7 @@ def api_update_member_role():
         SET role = ? 
         WHERE organization_id = ? AND user_id = ?
     """, (new_role, org_id, member_id))
+    versions.bump(conn, None, 'organization_memberships')
     conn.commit()
     conn.close()
     
@@ -3368,6 +4100,7 @@ def api_remove_member():
         DELETE FROM organization_memberships 
         WHERE organization_id = ? AND user_id = ?
     """, (org_id, member_id))
+    versions.bump(conn, None, 'organization_memberships')
     conn.commit()
     conn.close()
     
@@ -3492,6 +4225,20 @@ def api_create_schedule_event():
     if not class_id:
         return jsonify({'error': 'Class is required for schedule events'}), 400
     
+    # Optional RRULE-style recurrence ('FREQ=WEEKLY;BYDAY=MO,WE;UNTIL=20261218') and cancelled occurrences
+    recurrence_pattern = None
+    if data.get('recurrence'):
+        try:
+            rule = parse_recurrence(data['recurrence'])
+            for occurrence in data.get('exdates') or []:
+                rule = rule.with_exdate(parse_datetime(occurrence))
+            if parse_datetime(end_time) < parse_datetime(start_time):
+                return jsonify({'error': 'End time must not be before start time'}), 400
+            rule.validate(parse_datetime(start_time))
+            recurrence_pattern = str(rule)
+        except (TypeError, ValueError, OverflowError) as e:
+            return jsonify({'error': f'Invalid recurrence: {e}'}), 400
+    
     try:
         # Create schedule event
         event_id = db.create_schedule_event(
@@ -3500,7 +4247,8 @@ def api_create_schedule_event():
             description=description,
             start_time=start_time,
             end_time=end_time,
-            created_by=session['user_id']
+            created_by=session['user_id'],
+            recurrence_pattern=recurrence_pattern
         )
         
         if event_id:
@@ -3509,7 +4257,7 @@ def api_create_schedule_event():
             return jsonify({'error': 'Failed to create event'}), 500
             
     except Exception as e:
-        print(f"Error creating schedule event: {e}")
+        logger.error("Error creating schedule event: %s", e)
         return jsonify({'error': f'Failed to create event: {str(e)}'}), 500
 
 @app.route('/api/join_organization/<int:org_id>', methods=['POST'])
@@ -3601,7 +4349,8 @@ def download_file(filename):
     
     file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
     if os.path.exists(file_path):
-        return send_file(file_path, as_attachment=True)
+        with tracer.span('file.send', path=file_path):
+            return send_file(file_path, as_attachment=True)
     else:
         return "File not found", 404
 
@@ -3610,10 +4359,145 @@ def download_apk():
     """Download the APK file - no auth required for easier distribution"""
     apk_path = os.path.join(os.path.dirname(__file__), 'flutter/teacher/build/app/outputs/flutter-apk/app-release.apk')
     if os.path.exists(apk_path):
-        return send_file(apk_path, as_attachment=True, download_name='staffroom.apk', mimetype='application/vnd.android.package-archive')
+        with tracer.span('file.send', path=apk_path):
+            return send_file(apk_path, as_attachment=True, download_name='staffroom.apk', mimetype='application/vnd.android.package-archive')
     else:
         return "APK not found. Please build the APK first.", 404
 
+@app.route('/api/admin/traces', methods=['GET'])
+@require_admin
+def api_get_traces():
+    """Recent request traces as JSON, or in Chrome trace format with ?format=chrome"""
+    traces = tracer.traces(request.args.get('limit', type=int))
+    if request.args.get('format') == 'chrome':
+        return jsonify(tracer.export_chrome(traces))
+    return jsonify({'success': True, **tracer.export_json(traces)})
+
+@app.route('/api/admin/traces/<trace_id>', methods=['GET'])
+@require_admin
+def api_get_trace(trace_id):
+    """One request trace as JSON, or in Chrome trace format with ?format=chrome"""
+    trace = tracer.get(trace_id)
+    if trace is None:
+        return jsonify({'error': 'Trace not found'}), 404
+    if request.args.get('format') == 'chrome':
+        return jsonify(tracer.export_chrome([trace]))
+    return jsonify({'success': True, 'trace': trace.to_dict()})
+
+@app.route('/api/admin/profiler', methods=['GET', 'POST', 'DELETE'])
+@require_admin
+def api_profiler():
+    """Arm the profiler for the next N matching requests on this worker, show its state or disarm it"""
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        try:
+            session_id = profiler.arm(
+                int(data.get('count', 1)),
+                mode=data.get('mode', 'cprofile'),
+                endpoint=data.get('endpoint') or None,
+                path=data.get('path') or None,
+                user_id=int(data['user_id']) if data.get('user_id') not in (None, '') else None,
+                interval_ms=float(data.get('interval_ms', 5))
+            )
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'success': True, 'session_id': session_id, **profiler.status()})
+    if request.method == 'DELETE':
+        profiler.disarm()
+    return jsonify({'success': True, **profiler.status()})
+
+@app.route('/api/admin/profiles', methods=['GET'])
+@require_admin
+def api_get_profiling_sessions():
+    """Stored profiling sessions and the requests each captured"""
+    return jsonify({'success': True, 'sessions': profiler.sessions()})
+
+@app.route('/api/admin/profiles/<session_id>', methods=['GET'])
+@require_admin
+def api_get_profiling_session(session_id):
+    """A profiling session as ?format=text (default), collapsed (flamegraph stacks) or pstats"""
+    output = request.args.get('format', 'text')
+    if output == 'pstats':
+        path = profiler.pstats_path(session_id)
+        if path is None:
+            return jsonify({'error': 'No pstats data for this session'}), 404
+        return send_file(os.path.abspath(path), as_attachment=True, download_name=f'{session_id}.prof',
+                         mimetype='application/octet-stream', max_age=0)
+    if output == 'collapsed':
+        stacks = profiler.collapsed(session_id)
+        if stacks is None:
+            return jsonify({'error': 'Profile not found'}), 404
+        body = ''.join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+        return Response(body, mimetype='text/plain')
+    try:
+        report = profiler.text_report(session_id, sort=request.args.get('sort', 'cumulative'))
+    except KeyError:
+        return jsonify({'error': 'Unknown sort key'}), 400
+    if report is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    return Response(report, mimetype='text/plain')
+
+@app.route('/api/admin/memory', methods=['GET'])
+@require_admin
+def api_memory_report():
+    """Per-route peak/retained allocations, top allocation sites and growth since a snapshot (this worker)"""
+    if not memory_tracker.enabled:
+        return jsonify({'error': 'Memory tracking is disabled (set MEMORY_TRACKING=1)'}), 404
+    try:
+        report = memory_tracker.report(limit=request.args.get('limit', 20, type=int),
+                                       since=request.args.get('since', type=int))
+    except IndexError:
+        return jsonify({'error': 'No such snapshot'}), 400
+    return jsonify({'success': True, **report})
+
+@app.route('/api/admin/memory/snapshot', methods=['POST'])
+@require_admin
+def api_memory_snapshot():
+    """Record an allocation snapshot now, to diff later ones against"""
+    if not memory_tracker.enabled:
+        return jsonify({'error': 'Memory tracking is disabled (set MEMORY_TRACKING=1)'}), 404
+    memory_tracker.take_snapshot()
+    return jsonify({'success': True, 'snapshots': memory_tracker.snapshots()})
+
+@app.route('/api/admin/render_metrics', methods=['GET'])
+@require_admin
+def api_render_metrics():
+    """Template render times and fragment cache hit ratios for this worker"""
+    return jsonify({'success': True, **fragment_cache.stats()})
+
+@app.route('/api/admin/snapshot', methods=['GET', 'POST'])
+@require_admin
+def api_snapshot():
+    """Reporting snapshot status, or refresh it now with a POST"""
+    if snapshot is None:
+        return jsonify({'error': 'The reporting snapshot is disabled (set SNAPSHOT=1)'}), 404
+    if request.method != 'POST':
+        return jsonify({'success': True, **snapshot.stats()})
+    try:
+        refreshed = snapshot.refresh()
+    except Exception as e:
+        logger.error("Error refreshing reporting snapshot: %s", e)
+        return jsonify({'error': str(e)}), 500
+    return jsonify({'success': True, 'refreshed': refreshed, **snapshot.stats()})
+
+@app.route('/api/admin/archive', methods=['GET', 'POST'])
+@require_admin
+def api_archive():
+    """Archive status, or move rows past the academic-year cutoff into the archive now with a POST"""
+    if archive is None:
+        return jsonify({'error': 'Archival is disabled (set ARCHIVE=1)'}), 404
+    if request.method != 'POST':
+        return jsonify({'success': True, **archive.stats()})
+    try:
+        moved = archive.run()
+    except Exception as e:
+        logger.error("Error archiving old rows: %s", e)
+        return jsonify({'error': str(e)}), 500
+    if moved is None:
+        return jsonify({'error': 'Another worker is archiving'}), 409
+    return jsonify({'success': True, 'moved': moved, **archive.stats()})
+
+@tracer.traced('summarize')
 def generate_ai_summary(content, content_type="text"):
     """Generate a simple interpretive 1-line description from content"""
     if not content or len(content.strip()) == 0:
@@ -3682,7 +4566,7 @@ def generate_ai_summary(content, content_type="text"):
                 return f"Content discusses: {first_part}..."
     
     except Exception as e:
-        print(f"Summarization error: {e}")
+        logger.error("Summarization error: %s", e)
         return "Content summary unavailable."
 
 @app.route('/api/summarize_discussion/<int:discussion_id>', methods=['GET'])
@@ -3730,12 +4614,8 @@ def api_summarize_discussion(discussion_id):
         # Join all content
         full_content = ' '.join(content_parts)
         
-        # Debug logging
-        print(f"=== SUMMARIZING DISCUSSION {discussion_id} ===")
-        print(f"Title: {discussion.get('title')}")
-        print(f"Content preview: {full_content[:200] if full_content else 'EMPTY'}...")
-        print(f"Content length: {len(full_content) if full_content else 0}")
-        print(f"Number of replies: {len(replies)}")
+        tracer.annotate(discussion_id=discussion_id, is_global=is_global,
+                        content_length=len(full_content), reply_count=len(replies))
         
         # Generate overview from combined content
         summary = generate_ai_summary(full_content, "discussion")
@@ -3749,8 +4629,7 @@ def api_summarize_discussion(discussion_id):
             else:
                 summary += f" ({len(replies)} {'reply' if len(replies) == 1 else 'replies'})"
         
-        print(f"Generated summary: {summary}")
-        print("=" * 50)
+        tracer.annotate(summary_length=len(summary))
         
         return jsonify({
             'success': True,
@@ -3759,7 +4638,7 @@ def api_summarize_discussion(discussion_id):
         })
     
     except Exception as e:
-        print(f"Error summarizing discussion: {e}")
+        logger.error("Error summarizing discussion: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/summarize_resource/<int:resource_id>', methods=['GET'])
@@ -3801,7 +4680,7 @@ def api_summarize_resource(resource_id):
         })
     
     except Exception as e:
-        print(f"Error summarizing resource: {e}")
+        logger.error("Error summarizing resource: %s", e)
         return jsonify({'error': str(e)}), 500
 
 # ========================================
@@ -3809,6 +4688,7 @@ def api_summarize_resource(resource_id):
 # ========================================
 
 @app.route('/api/get_announcements', methods=['GET'])
+@conditional_get('announcements', 'users', use_session_org=True)
 def api_get_announcements():
     """Get announcements for current organization"""
     if 'user_id' not in session:
@@ -3850,7 +4730,7 @@ def api_get_announcements():
         return jsonify({'success': True, 'announcements': announcements})
     
     except Exception as e:
-        print(f"Error fetching announcements: {e}")
+        logger.error("Error fetching announcements: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/create_announcement', methods=['POST'])
@@ -3887,6 +4767,7 @@ def api_create_announcement():
         """, (title, content, org_id, user_id, priority, is_pinned))
         
         announcement_id = cursor.lastrowid
+        versions.bump(conn, org_id, 'announcements')
         conn.commit()
         conn.close()
         
@@ -3897,7 +4778,7 @@ def api_create_announcement():
         })
     
     except Exception as e:
-        print(f"Error creating announcement: {e}")
+        logger.error("Error creating announcement: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/delete_announcement/<int:announcement_id>', methods=['DELETE'])
@@ -3913,7 +4794,7 @@ def api_delete_announcement(announcement_id):
         conn = db.get_connection()
         
         # Check if user is author or admin
-        cursor = conn.execute("SELECT author_id FROM announcements WHERE id = ?", (announcement_id,))
+        cursor = conn.execute("SELECT author_id, organization_id FROM announcements WHERE id = ?", (announcement_id,))
         row = cursor.fetchone()
         
         if not row:
@@ -3927,13 +4808,14 @@ def api_delete_announcement(announcement_id):
             return jsonify({'error': 'Permission denied'}), 403
         
         conn.execute("DELETE FROM announcements WHERE id = ?", (announcement_id,))
+        versions.bump(conn, row[1], 'announcements')
         conn.commit()
         conn.close()
         
         return jsonify({'success': True, 'message': 'Announcement deleted'})
     
     except Exception as e:
-        print(f"Error deleting announcement: {e}")
+        logger.error("Error deleting announcement: %s", e)
         return jsonify({'error': str(e)}), 500
 
 # ========================================
@@ -3975,37 +4857,38 @@ def api_submit_assignment():
                 os.makedirs(submissions_dir, exist_ok=True)
                 
                 file_path = os.path.join(submissions_dir, unique_filename)
-                file.save(file_path)
+                save_upload(file, file_path)
         
         if not file_path and not content:
             return jsonify({'error': 'Either file or content is required'}), 400
         
-        conn = db.get_connection()
-        
-        # Check if submission already exists
-        cursor = conn.execute("""
-            SELECT id FROM assignment_submissions
-            WHERE assignment_id = ? AND student_id = ?
-        """, (assignment_id, user_id))
-        
-        existing = cursor.fetchone()
-        
-        if existing:
-            # Update existing submission
-            conn.execute("""
-                UPDATE assignment_submissions
-                SET file_path = ?, content = ?, submission_date = CURRENT_TIMESTAMP, status = 'submitted'
+        def save_submission(conn):
+            # Check if submission already exists
+            cursor = conn.execute("""
+                SELECT id FROM assignment_submissions
                 WHERE assignment_id = ? AND student_id = ?
-            """, (file_path, content, assignment_id, user_id))
-        else:
-            # Create new submission
-            conn.execute("""
-                INSERT INTO assignment_submissions (assignment_id, student_id, file_path, content)
-                VALUES (?, ?, ?, ?)
-            """, (assignment_id, user_id, file_path, content))
+            """, (assignment_id, user_id))
+            
+            existing = cursor.fetchone()
+            
+            if existing:
+                # Update existing submission
+                conn.execute("""
+                    UPDATE assignment_submissions
+                    SET file_path = ?, content = ?, submission_date = CURRENT_TIMESTAMP, status = 'submitted'
+                    WHERE assignment_id = ? AND student_id = ?
+                """, (file_path, content, assignment_id, user_id))
+            else:
+                # Create new submission
+                conn.execute("""
+                    INSERT INTO assignment_submissions (assignment_id, student_id, file_path, content)
+                    VALUES (?, ?, ?, ?)
+                """, (assignment_id, user_id, file_path, content))
+            versions.bump(conn, db.get_resource_organization_id(conn, assignment_id), 'assignment_submissions')
         
-        conn.commit()
-        conn.close()
+        if archive is not None:
+            archive.restore('assignment_submissions', 'assignment_id = ? AND student_id = ?', (assignment_id, user_id))
+        db.write(save_submission)
         
         return jsonify({
             'success': True,
@@ -4013,7 +4896,7 @@ def api_submit_assignment():
         })
     
     except Exception as e:
-        print(f"Error submitting assignment: {e}")
+        logger.error("Error submitting assignment: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/get_assignment_submissions/<int:assignment_id>', methods=['GET'])
@@ -4029,10 +4912,10 @@ def api_get_assignment_submissions(assignment_id):
         return jsonify({'error': 'Permission denied'}), 403
     
     try:
-        conn = db.get_connection()
-        cursor = conn.execute("""
+        conn = reports.get_connection()
+        cursor = conn.execute(f"""
             SELECT s.*, u.first_name, u.last_name, u.email
-            FROM assignment_submissions s
+            FROM {table_source(conn, 'assignment_submissions', assignment_created_at(conn, assignment_id))} s
             JOIN users u ON s.student_id = u.id
             WHERE s.assignment_id = ?
             ORDER BY s.submission_date DESC
@@ -4061,8 +4944,178 @@ def api_get_assignment_submissions(assignment_id):
         return jsonify({'success': True, 'submissions': submissions})
     
     except Exception as e:
-        print(f"Error fetching submissions: {e}")
+        logger.error("Error fetching submissions: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/grade_submissions_bulk', methods=['POST'])
+def api_grade_submissions_bulk():
+    """Grade many submissions at once: {"grades": [{"submission_id", "grade", "feedback"}, ...]} (teachers only)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    user_id = session['user_id']
+    user_type = session.get('user_type')
+    
+    if user_type not in ['teacher', 'admin']:
+        return jsonify({'error': 'Permission denied'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    items = data.get('grades')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'grades must be a non-empty list'}), 400
+    if len(items) > MAX_BULK_GRADES:
+        return jsonify({'error': f'At most {MAX_BULK_GRADES} grades per request'}), 400
+    
+    grades = []
+    try:
+        for item in items:
+            grade = item.get('grade')
+            grade = float(grade) if grade is not None else None
+            # float() accepts "NaN" and "inf"; SQLite would store NaN as NULL and silently clear the grade
+            if grade is not None and not math.isfinite(grade):
+                raise ValueError('grade must be finite')
+            grades.append((int(item['submission_id']), grade, item.get('feedback', '')))
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return jsonify({'error': 'Each grade needs an integer submission_id and a numeric grade'}), 400
+    ids = [submission_id for submission_id, _, _ in grades]
+    if len(set(ids)) != len(ids):
+        return jsonify({'error': 'Each submission can only be graded once per request'}), 400
+    
+    owner_id = user_id if user_type == 'teacher' else None
+    try:
+        if archive is not None:
+            # Check ownership across live and archived rows before moving anything back into the live table
+            conn = db.get_connection()
+            try:
+                result = db.check_submission_access(conn, ids, owner_id, source=table_source(conn, 'assignment_submissions'))
+            finally:
+                conn.close()
+            if not result['missing'] and not result['forbidden']:
+                archive.restore('assignment_submissions', f"id IN ({', '.join('?' for _ in ids)})", ids)
+                result = db.grade_submissions(grades, user_id, owner_id=owner_id)
+        else:
+            result = db.grade_submissions(grades, user_id, owner_id=owner_id)
+    except Exception as e:
+        logger.error("Error grading submissions: %s", e)
+        return jsonify({'error': str(e)}), 500
+    
+    if result.get('missing'):
+        return jsonify({'success': False, 'error': 'Submissions not found', 'missing': result['missing']}), 404
+    if result.get('forbidden'):
+        return jsonify({'success': False, 'error': 'You can only grade submissions for your own assignments',
+                        'forbidden': result['forbidden']}), 403
+    return jsonify({'success': True, 'graded': result['graded']})
+
+@app.route('/api/gradebook', methods=['GET'])
+@conditional_get('class_students', 'users', 'resources', 'assignment_submissions')
+def api_gradebook():
+    """Get a class's students x assignments gradebook with averages and grade statistics (teachers only)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    if session.get('user_type') not in ['teacher', 'admin']:
+        return jsonify({'error': 'Permission denied'}), 403
+    
+    class_id = request.args.get('class_id', type=int)
+    if not class_id:
+        return jsonify({'error': 'class_id is required'}), 400
+    
+    try:
+        conn = db.get_connection()
+        try:
+            cls = conn.execute("SELECT id, name, teacher_id FROM classes WHERE id = ?", (class_id,)).fetchone()
+        finally:
+            conn.close()
+        if cls is None:
+            return jsonify({'error': 'Class not found'}), 404
+        if session['user_type'] == 'teacher' and cls['teacher_id'] != session['user_id']:
+            return jsonify({'error': 'Permission denied'}), 403
+        
+        book = db.get_gradebook(class_id)
+        return jsonify({'success': True, 'class_id': class_id, 'class_name': cls['name'], **book})
+    
+    except Exception as e:
+        logger.error("Error building gradebook: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+SUBMISSION_FILE_PREFIX = re.compile(r'^submission_\d+_\d{8}_\d{6}_')
+
+@app.route('/api/assignment/<int:assignment_id>/submissions.zip', methods=['GET'])
+def api_download_submissions_zip(assignment_id):
+    """Download every submission of an assignment as one zip, streamed as it is built (teachers only)"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    user_id = session['user_id']
+    user_type = session.get('user_type')
+    if user_type not in ['teacher', 'admin']:
+        return jsonify({'error': 'Permission denied'}), 403
+    
+    # Live, not the reporting snapshot: the zip must hold the submissions as they are now
+    conn = db.get_connection()
+    try:
+        creator = 'created_by' if 'created_by' in conn.table_columns('resources') else 'uploaded_by'
+        assignment = conn.execute(f"""
+            SELECT r.title, r.{creator} AS author_id, c.teacher_id
+            FROM resources r
+            LEFT JOIN classes c ON r.class_id = c.id
+            WHERE r.id = ?
+        """, (assignment_id,)).fetchone()
+        if assignment is None:
+            return jsonify({'error': 'Assignment not found'}), 404
+        if user_type == 'teacher' and user_id not in (assignment['author_id'], assignment['teacher_id']):
+            return jsonify({'error': 'Permission denied'}), 403
+        # One row per student, so the list is bounded by the class size; the files are what gets streamed
+        submissions = conn.execute(f"""
+            SELECT s.student_id, u.username, u.first_name, u.last_name, s.file_path, s.content,
+                   s.submission_date, s.status, s.grade
+            FROM {table_source(conn, 'assignment_submissions', assignment_created_at(conn, assignment_id))} s
+            JOIN users u ON s.student_id = u.id
+            WHERE s.assignment_id = ?
+            ORDER BY u.last_name, u.first_name, u.id
+        """, (assignment_id,)).fetchall()
+    except Exception as e:
+        logger.error("Error listing submissions for zip: %s", e)
         return jsonify({'error': str(e)}), 500
+    finally:
+        conn.close()
+    
+    submissions_dir = os.path.realpath(os.path.join(app.config['UPLOAD_FOLDER'], 'submissions'))
+    manifest = []
+    
+    def entries():
+        for row in submissions:
+            student = secure_filename(f"{row['last_name']}_{row['first_name']}_{row['username']}") or f"student_{row['student_id']}"
+            files = []
+            if row['file_path']:
+                path = os.path.realpath(row['file_path'])
+                original = SUBMISSION_FILE_PREFIX.sub('', os.path.basename(path))
+                if path.startswith(submissions_dir + os.sep) and os.path.isfile(path):
+                    files.append(f"{student}_{original}")
+                    yield files[-1], iter_file(path)
+                else:
+                    logger.warning("Submission file missing: %s", row['file_path'])
+                    files.append(f"(missing) {original}")
+            if row['content']:
+                files.append(f"{student}_text.txt")
+                yield files[-1], [row['content'].encode('utf-8')]
+            manifest.append((row['student_id'], row['username'], row['first_name'], row['last_name'],
+                             row['submission_date'], row['status'], row['grade'], '; '.join(files)))
+        yield 'manifest.csv', iter_csv(['student_id', 'username', 'first_name', 'last_name', 'submission_date',
+                                        'status', 'grade', 'files'], manifest)
+    
+    def generate():
+        try:
+            yield from iter_zip(entries(), compress=should_deflate)
+        except Exception as e:
+            # Re-raised so the server aborts the transfer instead of ending a corrupt zip with a 200
+            logger.error("Error streaming submissions zip for assignment %s: %s", assignment_id, e)
+            raise
+    
+    filename = secure_filename(f"{assignment['title']}_submissions.zip") or f"assignment_{assignment_id}_submissions.zip"
+    response = Response(generate(), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
 
 @app.route('/api/get_my_submission/<int:assignment_id>', methods=['GET'])
 def api_get_my_submission(assignment_id):
@@ -4074,8 +5127,8 @@ def api_get_my_submission(assignment_id):
     
     try:
         conn = db.get_connection()
-        cursor = conn.execute("""
-            SELECT * FROM assignment_submissions
+        cursor = conn.execute(f"""
+            SELECT * FROM {table_source(conn, 'assignment_submissions', assignment_created_at(conn, assignment_id))}
             WHERE assignment_id = ? AND student_id = ?
         """, (assignment_id, user_id))
         
@@ -4102,7 +5155,7 @@ def api_get_my_submission(assignment_id):
         return jsonify({'success': True, 'submission': submission})
     
     except Exception as e:
-        print(f"Error fetching submission: {e}")
+        logger.error("Error fetching submission: %s", e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/grade_submission/<int:submission_id>', methods=['POST'])
@@ -4122,31 +5175,241 @@ def api_grade_submission(submission_id):
     grade = data.get('grade')
     feedback = data.get('feedback', '')
     
-    try:
-        conn = db.get_connection()
+    def grade_submission(conn):
         conn.execute("""
             UPDATE assignment_submissions
             SET grade = ?, feedback = ?, status = 'graded', graded_by = ?, graded_at = CURRENT_TIMESTAMP
             WHERE id = ?
         """, (grade, feedback, user_id, submission_id))
-        
-        conn.commit()
-        conn.close()
+        row = conn.execute("SELECT assignment_id FROM assignment_submissions WHERE id = ?", (submission_id,)).fetchone()
+        versions.bump(conn, db.get_resource_organization_id(conn, row['assignment_id']) if row else None,
+                      'assignment_submissions')
+    
+    try:
+        if archive is not None:
+            archive.restore('assignment_submissions', 'id = ?', (submission_id,))
+        db.write(grade_submission)
         
         return jsonify({'success': True, 'message': 'Submission graded successfully'})
     
     except Exception as e:
-        print(f"Error grading submission: {e}")
+        logger.error("Error grading submission: %s", e)
         return jsonify({'error': str(e)}), 500
 
+EXPORT_DATASETS = {
+    'attendance': 'Attendance',
+    'grades': 'Grades',
+    'members': 'Members',
+}
+
+def export_query(conn, dataset, organization_id, class_id=None, start_date=None, end_date=None):
+    """(columns, sql, params) for an organization's export; dates filter attendance days and submission dates"""
+    if dataset == 'attendance':
+        columns = ['date', 'student_id', 'first_name', 'last_name', 'status', 'notes', 'marked_by']
+        conditions = ["(a.organization_id = ? OR (a.organization_id IS NULL AND a.class_id IN "
+                      "(SELECT id FROM classes WHERE organization_id = ?)))"]
+        params = [organization_id, organization_id]
+        if class_id:
+            conditions.append("a.student_id IN (SELECT student_id FROM class_students WHERE class_id = ?)")
+            params.append(class_id)
+        if start_date:
+            conditions.append("a.date >= ?")
+            params.append(start_date)
+        if end_date:
+            conditions.append("a.date <= ?")
+            params.append(end_date)
+        sql = f"""
+            SELECT a.date, a.student_id, u.first_name, u.last_name, a.status, a.notes, a.marked_by
+            FROM {table_source(conn, 'attendance', start_date)} a
+            JOIN users u ON a.student_id = u.id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY a.date, u.last_name, u.first_name
+        """
+    elif dataset == 'grades':
+        columns = ['class_id', 'class_name', 'assignment_id', 'assignment', 'due_date', 'student_id', 'first_name',
+                   'last_name', 'submission_date', 'status', 'grade', 'feedback', 'graded_at']
+        conditions = ["c.organization_id = ?", "r.resource_category = 'assignment'"]
+        params = [organization_id]
+        if class_id:
+            conditions.append("c.id = ?")
+            params.append(class_id)
+        if start_date:
+            conditions.append("s.submission_date >= ?")
+            params.append(start_date)
+        if end_date:
+            conditions.append("s.submission_date < ?")
+            params.append((datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d'))
+        sql = f"""
+            SELECT c.id, c.name, r.id, r.title, r.due_date, s.student_id, u.first_name, u.last_name,
+                   s.submission_date, s.status, s.grade, s.feedback, s.graded_at
+            FROM {table_source(conn, 'assignment_submissions', start_date)} s
+            JOIN resources r ON s.assignment_id = r.id
+            JOIN classes c ON r.class_id = c.id
+            JOIN users u ON s.student_id = u.id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY c.name, c.id, r.due_date, r.id, u.last_name, u.first_name
+        """
+    else:
+        columns = ['user_id', 'username', 'first_name', 'last_name', 'email', 'user_type', 'role', 'joined_at']
+        conditions = ["om.organization_id = ?"]
+        params = [organization_id]
+        if class_id:
+            conditions.append("u.id IN (SELECT student_id FROM class_students WHERE class_id = ?)")
+            params.append(class_id)
+        sql = f"""
+            SELECT u.id, u.username, u.first_name, u.last_name, u.email, u.user_type, om.role, om.joined_at
+            FROM organization_memberships om
+            JOIN users u ON om.user_id = u.id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY u.last_name, u.first_name, u.id
+        """
+    return columns, sql, params
+
+def export_request(dataset):
+    """Validate an export request: ({organization_id, format, filters}, None) or (None, error response)"""
+    if 'user_id' not in session:
+        return None, (jsonify({'error': 'Not authenticated'}), 401)
+    if dataset not in EXPORT_DATASETS:
+        return None, (jsonify({'error': 'Unknown export'}), 404)
+    fmt = request.values.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return None, (jsonify({'error': f"format must be one of {', '.join(EXPORT_FORMATS)}"}), 400)
+    org = db.get_user_current_organization(session['user_id'])
+    if not org or org['role'] not in ['owner', 'admin', 'teacher']:
+        return None, (jsonify({'error': 'Permission denied'}), 403)
+    organization_id = org['id']
+    
+    filters = {}
+    for field in ('start_date', 'end_date'):
+        value = request.values.get(field)
+        if value:
+            try:
+                datetime.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                return None, (jsonify({'error': f'{field} must be YYYY-MM-DD'}), 400)
+            filters[field] = value
+    class_id = request.values.get('class_id', type=int)
+    if class_id:
+        conn = db.get_connection()
+        try:
+            cls = conn.execute("SELECT organization_id, teacher_id FROM classes WHERE id = ?", (class_id,)).fetchone()
+        finally:
+            conn.close()
+        if cls is None or cls['organization_id'] != organization_id:
+            return None, (jsonify({'error': 'Class not found'}), 404)
+        filters['class_id'] = class_id
+    # Teachers export their own classes; owners and admins the whole organization
+    if org['role'] == 'teacher' and (not class_id or cls['teacher_id'] != session['user_id']):
+        return None, (jsonify({'error': 'Teachers can only export their own classes (pass class_id)'}), 403)
+    return {'organization_id': organization_id, 'format': fmt, 'filters': filters}, None
+
+def export_filename(dataset, organization_id, fmt, filters):
+    """Download name like attendance_org9_class2_2025-09-01_2025-12-19.csv"""
+    parts = [dataset, f"org{organization_id}"]
+    if filters.get('class_id'):
+        parts.append(f"class{filters['class_id']}")
+    parts.append(filters.get('start_date') or 'start')
+    parts.append(filters.get('end_date') or datetime.now().strftime('%Y-%m-%d'))
+    return '_'.join(parts) + '.' + EXPORT_FORMATS[fmt][1]
+
+@app.route('/api/export/<dataset>', methods=['GET'])
+def api_export(dataset):
+    """Stream an attendance, grades or members export as CSV, NDJSON or XLSX"""
+    export, error = export_request(dataset)
+    if error:
+        return error
+    organization_id, fmt, filters = export['organization_id'], export['format'], export['filters']
+    
+    conn = reports.get_connection()
+    try:
+        columns, sql, params = export_query(conn, dataset, organization_id, **filters)
+        cursor = conn.server_cursor(sql, params)
+    except Exception as e:
+        conn.close()
+        logger.error("Error starting %s export: %s", dataset, e)
+        return jsonify({'error': str(e)}), 500
+    try:
+        # Runs the query for the first batch; stream_export closes conn if that fails
+        return stream_export(conn, cursor, columns, fmt, export_filename(dataset, organization_id, fmt, filters),
+                             title=EXPORT_DATASETS[dataset])
+    except Exception as e:
+        logger.error("Error starting %s export: %s", dataset, e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/export/<dataset>/jobs', methods=['POST'])
+def api_start_export_job(dataset):
+    """Run an export in the background; poll the returned status_url, then fetch download_url"""
+    export, error = export_request(dataset)
+    if error:
+        return error
+    organization_id, fmt, filters = export['organization_id'], export['format'], export['filters']
+    
+    def produce():
+        # Runs on the job's thread, outside any request: pin the organization's shard explicitly
+        with shards.use(organization_id) if shards is not None else contextlib.nullcontext():
+            conn = reports.get_connection()
+            try:
+                columns, sql, params = export_query(conn, dataset, organization_id, **filters)
+                cursor = conn.server_cursor(sql, params)
+                yield from iter_export(fmt, columns, iter_rows(cursor), EXPORT_DATASETS[dataset])
+            finally:
+                conn.close()
+    
+    try:
+        job = export_jobs.start(produce, user_id=session['user_id'], organization_id=organization_id, dataset=dataset,
+                                format=fmt, filters=filters,
+                                filename=export_filename(dataset, organization_id, fmt, filters))
+    except ExportLimitError as e:
+        return jsonify({'error': str(e)}), 429
+    return jsonify({'success': True, 'job': export_job_view(job)}), 202
+
+def export_job_view(job):
+    """A job's status as returned by the API, with its URLs"""
+    view = {key: job.get(key) for key in ('id', 'status', 'dataset', 'format', 'filters', 'filename', 'bytes',
+                                           'seconds', 'error', 'created_at', 'finished_at')}
+    view['status_url'] = url_for('api_export_job', job_id=job['id'])
+    if job['status'] == 'done':
+        view['download_url'] = url_for('api_download_export_job', job_id=job['id'])
+    return view
+
+def owned_export_job(job_id):
+    """The current user's export job, or None"""
+    job = export_jobs.get(job_id)
+    if job is None or 'user_id' not in session or job.get('user_id') != session['user_id']:
+        return None
+    return job
+
+@app.route('/api/export/jobs/<job_id>', methods=['GET'])
+def api_export_job(job_id):
+    """Status of a background export"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    job = owned_export_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Export not found'}), 404
+    return jsonify({'success': True, 'job': export_job_view(job)})
+
+@app.route('/api/export/jobs/<job_id>/download', methods=['GET'])
+def api_download_export_job(job_id):
+    """Download a finished background export"""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    job = owned_export_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Export not found'}), 404
+    if job['status'] != 'done':
+        return jsonify({'error': f"Export is {job['status']}"}), 409
+    return send_file(os.path.abspath(export_jobs.path(job)), mimetype=EXPORT_FORMATS[job['format']][0],
+                     as_attachment=True, download_name=job['filename'])
+
 def create_default_admin():
     """Create a default teacher user for testing"""
     try:
         db = WebDatabaseManager()
         # The default admin is already created in WebDatabaseManager.create_default_admin()
-        print("Default users initialized via WebDatabaseManager")
+        logger.info("Default users initialized via WebDatabaseManager")
     except Exception as e:
-        print(f"Error initializing default admin: {e}")
+        logger.error("Error initializing default admin: %s", e)
 
 if __name__ == '__main__':
     # Production-ready configuration